@@ -0,0 +1,81 @@
+"""
+Import time of carcosa, held to a budget.
+
+Each module is imported in a new interpreter with ``-X importtime``, and the
+best cumulative time over some runs (the first one is discarded, it may write
+the bytecode cache) is compared to its budget. The budgets are relative to
+the import of ``json``, measured the same way, so they hold on slow and fast
+machines alike. Exits with status 1 if a module is over its budget::
+
+    python benchmarks/importtime.py --runs 5 --top 10
+"""
+import argparse
+import subprocess
+import sys
+
+# Budget of each module, in multiples of the import time of the reference
+# module. Importing Pyro4 alone takes about 6 times the reference, so an
+# eager import of it (or of a backend) goes over.
+BUDGETS = {
+    'carcosa': 4.0,
+    'carcosa.cluster': 8.0,
+    }
+REFERENCE = 'json'
+
+
+def import_times(module, runs):
+    """
+    Best self and cumulative import time (microseconds) of each module
+    loaded by importing a module.
+    """
+    times = {}
+    for i in range(runs + 1):
+        out = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True
+            ).stderr
+        if i == 0:
+            continue
+        for line in out.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            own, cumulative, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            best = times.get(name, (int(own), int(cumulative)))
+            times[name] = (
+                min(best[0], int(own)), min(best[1], int(cumulative))
+                )
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10,
+                        help='slowest imports to show of each module')
+    args = parser.parse_args()
+
+    reference = import_times(REFERENCE, args.runs)[REFERENCE][1]
+    print('{}: {:.1f} ms'.format(REFERENCE, reference / 1e3))
+
+    failed = False
+    for module, budget in BUDGETS.items():
+        times = import_times(module, args.runs)
+        ratio = times[module][1] / reference
+        over = ratio > budget
+        failed = failed or over
+        print('{}: {:.1f} ms, {:.1f}x {} (budget {:.1f}x){}'.format(
+            module, times[module][1] / 1e3, ratio, REFERENCE, budget,
+            ' OVER BUDGET' if over else ''
+            ))
+        slowest = sorted(times.items(), key=lambda t: -t[1][0])[:args.top]
+        for name, (own, _) in slowest:
+            print('    {:<40} {:>8.1f} ms'.format(name, own / 1e3))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Latency of a large ``metrics`` transfer under each Pyro4 serializer.
+
+A Pyro4 daemon with a ``metrics`` method shaped like
+``SlurmServer.metrics`` is started in this process: each call parses a
+``sacct`` output into a list of tuples, returned whole (not streamed). The
+rows are fetched through a proxy using each available serializer (see
+``carcosa.config.serializer``), so the times include the parsing done in
+the server::
+
+    python benchmarks/serializers.py --rows 100000 --repeat 5
+"""
+import statistics
+import argparse
+import threading
+import time
+
+import Pyro4
+
+from carcosa.cluster.rpc import available_serializers
+
+ROW = (
+    '123456_7', 'normal', '4', '1', 'billing=4,cpu=4,mem=8G,node=1',
+    '2400000K', '1234567', '7654321', '1048576K', '0',
+    '2020-05-01T10:00:00', '2020-05-01T10:00:05', '2020-05-01T10:10:05',
+    '00:10:00'
+    )
+
+
+@Pyro4.expose
+class MetricsServer:
+    def __init__(self, rows):
+        self._stdout = '\n'.join(['|'.join(ROW)] * rows) + '\n'
+
+    def metrics(self, job_id=None):
+        return [tuple(line.split('|')) for line in self._stdout.splitlines()]
+
+
+def bench(uri, serializer, repeat):
+    proxy = Pyro4.Proxy(uri)
+    proxy._pyroSerializer = serializer
+    proxy._pyroBind()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows = proxy.metrics()
+        times.append(time.perf_counter() - t0)
+    proxy._pyroRelease()
+    return times, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    serializers = available_serializers()
+    Pyro4.config.SERIALIZERS_ACCEPTED = set(serializers)
+    daemon = Pyro4.Daemon()
+    uri = daemon.register(MetricsServer(args.rows))
+    threading.Thread(target=daemon.requestLoop, daemon=True).start()
+
+    print('{} rows, {} repetitions'.format(args.rows, args.repeat))
+    print('{:<10} {:>10} {:>10} {:>12}'.format(
+        'serializer', 'median ms', 'min ms', 'rows/s'
+        ))
+    for name in serializers:
+        times, n = bench(uri, name, args.repeat)
+        median = statistics.median(times)
+        print('{:<10} {:>10.1f} {:>10.1f} {:>12.0f}'.format(
+            name, median * 1e3, min(times) * 1e3, n / median
+            ))
+    daemon.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,23 @@
+import importlib
+import sys
+
 from .config import config
-from . import cluster
-from . import qsystems
-from . import scripts
+
+# Subpackages are loaded on first access, so ``import carcosa`` stays cheap
+# for the CLI and the job runners.
+_SUBMODULES = ('cluster', 'qsystems', 'scripts')
+
+
+def __getattr__(name: str):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name)
+        )
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ (PEP 562) is not available.
+    from . import cluster
+    from . import qsystems
+    from . import scripts
@@ -2,6 +2,10 @@ from .server import ClusterServer
 from .client import ClusterClient
 from .cluster import Cluster
 from .job import Job
+from .pipeline import Pipeline
+from .janitor import Janitor, RetentionPolicy
+from .retry import Retrier, RetryPolicy
+from .speculation import Speculator
 from .states import *
 
 from . import errors
@@ -0,0 +1,218 @@
+"""
+Aggregation of the accounting of the jobs in the server, see
+:meth:`ClusterServer.metrics_summary
+<carcosa.cluster.ClusterServer.metrics_summary>`.
+
+The rows of the accounting (``sacct``, with the fields of
+:data:`SUMMARY_FIELDS`) are parsed into one record per job, the steps are
+collapsed into their job, and the records are grouped and aggregated in a
+single pass. Only the aggregated table is sent to the client.
+"""
+from typing import Optional, Dict, List, Tuple, Any, Iterable, Sequence
+from datetime import datetime
+import logging
+
+from .stats import percentile
+from .retry import parse_walltime
+from .resources import parse_memory
+from .snapshot import parent_id
+
+# Fields of the accounting rows, in order
+SUMMARY_FIELDS = (
+    'JobID', 'JobName', 'Partition', 'State', 'AllocCPUs', 'AllocNodes',
+    'MaxRSS', 'Submit', 'Start', 'Elapsed'
+    )
+(_JOBID, _NAME, _PARTITION, _STATE, _CPUS, _NODES, _MAX_RSS, _SUBMIT,
+ _START, _ELAPSED) = range(len(SUMMARY_FIELDS))
+
+# Fields of the job records that can be grouped by
+GROUP_FIELDS = ('name', 'partition', 'state')
+# Numeric fields of the job records: seconds waiting in the queue and
+# running, allocated cpus and nodes, cpu seconds allocated (cpus by
+# elapsed), and maximum resident memory of the steps in bytes
+VALUE_FIELDS = ('wait', 'elapsed', 'cpus', 'nodes', 'cpu_time', 'max_rss')
+# Operations of the aggregates, ``pNN`` is the NN percentile
+OPERATIONS = ('sum', 'mean', 'min', 'max')
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def _timestamp(value: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(value, TIME_FORMAT)
+    except ValueError:
+        # Unknown, None...
+        return None
+
+
+def parse_jobs(rows: Iterable[Sequence[str]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Records of the jobs from the accounting rows. The memory is the maximum
+    of the steps of the job, the rest of the fields are from the row of the
+    job. Values that are not known (e.g. the wait of a pending job) are
+    None.
+
+    Returns:
+        jobs (dict): Record by job id.
+    """
+    jobs: Dict[str, Dict[str, Any]] = dict()
+    rss: Dict[str, int] = dict()
+    for row in rows:
+        if len(row) < len(SUMMARY_FIELDS) or not row[_JOBID][:1].isdigit():
+            continue
+        try:
+            job_id = parent_id(row[_JOBID])
+            rss[job_id] = max(rss.get(job_id, 0), parse_memory(row[_MAX_RSS]))
+            if job_id != row[_JOBID]:
+                continue
+
+            elapsed = parse_walltime(row[_ELAPSED])
+            cpus = int(row[_CPUS] or 0)
+            submit = _timestamp(row[_SUBMIT])
+            start = _timestamp(row[_START])
+            wait = None
+            if submit is not None and start is not None:
+                wait = max((start - submit).total_seconds(), 0.0)
+            jobs[job_id] = {
+                'name': row[_NAME],
+                'partition': row[_PARTITION],
+                'state': row[_STATE].split(' ', 1)[0].lower(),
+                'wait': wait,
+                'elapsed': elapsed,
+                'cpus': cpus,
+                'nodes': int(row[_NODES] or 0),
+                'cpu_time': elapsed * cpus,
+                }
+        except ValueError:
+            logging.warning('Invalid sacct row: {}'.format('|'.join(row)))
+
+    for job_id, job in jobs.items():
+        job['max_rss'] = rss.get(job_id, 0)
+    return jobs
+
+
+def parse_aggregates(aggregates: Sequence[str]) \
+        -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Parse the aggregates of a summary: ``count``, or ``OPERATION:FIELD``
+    with an operation of :data:`OPERATIONS` or a percentile (``p50``,
+    ``p95``...), and a field of :data:`VALUE_FIELDS`, e.g. ``mean:wait``.
+
+    Returns:
+        aggregates (list): ``(name, operation, field)``.
+
+    Raises:
+        ValueError: Invalid aggregate.
+    """
+    parsed: List[Tuple[str, str, Optional[str]]] = []
+    for name in aggregates:
+        if name == 'count':
+            parsed.append((name, name, None))
+            continue
+
+        op, _, field = name.partition(':')
+        valid_op = op in OPERATIONS
+        if op.startswith('p'):
+            try:
+                valid_op = 0 <= float(op[1:]) <= 100
+            except ValueError:
+                valid_op = False
+        if not valid_op or field not in VALUE_FIELDS:
+            e_msg = 'Invalid aggregate: {}'.format(name)
+            logging.error(e_msg)
+            raise ValueError(e_msg)
+        parsed.append((name, op, field))
+    return parsed
+
+
+def _aggregate(op: str, values: List[float]) -> Optional[float]:
+    if op == 'sum':
+        return sum(values)
+    if not values:
+        return None
+    if op == 'mean':
+        return sum(values) / len(values)
+    if op == 'min':
+        return min(values)
+    if op == 'max':
+        return max(values)
+    return percentile(values, float(op[1:]))
+
+
+def summarize(jobs: Iterable[Dict[str, Any]],
+              group_by: Sequence[str] = (),
+              filters: Optional[Dict[str, Any]] = None,
+              aggregates: Sequence[str] = ('count',)) -> List[Dict[str, Any]]:
+    """
+    Group and aggregate job records, see :func:`parse_jobs`.
+
+    Args:
+        jobs (iterable):
+            Job records.
+        group_by (list, optional):
+            Fields of :data:`GROUP_FIELDS` to group by, all the jobs in a
+            single group by default.
+        filters (dict, optional):
+            Only the jobs with the ``states`` (list), ``partitions`` (list)
+            and ``name`` (prefix) given.
+        aggregates (list, optional):
+            Aggregates of each group, see :func:`parse_aggregates`. The
+            jobs where a value is not known are left out of its aggregates.
+
+    Returns:
+        rows (list):
+            A dict per group, with the values of the ``group_by`` fields and
+            of the aggregates, sorted by the group fields.
+
+    Raises:
+        ValueError: Invalid group field, filter or aggregate.
+    """
+    unknown = set(group_by) - set(GROUP_FIELDS)
+    if unknown:
+        e_msg = 'Invalid group fields: {}'.format(unknown)
+        logging.error(e_msg)
+        raise ValueError(e_msg)
+    filters = filters or {}
+    unknown = set(filters) - {'states', 'partitions', 'name'}
+    if unknown:
+        e_msg = 'Unknown filter keys: {}'.format(unknown)
+        logging.error(e_msg)
+        raise ValueError(e_msg)
+    parsed = parse_aggregates(aggregates)
+
+    states = filters.get('states')
+    if states is not None:
+        states = set(s.lower() for s in states)
+    partitions = filters.get('partitions')
+    if partitions is not None:
+        partitions = set(partitions)
+    name = filters.get('name')
+
+    fields = set(field for _, _, field in parsed if field is not None)
+    counts: Dict[Tuple, int] = dict()
+    values: Dict[Tuple, Dict[str, List[float]]] = dict()
+    for job in jobs:
+        if states is not None and job['state'] not in states:
+            continue
+        if partitions is not None and job['partition'] not in partitions:
+            continue
+        if name is not None and not job['name'].startswith(name):
+            continue
+
+        key = tuple(job[f] for f in group_by)
+        counts[key] = counts.get(key, 0) + 1
+        group = values.setdefault(key, {f: [] for f in fields})
+        for f in fields:
+            if job[f] is not None:
+                group[f].append(job[f])
+
+    rows = []
+    for key in sorted(counts):
+        row: Dict[str, Any] = dict(zip(group_by, key))
+        for agg, op, field in parsed:
+            if field is None:
+                row[agg] = counts[key]
+            else:
+                row[agg] = _aggregate(op, values[key][field])
+        rows.append(row)
+    return rows
@@ -0,0 +1,184 @@
+"""
+Memoization of function job results. The result files are stored in a
+directory inside the job root, named after a hash of the function code, the
+globals it references and its arguments. Launching a job with the same key
+again reuses the stored result instead of submitting the job.
+"""
+from typing import Callable, Optional, Dict, Any, List, Tuple, Set
+import marshal
+import logging
+import types
+import time
+import os
+
+
+class ResultCache:
+    """
+    Cache of results in ``{root}/.carcosa-cache``. Eviction is based on the
+    last use of an entry (its modification time, refreshed on each hit).
+    """
+    DIRNAME = '.carcosa-cache'
+    RESULT_FILE = '{key}.marshal.out'
+
+    def __init__(self,
+                 root: str,
+                 max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 max_age: Optional[float] = None) -> None:
+        """
+        Args:
+            root (str):
+                Local path of the job root, the cache is created inside.
+            max_entries (int, optional):
+                Maximum number of results kept.
+            max_bytes (int, optional):
+                Maximum size of all the results, in bytes.
+            max_age (float, optional):
+                Seconds since the last use before a result is discarded.
+        """
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        os.makedirs(self.path, exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.root, self.DIRNAME)
+
+    @classmethod
+    def relpath(cls, key: str) -> str:
+        """
+        Path of the result file relative to the job root, it's the same in the
+        local and the remote host.
+        """
+        return os.path.join(cls.DIRNAME, cls.RESULT_FILE.format(key=key))
+
+    @staticmethod
+    def key(function: Callable[..., Any],
+            args: List = [],
+            kwargs: Dict = {}) -> str:
+        """
+        Hash of the function code, the globals referenced by it and its
+        arguments.
+
+        Raises:
+            ValueError:
+                The arguments can not be serialized with marshal.
+        """
+        import hashlib
+
+        h = hashlib.sha256()
+        _hash_code(h, function.__code__, function.__globals__, set())
+        h.update(marshal.dumps((tuple(args), kwargs)))
+        return h.hexdigest()
+
+    def lookup(self, key: str) -> Optional[str]:
+        """
+        Local path of the result for ``key``, or None if it's not cached or
+        it's expired.
+        """
+        path = os.path.join(self.root, self.relpath(key))
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        now = time.time()
+        if self.max_age is not None and now - st.st_mtime > self.max_age:
+            logging.info('Cached result {} expired'.format(key))
+            self._remove([path])
+            return None
+
+        os.utime(path, (now, now))
+        return path
+
+    def evict(self) -> int:
+        """
+        Remove the expired entries and then the least recently used ones
+        until the cache fits in ``max_entries`` and ``max_bytes``.
+
+        Returns:
+            removed (int): Number of removed entries.
+        """
+        entries: List[Tuple[float, int, str]] = []
+        with os.scandir(self.path) as it:
+            for e in it:
+                if not e.name.endswith('.marshal.out'):
+                    continue
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+        entries.sort()
+
+        remove: List[str] = []
+        now = time.time()
+        if self.max_age is not None:
+            while entries and now - entries[0][0] > self.max_age:
+                remove.append(entries.pop(0)[2])
+        if self.max_entries is not None:
+            while len(entries) > self.max_entries:
+                remove.append(entries.pop(0)[2])
+        if self.max_bytes is not None:
+            total = sum(e[1] for e in entries)
+            while entries and total > self.max_bytes:
+                _, size, path = entries.pop(0)
+                total -= size
+                remove.append(path)
+
+        self._remove(remove)
+        return len(remove)
+
+    def invalidate(self, key: Optional[str] = None) -> int:
+        """
+        Remove the result for ``key``, or all of them if no key is given.
+
+        Returns:
+            removed (int): Number of removed entries.
+        """
+        if key is not None:
+            paths = [os.path.join(self.root, self.relpath(key))]
+            paths = [p for p in paths if os.path.exists(p)]
+        else:
+            paths = [
+                os.path.join(self.path, f) for f in os.listdir(self.path)
+                if f.endswith('.marshal.out')
+                ]
+        self._remove(paths)
+        return len(paths)
+
+    def _remove(self, paths: List[str]) -> None:
+        for p in paths:
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+
+def _hash_code(h: Any,
+               code: types.CodeType,
+               globs: Dict[str, Any],
+               seen: Set[int]) -> None:
+    if id(code) in seen:
+        return
+    seen.add(id(code))
+    h.update(marshal.dumps(code))
+
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            _hash_code(h, c, globs, seen)
+
+    for name in code.co_names:
+        if name not in globs:
+            continue
+        val = globs[name]
+        h.update(name.encode())
+        if isinstance(val, types.FunctionType):
+            _hash_code(h, val.__code__, val.__globals__, seen)
+        elif isinstance(val, types.ModuleType):
+            h.update(val.__name__.encode())
+        else:
+            try:
+                h.update(marshal.dumps(val))
+            except ValueError:
+                h.update(repr(val).encode())
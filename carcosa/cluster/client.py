@@ -1,15 +1,31 @@
-from typing import Optional, List, Union, Callable, Dict, Iterator, Tuple, Any
+from typing import Optional, List, Union, Callable, Dict, Tuple, \
+    Iterable, Any, TYPE_CHECKING
 from random import choices
 from time import sleep
+import threading
 import string
+import time
+import marshal
 import types
 import os
-import Pyro4
 import logging
 
 from .job import Job
+from .table import JobTable, USAGE_RECORDED, REMOVED, RESOLVED
+from .states import GOOD_STATES
+from .cache import ResultCache
+from .results import ResultsLog
+from .throttle import SubmitThrottle
+from .resources import ResourceHistory, family, parse_usage
+from .errors import ClusterClientError, InlineCallError
+from .inline import encode_call, INLINE_ERROR
+from .rpc import to_bytes, client_serializer
 
-from carcosa import scripts
+from carcosa import scripts, config
+
+if TYPE_CHECKING:
+    # Pyro4 is slow to import, it's only loaded when connecting to a server.
+    import Pyro4
 
 
 class ClusterClient:
@@ -43,8 +59,46 @@ class ClusterClient:
         if not remote_path and local_path:
             self.remote_path = local_path
 
-        # Create a list of executed jobs
-        self.jobs: List[Job] = []
+        # Table of the jobs created by this client, behaves like a list of
+        # jobs.
+        self.jobs: JobTable = JobTable(self)
+
+        # Results of function jobs are memoized if a cache is set, see
+        # :meth:`enable_cache`.
+        self.result_cache: Optional[ResultCache] = None
+
+        # Payloads of the function jobs are appended to a pack per job
+        # directory, named after the session, see :meth:`pack`.
+        self.session = 'carcosa-' + ''.join(
+            choices(string.ascii_lowercase + string.digits, k=8)
+            )
+        self._packs: Dict[Tuple[str, str], scripts.Pack] = dict()
+        # Held while appending to a pack, and by the janitor while it decides
+        # to remove a pack and removes it.
+        self._packs_lock = threading.RLock()
+
+        # Results of the function jobs are appended to a shared log instead
+        # of a file per job if it's set, see :meth:`enable_results_log`.
+        self.results_log: Optional[ResultsLog] = None
+
+        # Submissions are rate limited if it's set, see
+        # :meth:`enable_throttle`.
+        self.throttle: Optional[SubmitThrottle] = None
+
+        # Options of new jobs are sized from the usage of the previous jobs
+        # of the same family if it's set, see :meth:`enable_right_sizing`.
+        self.resources: Optional[ResourceHistory] = None
+        self.auto_size = False
+
+        # Cursor of the state changes feed of the server, see
+        # :meth:`poll_changes`.
+        self._events_seq = 0
+
+        # Status of the launched jobs is refreshed on read when it's older
+        # than this, see :meth:`enable_state_cache`.
+        self.max_staleness: Optional[float] = None
+        self._refresh_lock = threading.RLock()
+        self._refreshing = False
 
     @property
     def uri(self) -> Optional[str]:
@@ -60,7 +114,7 @@ class ClusterClient:
         self._uri = val
 
     @property
-    def server(self) -> Pyro4.Proxy:
+    def server(self) -> 'Pyro4.Proxy':
         """
         Get the Pyro4 remote object
         """
@@ -111,6 +165,350 @@ class ClusterClient:
             logging.error(e_msg)
             raise ValueError(e_msg)
 
+    def enable_cache(self,
+                     max_entries: Optional[int] = None,
+                     max_bytes: Optional[int] = None,
+                     max_age: Optional[float] = None) -> ResultCache:
+        """
+        Memoize the results of the function jobs launched from this client.
+        A job whose function code, referenced globals and arguments match a
+        stored result is not submitted, the stored result is used instead.
+
+        The results are stored in the local path of the client, so it must be
+        set.
+
+        Args:
+            max_entries (int, optional):
+                Maximum number of stored results.
+            max_bytes (int, optional):
+                Maximum size of the stored results, in bytes.
+            max_age (float, optional):
+                Seconds since its last use before a result is discarded.
+
+        Returns:
+            ResultCache: The cache, it can be used to evict or invalidate
+            results.
+        """
+        if not self.local_path:
+            e_msg = 'Local path must be set to enable the result cache.'
+            logging.error(e_msg)
+            raise ValueError(e_msg)
+
+        self.result_cache = ResultCache(
+            self.local_path,
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            max_age=max_age
+            )
+        self.result_cache.evict()
+        return self.result_cache
+
+    def enable_results_log(self) -> ResultsLog:
+        """
+        Write the results of the function jobs launched from now on to a
+        results log in the client paths, instead of a result file per job.
+        Each node appends to its own shard of the log, and the results are
+        read with a seek (:py:attr:`Job.retval`) or a sequential scan
+        (:meth:`collect`).
+
+        Jobs in other paths, jobs whose results are cached and profiled jobs
+        still write a result file.
+
+        Returns:
+            ResultsLog: The log of this session.
+        """
+        if not self.local_path or not self.remote_path:
+            e_msg = 'Local and remote paths must be set to use a results log.'
+            logging.error(e_msg)
+            raise ValueError(e_msg)
+
+        if self.results_log is None:
+            self.results_log = ResultsLog(
+                self.session, self.local_path, self.remote_path
+                )
+        return self.results_log
+
+    def enable_throttle(self,
+                        rate: float = 1.0,
+                        burst: int = 10,
+                        max_queued: Optional[int] = None,
+                        refresh: float = 30.0) -> SubmitThrottle:
+        """
+        Rate limit the submissions of this client, and keep the number of
+        jobs in the queue under the submit limit of the queue system (given,
+        or learned when a submission is refused). Launched jobs that can't
+        be submitted yet are held (:py:attr:`Job.backlogged`), and submitted
+        by :meth:`SubmitThrottle.pump
+        <carcosa.cluster.throttle.SubmitThrottle.pump>`, which is called on
+        each launch or periodically if the throttle is started.
+
+        Pipeline stages that depend on a held job are submitted by calling
+        :meth:`Pipeline.submit <carcosa.cluster.Pipeline.submit>` again.
+
+        Args:
+            rate (float, optional):
+                Submissions per second.
+            burst (int, optional):
+                Submissions that can be done at once.
+            max_queued (int, optional):
+                Maximum number of jobs in the queue, learned if not set.
+            refresh (float, optional):
+                Seconds between queries of the number of queued jobs.
+
+        Returns:
+            SubmitThrottle: The throttle.
+        """
+        self.throttle = SubmitThrottle(
+            self, rate=rate, burst=burst, max_queued=max_queued,
+            refresh=refresh
+            )
+        return self.throttle
+
+    def enable_right_sizing(self,
+                            auto: bool = False,
+                            quantile: float = 95,
+                            headroom: float = 1.2,
+                            min_samples: int = 3,
+                            path: Optional[str] = None) -> ResourceHistory:
+        """
+        Size the ``time``, ``memory`` and ``cpus_per_task`` options of the
+        new jobs from the usage of the finished jobs of the same family (the
+        same function, or the same job name for commands). The usage of the
+        jobs is added to the history by :meth:`record_usage`.
+
+        Args:
+            auto (bool, optional):
+                Set the suggested options in the new jobs, the options passed
+                explicitly are kept. If it's not set the suggestions are only
+                logged, and can be queried with :meth:`suggest_options`.
+            quantile (float, optional):
+                Percentile (0-100) of the usage used for the suggestions.
+            headroom (float, optional):
+                Multiplier of the percentile.
+            min_samples (int, optional):
+                Finished jobs of a family needed to suggest options.
+            path (str, optional):
+                Directory of the history, ``config.path`` by default.
+
+        Returns:
+            ResourceHistory: The history.
+        """
+        self.resources = ResourceHistory(
+            path=path, quantile=quantile, headroom=headroom,
+            min_samples=min_samples
+            )
+        self.auto_size = auto
+        return self.resources
+
+    def enable_state_cache(self, max_staleness: Optional[float] = 30.0) \
+            -> None:
+        """
+        Refresh the status of the launched jobs when it's read and it's older
+        than ``max_staleness`` seconds, so reading :py:attr:`Job.status
+        <carcosa.cluster.Job.status>`, ``finished`` or ``running`` in a loop
+        doesn't need explicit updates. A refresh updates all the unfinished
+        jobs of the client at once (see :meth:`refresh_states`), and the
+        reads of other jobs within ``max_staleness`` use the cached status.
+        The staleness can be set for each job, see :py:attr:`Job.max_staleness
+        <carcosa.cluster.Job.max_staleness>`.
+
+        Args:
+            max_staleness (float, optional):
+                Seconds, None disables the refresh on read.
+        """
+        self.max_staleness = max_staleness
+
+    def suggest_options(self,
+                        f: Union[Callable, str],
+                        jobname: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Options suggested for a new job from the resource history, empty if
+        right sizing is not enabled or there is not enough history.
+        """
+        if self.resources is None:
+            return dict()
+        return self.resources.suggest(family(f, jobname))
+
+    def record_usage(self, jobs: Optional[List[Job]] = None) -> int:
+        """
+        Add the usage of the jobs that completed to the resource history,
+        querying the accounting of the queue system once. The usage is also
+        stored in :py:attr:`Job.metrics`. Jobs are recorded only once.
+
+        Args:
+            jobs (list, optional):
+                Jobs to record, all the jobs of the client by default.
+
+        Returns:
+            recorded (int): Number of recorded jobs.
+        """
+        if self.resources is None:
+            e_msg = 'Right sizing must be enabled to record the usage.'
+            logging.error(e_msg)
+            raise ValueError(e_msg)
+
+        if jobs is None:
+            jobs = list(self.jobs)
+        jobs = [
+            j for j in jobs
+            if j.launched and j.id and j.status in GOOD_STATES and
+            not j._flag(USAGE_RECORDED)
+            ]
+        if not jobs:
+            return 0
+
+        # Array tasks are accounted under the id of the array job.
+        ids = sorted(set(str(j.id).split('_')[0] for j in jobs))
+        usage = parse_usage(self.metrics(','.join(ids)))
+
+        samples: Dict[str, List[Tuple[int, int, int]]] = dict()
+        for j in jobs:
+            u = usage.get(str(j.id))
+            if u is None:
+                continue
+            j.metrics.update(zip(('elapsed', 'max_rss', 'alloc_cpus'), u))
+            samples.setdefault(
+                family(j.f, j.options.get('jname')), []
+                ).append(u)
+            j._set_flag(USAGE_RECORDED, True)
+
+        self.resources.record(samples)
+        return sum(len(v) for v in samples.values())
+
+    def _sized(self,
+               f: Union[Callable, str],
+               options: Dict,
+               jobname: Optional[str]) -> Dict:
+        """
+        Options of a new job, with the suggested ones if right sizing is
+        enabled.
+        """
+        options = dict(options)
+        suggested = self.suggest_options(f, options.get('jname', jobname))
+        if not suggested:
+            return options
+        if self.auto_size:
+            return dict(suggested, **options)
+        logging.info('Suggested options for {}: {}'.format(
+            family(f, options.get('jname', jobname)), suggested
+            ))
+        return options
+
+    def _launch(self,
+                script: scripts.Script,
+                jobs: List[Job],
+                array: bool = False,
+                args: Optional[List[str]] = None) -> bool:
+        """
+        Submit the generated script of a job, or of the tasks of an array
+        job, through the throttle if it's enabled.
+
+        Args:
+            args (list, optional):
+                Options for the queue system that override the ones in the
+                script.
+
+        Returns:
+            submitted (bool):
+                False if the submission is held (the jobs are backlogged) or
+                the queue system didn't return a job id.
+        """
+        if self.throttle is not None:
+            return self.throttle.submit(script, jobs, array, args)
+        return self._assign(jobs, self.submit(script, args), array)
+
+    def _assign(self,
+                jobs: List[Job],
+                job_id: Optional[str],
+                array: bool) -> bool:
+        """
+        Set the id returned by the queue system to submitted jobs. The tasks
+        of an array job keep their task number if they had one (a
+        resubmitted task). Submitted jobs are not finished anymore, and
+        their new files must be kept by the janitor. The jobs are left as
+        they were if there's no id.
+
+        Returns:
+            submitted (bool): False if there's no id.
+        """
+        if not job_id:
+            logging.error('Job {} was not submitted'.format(
+                jobs[0].script.batch if array else jobs[0].script.name
+                ))
+            return False
+
+        table = self.jobs
+        for i, job in enumerate(jobs):
+            row = job._row
+            if array:
+                task = table.tasks[row]
+                job.id = '{}_{}'.format(job_id, task if task >= 0 else i)
+            else:
+                job.id = job_id
+            job.status = job.INIT_STATUS
+            table.flags[row] &= ~(REMOVED | RESOLVED)
+            # Steps are resubmitted to the queue.
+            if table.extra[row]:
+                table.extra[row].pop('allocation', None)
+                table.extra[row].pop('step', None)
+            job.launched = True
+        logging.info('Job launched with id {}{}'.format(
+            job_id, ' ({} tasks)'.format(len(jobs)) if array else ''
+            ))
+        return True
+
+    def collect(self, jobs: Optional[List[Job]] = None) -> List[Any]:
+        """
+        Results of several jobs. The results in the results log are read
+        with a single sequential scan of the log, the rest from their result
+        files.
+
+        Args:
+            jobs (list, optional):
+                Jobs to get the results of, all the jobs of the client by
+                default.
+
+        Returns:
+            list:
+                Result of each job, None for the jobs that have not finished.
+                Exceptions raised by the jobs are returned, not raised.
+        """
+        if jobs is None:
+            jobs = list(self.jobs)
+
+        payloads: Dict[str, bytes] = dict()
+        if self.results_log is not None:
+            keys = {j.script.out_file for j in jobs if j.finished}
+            payloads = dict(self.results_log.items(keys))
+
+        results: List[Any] = []
+        for j in jobs:
+            if not j.finished:
+                results.append(None)
+                continue
+            payload = payloads.get(j.script.out_file)
+            try:
+                if payload is not None:
+                    results.append(j._decode_result(payload))
+                else:
+                    results.append(j.retval)
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def pack(self, script: scripts.Script) -> scripts.Pack:
+        """
+        Pack of this session for the directory of a job script.
+        """
+        key = (script.local_path, script.remote_path)
+        pack = self._packs.get(key)
+        if pack is None:
+            pack = scripts.Pack(
+                self.session, script.local_path, script.remote_path
+                )
+            self._packs[key] = pack
+        return pack
+
     def disconnect(self) -> None:
         if self.server:
             self.server._pyroRelease()
@@ -123,7 +521,8 @@ class ClusterClient:
 
     def new_job(self, f: Union[Callable, str],
                 options: Dict = {},
-                jobname: Optional[str] = None) -> Job:
+                jobname: Optional[str] = None,
+                profile: bool = False) -> Job:
         """
         Get a Job for the function or command passed.
 
@@ -133,6 +532,7 @@ class ClusterClient:
         - ``error`` (str): File where the stderr will be saved.
         - ``jname`` (str): Job for the name (if different from the name in the :class:`~carcosa.scripts.Script` object).
         - ``time`` (str): Walltime, in format ``DD-HH:MM:SS``.
+        - ``memory`` (str): Memory per node, e.g. ``4G``.
         - ``queue`` (str): Queue to launch the job (``--qos``).
         - ``workdir`` (str): Workdir of the job, if different from remote_path.
         - ``nodes`` (int): Number of nodes to use.
@@ -140,6 +540,7 @@ class ClusterClient:
         - ``cpus_per_task`` (int): Self explainatory.
         - ``tasks_per_node`` (int): Self explainatory.
         - ``exclusive`` (bool): Use the nodes in exclusive mode.
+        - ``dependency`` (str): Jobs that must finish before this one starts, e.g. ``afterok:123:124``. See :class:`~carcosa.cluster.Pipeline`.
 
 
         Args:
@@ -150,6 +551,9 @@ class ClusterClient:
                 Options for sbatch, see queue system client.
             jobname (str, optional):
                 Job of the name
+            profile (bool, optional):
+                Run the function under cProfile and tracemalloc, the results
+                are available through :py:attr:`Job.profile`.
 
         Returns:
             Job: New job created.
@@ -166,6 +570,8 @@ class ClusterClient:
                 'Job work must be a python function or a cmd string'
                 )
 
+        options = self._sized(f, options, jobname)
+
         if not self.local_path or not self.remote_path:
             logging.warning(
                 'Local or remote path not set in client, if it\'s not set for '
@@ -173,13 +579,104 @@ class ClusterClient:
                 )
 
         script = scripts.Script(jobname, self.local_path, self.remote_path)
-        j = Job(f, script, options, self)
+        # The job is added to self.jobs. Options are already a copy, as the
+        # job adds its defaults to them.
+        return Job(f, script, options, self, profile=profile)
+
+    def map(self,
+            f: Callable,
+            iterable: Iterable,
+            kwargs: Dict = {},
+            options: Dict = {},
+            jobname: Optional[str] = None,
+            max_running: Optional[int] = None) -> List[Job]:
+        """
+        Call a function with each item of an iterable, as the tasks of a
+        single array job. All the tasks share the same submission script,
+        payload pack, and stdout and stderr files (appended by the tasks), so
+        the number of files doesn't grow with the number of tasks, apart from
+        a result file per task.
+
+        Args:
+            f (types.FunctionType):
+                Function to call, with an item as the only positional
+                argument.
+            iterable (iterable):
+                Items to call the function with.
+            kwargs (dict, optional):
+                Keyword arguments passed to every call.
+            options (dict, optional):
+                Options for the array job, see :meth:`new_job`.
+            jobname (str, optional):
+                Name of the array job, task ``i`` is named ``{jobname}_{i}``.
+            max_running (int, optional):
+                Maximum number of tasks running at the same time.
+
+        Returns:
+            list: A :class:`Job` per item, already launched (or held, if the
+            submissions are throttled).
 
-        self.jobs.append(j)
+        Raises:
+            ValueError:
+                The paths of the client are not set, or marshal can not
+                serialize the arguments.
+            ClusterClientError:
+                The array job could not be submitted.
+        """
+        if not isinstance(f, types.FunctionType):
+            raise TypeError(
+                'A function must be passed, not {}'.format(type(f))
+                )
 
-        return j
+        if not self.local_path or not self.remote_path:
+            e_msg = 'Local and remote paths must be set to map a function.'
+            logging.error(e_msg)
+            raise ValueError(e_msg)
 
-    def launch_job(job: Optional[Job] = None,
+        if not jobname:
+            jobname = ''.join(
+                choices(string.ascii_uppercase + string.digits, k=6)
+                )
+
+        calls = [((item,), kwargs) for item in iterable]
+        if not calls:
+            return []
+
+        # All the tasks share the options dict.
+        options = self._sized(f, options, jobname)
+        options.setdefault('jname', jobname)
+        options.setdefault('output', jobname + '.out')
+        options.setdefault('error', jobname + '.err')
+        options.setdefault('workdir', self.remote_path)
+        options['open_mode'] = 'append'
+        options['array'] = '0-{}'.format(len(calls) - 1)
+        if max_running:
+            options['array'] += '%{}'.format(max_running)
+
+        script = scripts.Script(jobname, self.local_path, self.remote_path)
+        if not self.gen_array_scripts(script, options, f, calls):
+            e_msg = 'Can not generate the scripts of {}'.format(jobname)
+            logging.error(e_msg)
+            raise ValueError(e_msg)
+
+        jobs = [
+            Job(f, scripts.Script(
+                '{}_{}'.format(jobname, i),
+                self.local_path,
+                self.remote_path,
+                batch=jobname
+                ), options, self)
+            for i in range(len(calls))
+            ]
+
+        submitted = self._launch(script, jobs, array=True)
+        if not submitted and not jobs[0].backlogged:
+            e_msg = 'Array job {} was not submitted'.format(jobname)
+            raise ClusterClientError(e_msg)
+        return jobs
+
+    def launch_job(self,
+                   job: Optional[Job] = None,
                    args: List = [],
                    kwargs: Dict = {},
                    retries: int = 3) -> Job:
@@ -198,8 +695,10 @@ class ClusterClient:
                 Keyword arguments for the job, if the job will execute a python
                 function.
             retries (int, optional):
-                Number of times that the Job will be resubmitted in case of
-                error.
+                Number of times that the launch is tried again if the
+                connection with the server is lost. See
+                :class:`~carcosa.cluster.retry.Retrier` to resubmit the jobs
+                that fail in the queue system.
 
         Returns:
             Job: The job launched.
@@ -212,6 +711,8 @@ class ClusterClient:
             ConnectionError:
                 The connection with the remote server
         """
+        import Pyro4
+
         if not job:
             if len(self.jobs) > 0:
                 job = self.jobs[-1]
@@ -255,7 +756,7 @@ class ClusterClient:
                 raise e
             else:
                 # Relaunch the job if possible
-                self.launch_job(job, args, kwargs, retries)
+                return self.launch_job(job, args, kwargs, retries)
 
         except Pyro4.errors.ConnectionClosedError:
             logging.error(
@@ -264,9 +765,9 @@ class ClusterClient:
             # TODO: call disconnect ?
             # TODO: async time wait ?
             # Wait some time (arbitrary), reset the server and try to reconnect
-            time.sleep(1)
+            sleep(1)
             self._server = None
-            if self.retries > 0:
+            if retries > 0:
                 logging.warning(
                     'Could not start the job due to a connection error, '
                     'retying ({})'.format(retries))
@@ -278,16 +779,33 @@ class ClusterClient:
                 'Con not connect to the remote server to launch the job'
                 )
 
-    def _get_server(self, retries: int = 3) -> Optional[Pyro4.Proxy]:
+    def _get_server(self, retries: int = 3) -> Optional['Pyro4.Proxy']:
+        import Pyro4
+        from .errors import register_pyro_errors
+
         if not self.uri:
             raise ValueError('Can not connect if URI is not defined.')
 
+        register_pyro_errors()
+
         s = Pyro4.Proxy(self.uri)
+        s._pyroSerializer = client_serializer()
         for i in range(retries + 1):
             try:
                 s._pyroBind()
                 break
-            except Pyro4.errors.CommunicationError:
+            except Pyro4.errors.CommunicationError as e:
+                # Servers started before the serializer was configured may
+                # not accept it.
+                if ('serializer' in str(e) and
+                        s._pyroSerializer != config.DEFAULT_SERIALIZER):
+                    logging.warning(
+                        'Server does not accept {}, using {}'.format(
+                            s._pyroSerializer, config.DEFAULT_SERIALIZER
+                            )
+                        )
+                    s._pyroSerializer = config.DEFAULT_SERIALIZER
+                    continue
                 logging.warning(
                     'Can not bind server ({}/{})'.format(i, retries)
                     )
@@ -298,9 +816,176 @@ class ClusterClient:
 
         return s
 
-    def metrics(self, job_id: int = None) -> Iterator[Tuple[str, ...]]:
+    def run_inline(self,
+                   f: Callable,
+                   args: List = [],
+                   kwargs: Dict = {}) -> Any:
+        """
+        Call a function in the server host and return its result, without
+        submitting a job. It's meant for small tasks, like checking a file
+        or aggregating results in the remote path; the call runs with CPU
+        time and memory limits, see
+        :meth:`ClusterServer.run_inline
+        <carcosa.cluster.ClusterServer.run_inline>`. As in the function
+        jobs, the function must import the modules it uses.
+
+        Raises:
+            ValueError:
+                marshal can not serialize the arguments.
+            InlineCallError:
+                The function raised an exception, or marshal can not
+                serialize its result.
+            ClusterServerError:
+                The call was refused, timed out or reached a limit.
+        """
+        if not isinstance(f, types.FunctionType):
+            raise TypeError(
+                'A function must be passed, not {}'.format(type(f))
+                )
+        try:
+            payload = encode_call(f, args, kwargs)
+        except ValueError as e:
+            e_msg = 'Can not serialize the call: {}'.format(e)
+            logging.error(e_msg)
+            raise ValueError(e_msg)
+
+        status, value = marshal.loads(
+            to_bytes(self.server.run_inline(payload))
+            )
+        if status == INLINE_ERROR:
+            raise InlineCallError(value)
+        return value
+
+    def metrics(self,
+                job_id: Optional[Union[int, str]] = None) \
+            -> List[Tuple[str, ...]]:
         return self.server.metrics(job_id=job_id)
 
+    def metrics_summary(self,
+                        group_by: List[str] = [],
+                        filters: Optional[Dict[str, Any]] = None,
+                        aggregates: List[str] = ['count'],
+                        since: Optional[str] = None,
+                        until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Aggregated accounting of the jobs, computed by the server, e.g. the
+        mean and 95 percentile of the wait per partition in the last week::
+
+            client.metrics_summary(
+                ['partition'], aggregates=['count', 'mean:wait', 'p95:wait'],
+                since='now-7days'
+                )
+
+        See :meth:`ClusterServer.metrics_summary
+        <carcosa.cluster.ClusterServer.metrics_summary>`.
+        """
+        return self.server.metrics_summary(
+            list(group_by), filters, list(aggregates), since, until
+            )
+
+    def changes_since(self,
+                      seq: int = 0,
+                      job_filter: Optional[Dict[str, Any]] = None) \
+            -> Dict[str, Any]:
+        """
+        State changes of the jobs in the queue system after a sequence
+        number, see :meth:`ClusterServer.changes_since
+        <carcosa.cluster.ClusterServer.changes_since>`.
+        """
+        return self.server.changes_since(seq, job_filter)
+
+    def poll_changes(self) -> int:
+        """
+        Update the status of the jobs of this client from the state changes
+        feed of the server. Only the jobs that changed state since the
+        previous poll are transferred, instead of the state of every job.
+        Jobs of the allocations are not in the feed, see
+        :meth:`update_steps`, and the tasks finished by a copy of a
+        :class:`~carcosa.cluster.speculation.Speculator` keep their status.
+
+        Returns:
+            updated (int): Number of jobs of this client updated.
+        """
+        feed = self.changes_since(self._events_seq)
+        if feed['reset']:
+            logging.warning(
+                'State changes after {} were dropped by the server, using '
+                'the current states'.format(self._events_seq)
+                )
+
+        updated = 0
+        for _, job_id, state in feed['changes']:
+            row = self.jobs.find(job_id)
+            if row is None or self.jobs.flags[row] & RESOLVED:
+                continue
+            self.jobs.set_state(row, state)
+            updated += 1
+        self._events_seq = feed['seq']
+        return updated
+
+    def refresh_states(self) -> int:
+        """
+        Refresh the status of all the launched unfinished jobs of the client
+        with a single poll of the state changes feed (see
+        :meth:`poll_changes`), and a single query per allocation for the jobs
+        run as steps (see :meth:`update_steps`).
+
+        Returns:
+            updated (int): Number of jobs that changed status.
+        """
+        table = self.jobs
+        now = time.time()
+        rows = [
+            job._row for job in table.unfinished() if job.launched
+            ]
+        allocations = set(
+            table.extra[row]['allocation'] for row in rows
+            if (table.extra[row] or {}).get('allocation') is not None
+            )
+
+        with self._refresh_lock:
+            self._refreshing = True
+            try:
+                updated = self.poll_changes()
+                for allocation in allocations:
+                    self.update_steps(allocation)
+            finally:
+                self._refreshing = False
+                # Also on errors, so the next refresh waits as well
+                for row in rows:
+                    table.checked[row] = max(table.checked[row], now)
+        return updated
+
+    def _refresh_stale(self, row: int, staleness: float) -> None:
+        """
+        Refresh the states when the status of a job is read and it's
+        stale. Concurrent reads wait for a single refresh.
+        """
+        with self._refresh_lock:
+            # Status read during the refresh, or already refreshed by
+            # another thread
+            if self._refreshing or \
+                    time.time() - self.jobs.checked[row] <= staleness:
+                return
+            try:
+                self.refresh_states()
+            except Exception as e:
+                # Cached status is used until the next refresh
+                logging.warning('Can not refresh the job states: {}'.format(e))
+
+    def cancel(self, job_filter: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Cancel all the jobs in the queue system that match a filter, e.g.
+        ``{'name': 'sweep42', 'states': ['pending']}``. The filter is
+        resolved by the server, see the ``cancel`` method of the queue system
+        server for the available keys.
+
+        Returns:
+            counts (dict):
+                Number of ``matched``, ``cancelled`` and ``failed`` jobs.
+        """
+        return self.server.cancel(job_filter)
+
     # Pure virtual functions (to be implemented by the queue system subclasses)
 
     def gen_scripts(self,
@@ -309,8 +994,32 @@ class ClusterClient:
                     function: Optional[Callable[..., Any]] = None,
                     args: Optional[Tuple] = None,
                     kwargs: Optional[Dict] = None,
-                    cmd: Optional[str] = None) -> bool:
+                    cmd: Optional[str] = None,
+                    profile: bool = False) -> bool:
+        raise NotImplementedError('This must be implemented in any subclass')
+
+    def gen_array_scripts(self,
+                          script: scripts.Script,
+                          options: Dict,
+                          function: Callable[..., Any],
+                          calls: List[Tuple[Tuple, Dict]]) -> bool:
+        raise NotImplementedError('This must be implemented in any subclass')
+
+    def submit(self,
+               script: scripts.Script,
+               args: Optional[List[str]] = None) -> str:
+        raise NotImplementedError('This must be implemented in any subclass')
+
+    def allocate(self, options: Dict = {}) -> Optional[str]:
+        raise NotImplementedError('This must be implemented in any subclass')
+
+    def run_step(self, job: Job, allocation: str) -> None:
+        raise NotImplementedError('This must be implemented in any subclass')
+
+    def update_steps(self,
+                     allocation: str,
+                     jobs: Optional[List[Job]] = None) -> None:
         raise NotImplementedError('This must be implemented in any subclass')
 
-    def submit(self, script: scripts.Script) -> str:
+    def release(self, allocation: str) -> bool:
         raise NotImplementedError('This must be implemented in any subclass')
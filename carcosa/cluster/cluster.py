@@ -25,6 +25,11 @@ class Cluster():
         c, s = (None, None)
         if qsystem:
             c, s = qsystems.get_queue_system(qsystem)
+            if not uri:
+                # Reuse a running server for this queue system, if any.
+                entry = s.registry.lookup(qsystem)
+                if entry is not None:
+                    uri = entry['uri']
         elif uri:
             tmpc = ClusterClient(uri)
             server = tmpc.server
@@ -44,7 +49,8 @@ class Cluster():
             logging.error(e_msg)
             raise ValueError(e_msg)
 
-        c.uri = uri
+        if uri:
+            c.uri = uri
         return cls(c, s, qsystem)
 
     @property
@@ -1,6 +1,42 @@
+from typing import Any
+
+
 class ClusterServerError(Exception):
     pass
 
 
 class ClusterClientError(Exception):
     pass
+
+
+class SubmitLimitError(ClusterServerError):
+    """
+    The queue system refused a submission because a limit of submitted jobs
+    (e.g. ``MaxSubmitJobs`` in slurm) was reached.
+    """
+    pass
+
+
+class InlineCallError(ClusterClientError):
+    """
+    A function run inline in the server raised an exception, see
+    :meth:`ClusterClient.run_inline
+    <carcosa.cluster.ClusterClient.run_inline>`.
+    """
+    pass
+
+
+def register_pyro_errors() -> None:
+    """
+    Let Pyro4 rebuild the carcosa exceptions raised by a server, instead of
+    failing to deserialize them.
+    """
+    import Pyro4.util
+
+    def rebuild(cls: type) -> Any:
+        return lambda classname, d: cls(*d.get('args', ()))
+
+    for cls in (ClusterServerError, ClusterClientError, SubmitLimitError):
+        Pyro4.util.SerializerBase.register_dict_to_class(
+            '{}.{}'.format(cls.__module__, cls.__name__), rebuild(cls)
+            )
@@ -0,0 +1,153 @@
+"""
+Feed of the state changes of the jobs in the queue system.
+
+A server keeps the last state seen for each job, and appends an event with
+an increasing sequence number every time a job shows up or changes state.
+Clients ask for the changes after the last sequence number they've seen (see
+:meth:`ClusterServer.changes_since
+<carcosa.cluster.ClusterServer.changes_since>`), so a poll only transfers
+the jobs that moved since the previous one.
+"""
+from typing import Optional, Dict, List, Tuple, Any, Deque, Callable
+from collections import deque
+import threading
+import logging
+
+from .states import DONE_STATES
+
+# Event: (sequence number, job id, job name, state)
+Event = Tuple[int, str, str, str]
+
+
+def job_matcher(job_filter: Optional[Dict[str, Any]]) \
+        -> Callable[[str, str, str], bool]:
+    """
+    Predicate ``(job_id, name, state)`` of a job filter. All the given keys
+    must match:
+
+    - ``ids``: list of job ids.
+    - ``name``: prefix of the job name.
+    - ``states``: list of states (e.g. ``['pending']``).
+
+    Raises:
+        ValueError: Unknown keys in the filter.
+    """
+    job_filter = job_filter or {}
+    unknown = set(job_filter) - {'ids', 'name', 'states'}
+    if unknown:
+        raise ValueError('Unknown filter keys: {}'.format(unknown))
+
+    ids = job_filter.get('ids')
+    if ids is not None:
+        ids = set(str(i) for i in ids)
+    name = job_filter.get('name')
+    states = job_filter.get('states')
+    if states is not None:
+        states = set(s.lower() for s in states)
+
+    def match(job_id: str, job_name: str, state: str) -> bool:
+        if ids is not None and job_id not in ids:
+            return False
+        if name is not None and not job_name.startswith(name):
+            return False
+        if states is not None and state.lower() not in states:
+            return False
+        return True
+
+    return match
+
+
+class EventLog:
+    """
+    Last state of each job and the bounded sequence of state changes.
+    """
+    def __init__(self, max_events: int = 100000) -> None:
+        """
+        Args:
+            max_events (int, optional):
+                Events kept. Clients whose cursor is older than the oldest
+                kept event are told to reset, see :meth:`since`.
+        """
+        self.seq = 0
+        self._events: Deque[Event] = deque(maxlen=max_events)
+        # (state, name, sequence number of its last event) by job id
+        self._states: Dict[str, Tuple[str, str, int]] = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, jobs: Dict[str, Tuple[str, str]]) -> int:
+        """
+        Record the states of a snapshot of the queue. The finished jobs that
+        left the queue system, and whose events are not kept anymore, are
+        forgotten.
+
+        Args:
+            jobs (dict): State and name of the jobs, by job id.
+
+        Returns:
+            changes (int): Number of new events.
+        """
+        changes = 0
+        with self._lock:
+            for job_id, (state, name) in jobs.items():
+                state = state.lower()
+                if self._states.get(job_id, ('',))[0] == state:
+                    continue
+                self.seq += 1
+                self._states[job_id] = (state, name, self.seq)
+                self._events.append((self.seq, job_id, name, state))
+                changes += 1
+
+            if len(self._states) > len(jobs):
+                first = self._events[0][0] if self._events else self.seq + 1
+                for job_id in [
+                        j for j, (state, _, seq) in self._states.items()
+                        if seq < first and state in DONE_STATES and
+                        j not in jobs
+                        ]:
+                    del self._states[job_id]
+        if changes:
+            logging.info('{} job state changes'.format(changes))
+        return changes
+
+    def since(self,
+              seq: int,
+              job_filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Changes after a sequence number.
+
+        Args:
+            seq (int):
+                Last sequence number seen by the client, 0 for all the kept
+                changes.
+            job_filter (dict, optional):
+                Only the changes of the matching jobs, see
+                :func:`job_matcher`.
+
+        Returns:
+            dict:
+                ``seq``: the new cursor, ``changes``: list of
+                ``(seq, job_id, state)``, and ``reset``: True if changes
+                after ``seq`` have been dropped, or ``seq`` is ahead of the
+                log (e.g. the server was restarted). In that case the
+                changes are the current state of all the known jobs
+                instead.
+        """
+        match = job_matcher(job_filter)
+        with self._lock:
+            first = self._events[0][0] if self._events else self.seq + 1
+            changes: List[Tuple[int, str, str]] = []
+            if seq > self.seq or (seq + 1 < first and seq < self.seq):
+                for job_id, (state, name, _) in self._states.items():
+                    if match(job_id, name, state):
+                        changes.append((self.seq, job_id, state))
+                return {'seq': self.seq, 'changes': changes, 'reset': True}
+
+            # Events are in order, scan from the newest.
+            for event in reversed(self._events):
+                if event[0] <= seq:
+                    break
+                e_seq, job_id, name, state = event
+                if match(job_id, name, state):
+                    changes.append((e_seq, job_id, state))
+            changes.reverse()
+            return {'seq': self.seq, 'changes': changes, 'reset': False}
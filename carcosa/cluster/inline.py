@@ -0,0 +1,183 @@
+"""
+Inline execution of small functions in the server host, see
+:meth:`ClusterServer.run_inline <carcosa.cluster.ClusterServer.run_inline>`.
+
+The functions run in a bounded pool of worker processes, each one with a
+memory limit (``RLIMIT_AS``) and a CPU time limit per call (``RLIMIT_CPU``),
+so a runaway call doesn't take the daemon down with it. The payload is the
+marshal of ``(code, args, kwargs)``, as in the function jobs, and the result
+is the marshal of ``(INLINE_RESULT, value)`` or ``(INLINE_ERROR, message)``.
+
+The limits only protect the daemon from mistakes, they are not a sandbox:
+the functions run with the full builtins, as the user of the daemon, so
+they can import any module, read and write files, or start processes.
+"""
+from typing import Optional, Tuple, Dict, Any, TYPE_CHECKING
+import threading
+import builtins
+import logging
+import marshal
+import types
+
+from .errors import ClusterServerError
+
+if TYPE_CHECKING:
+    # multiprocessing is imported with the pool, on the first call.
+    from concurrent.futures import ProcessPoolExecutor
+
+INLINE_RESULT = 0
+INLINE_ERROR = 1
+
+
+def encode_call(function: types.FunctionType,
+                args: Tuple = (),
+                kwargs: Optional[Dict[str, Any]] = None) -> bytes:
+    """
+    Payload of a call to run inline. As in the function jobs, the function
+    only gets the builtins as globals, so it must import what it uses.
+
+    Raises:
+        ValueError: marshal can not serialize the arguments.
+    """
+    return marshal.dumps((function.__code__, tuple(args), dict(kwargs or {})))
+
+
+def _init_worker(memory: Optional[int]) -> None:
+    import resource
+
+    if memory:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+
+def _run(payload: bytes, cpu_time: Optional[int]) -> bytes:
+    """
+    Run a call in a worker. The worker is killed (``SIGXCPU``) if the call
+    uses more than ``cpu_time`` seconds of CPU.
+    """
+    import resource
+
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if cpu_time:
+        # The limit counts the CPU used by the worker since it started.
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        limit = int(usage.ru_utime + usage.ru_stime) + 1 + cpu_time
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+    try:
+        code, args, kwargs = marshal.loads(payload)
+        function = types.FunctionType(code, {'__builtins__': builtins})
+        out = function(*args, **kwargs)
+        return marshal.dumps((INLINE_RESULT, out))
+    except Exception as e:
+        return marshal.dumps(
+            (INLINE_ERROR, '{}: {}'.format(type(e).__name__, e))
+            )
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+class InlinePool:
+    """
+    Bounded pool of worker processes for the inline calls. Workers are
+    started on the first call.
+    """
+    def __init__(self,
+                 workers: int = 2,
+                 cpu_time: Optional[int] = 10,
+                 memory: Optional[int] = 512 << 20,
+                 timeout: float = 60.0,
+                 max_pending: int = 16) -> None:
+        """
+        Args:
+            workers (int, optional):
+                Number of worker processes.
+            cpu_time (int, optional):
+                Seconds of CPU a call can use.
+            memory (int, optional):
+                Address space of a worker, in bytes.
+            timeout (float, optional):
+                Seconds to wait for the result of a call. A call that times
+                out restarts the pool, as it may be stuck.
+            max_pending (int, optional):
+                Calls running or waiting for a worker, further calls are
+                refused.
+        """
+        self.workers = workers
+        self.cpu_time = cpu_time
+        self.memory = memory
+        self.timeout = timeout
+        self.max_pending = max_pending
+
+        self._pool: Optional['ProcessPoolExecutor'] = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _get_pool(self) -> 'ProcessPoolExecutor':
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.memory,)
+                    )
+            return self._pool
+
+    def _reset(self, pool: 'ProcessPoolExecutor', kill: bool = False) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        if kill:
+            # The executor can't cancel running calls.
+            for proc in list((getattr(pool, '_processes', None) or
+                              {}).values()):
+                proc.terminate()
+        pool.shutdown(wait=False)
+
+    def run(self, payload: bytes) -> bytes:
+        """
+        Run a call and wait for its result.
+
+        Returns:
+            result (bytes): Marshal of the result, see the module docs.
+
+        Raises:
+            ClusterServerError:
+                The pool is full, the call timed out, or the worker died
+                (e.g. it reached the CPU limit).
+        """
+        from concurrent.futures import TimeoutError
+        from concurrent.futures.process import BrokenProcessPool
+
+        if not self._slots.acquire(blocking=False):
+            e_msg = 'Too many inline calls pending'
+            logging.error(e_msg)
+            raise ClusterServerError(e_msg)
+
+        try:
+            pool = self._get_pool()
+            future = pool.submit(_run, payload, self.cpu_time)
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                e_msg = 'Inline call timed out after {}s'.format(self.timeout)
+                self._reset(pool, kill=True)
+            except BrokenProcessPool:
+                e_msg = 'Inline worker died, limits exceeded?'
+                self._reset(pool)
+            logging.error(e_msg)
+            raise ClusterServerError(e_msg)
+        finally:
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        """
+        Stop the workers, waiting for the running calls.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
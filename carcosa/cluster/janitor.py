@@ -0,0 +1,282 @@
+"""
+Removal of the files of finished jobs, following retention policies.
+
+The files of a job are grouped as inputs (submission scripts, runners and
+payloads), results (result, profile and timings files) and logs (stdout and
+stderr). A file is only removed when every job that uses it agrees: all the
+jobs have finished and the policy allows removing it, so the files shared by
+the tasks of an array job, or by all the jobs of a session (the payload
+pack), stay until the last of them can be removed. Files of jobs that have
+not finished are never touched.
+"""
+from typing import Optional, Dict, List, Tuple, TYPE_CHECKING
+import threading
+import logging
+import time
+import os
+
+from .states import GOOD_STATES, DONE_STATES, STATE_CODES
+from .table import LAUNCHED, INPUTS_REMOVED, RESULTS_REMOVED, LOGS_REMOVED
+from .cache import ResultCache
+
+if TYPE_CHECKING:
+    from carcosa.cluster import ClusterClient, Job
+    from .table import JobTable
+
+_GOOD_CODES = frozenset(STATE_CODES[s] for s in GOOD_STATES)
+_DONE_CODES = frozenset(STATE_CODES[s] for s in DONE_STATES)
+
+# (local path, remote path) of a file
+FilePaths = Tuple[str, str]
+
+
+class RetentionPolicy:
+    """
+    How long the files of a finished job are kept, in seconds since the job
+    state was last updated (when it was seen finished). None keeps the files
+    forever.
+    """
+    def __init__(self,
+                 inputs: Optional[float] = 0,
+                 failed_inputs: Optional[float] = None,
+                 results: Optional[float] = None,
+                 logs: Optional[float] = None) -> None:
+        """
+        Args:
+            inputs (float, optional):
+                Retention of the inputs of the jobs that succeeded, by
+                default they're removed as soon as the job finishes.
+            failed_inputs (float, optional):
+                Retention of the inputs of the jobs that failed, by default
+                they're kept so the jobs can be relaunched.
+            results (float, optional):
+                Retention of the results, e.g. ``7 * 86400`` keeps them a
+                week.
+            logs (float, optional):
+                Retention of the stdout and stderr files.
+        """
+        self.inputs = inputs
+        self.failed_inputs = failed_inputs
+        self.results = results
+        self.logs = logs
+
+
+class Janitor:
+    """
+    Removes the files of the finished jobs of a client. It can be run on
+    demand with :meth:`run`, or periodically in a background thread with
+    :meth:`start`.
+
+    The jobs whose files have been removed are flagged in the job table, so
+    they're not checked again.
+    """
+    def __init__(self,
+                 client: 'ClusterClient',
+                 policy: Optional[RetentionPolicy] = None,
+                 remote: bool = False,
+                 batch_size: int = 1000,
+                 pause: float = 0) -> None:
+        """
+        Args:
+            client (ClusterClient):
+                Client of the jobs.
+            policy (RetentionPolicy, optional):
+                Retention policy, by default only the inputs of the jobs
+                that succeeded are removed.
+            remote (bool, optional):
+                Remove the files in the server host (with the server
+                ``remove_files`` method) instead of the local filesystem.
+            batch_size (int, optional):
+                Number of files removed at once, or sent in a single call to
+                the server.
+            pause (float, optional):
+                Seconds to wait between batches, to spread the load on the
+                filesystem.
+        """
+        self.client = client
+        self.policy = policy or RetentionPolicy()
+        self.remote = remote
+        self.batch_size = batch_size
+        self.pause = pause
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # Shards and index buckets of the results log, listed once per run.
+        self._shards: List[str] = []
+
+    def _categories(self, job: 'Job', good: bool) \
+            -> List[Tuple[int, Optional[float], List[FilePaths]]]:
+        """
+        Flag, retention and files of each category of files of a job.
+        """
+        script = job.script
+        if not script.local_path or not script.remote_path:
+            # The job never had files.
+            return []
+        pair = (script.local_path, script.remote_path)
+        is_function = not isinstance(job.f, str)
+
+        # Only profiled jobs have their own runner, payload and profile.
+        input_files = ['sbatch']
+        result_files = ['out', 'timings']
+        if job.profiling:
+            input_files += ['marshal', 'python']
+            result_files += ['prof', 'alloc']
+
+        inputs = [
+            (script.local.filepath(f), script.remote.filepath(f))
+            for f in input_files
+            ]
+        pack = self.client._packs.get(pair)
+        if is_function and pack is not None:
+            inputs.extend(
+                (pack.filepath(f), pack.filepath(f, remote=True))
+                for f in ('pack', 'index')
+                )
+
+        results = [
+            (script.local.filepath(f), script.remote.filepath(f))
+            for f in (result_files if is_function else ['timings'])
+            ]
+        # Cached results are managed by the cache.
+        results = [
+            r for r in results
+            if os.path.basename(os.path.dirname(r[0])) != ResultCache.DIRNAME
+            ]
+        log = self.client.results_log
+        if is_function and log is not None and \
+                log.local_path == script.local_path:
+            results.extend(
+                (s, os.path.join(log.remote_path, os.path.basename(s)))
+                for s in self._shards
+                )
+
+        logs = [
+            job._log_paths(stream) for stream in ('stdout', 'stderr')
+            if (job.outfile if stream == 'stdout' else job.errfile)
+            ]
+
+        policy = self.policy
+        return [
+            (INPUTS_REMOVED,
+             policy.inputs if good else policy.failed_inputs, inputs),
+            (RESULTS_REMOVED, policy.results, results),
+            (LOGS_REMOVED, policy.logs, logs)
+            ]
+
+    def run(self) -> int:
+        """
+        Remove the files of the finished jobs allowed by the policy.
+
+        Returns:
+            removed (int): Number of removed files.
+        """
+        table = self.client.jobs
+        now = time.time()
+        log = self.client.results_log
+        self._shards = log.shards() + log.index_files() \
+            if log is not None else []
+
+        # A launch appending to a pack of the session is not finished when
+        # the table is scanned, the packs are decided and removed under the
+        # lock of the packs, before another launch can append to them.
+        with self.client._packs_lock:
+            paths, done = self._select(table, now)
+            pack_files = set()
+            for pack in self.client._packs.values():
+                pack_files.update(
+                    (pack.filepath(f), pack.filepath(f, remote=True))
+                    for f in ('pack', 'index')
+                    )
+            removed = self._remove([p for p in paths if p in pack_files])
+
+            # The pack of the session is recreated if it's used again.
+            gone = set(p[0] for p in paths)
+            for key, pack in list(self.client._packs.items()):
+                if pack.filepath('pack') in gone:
+                    del self.client._packs[key]
+
+        removed += self._remove([p for p in paths if p not in pack_files])
+        for row, flag in done.items():
+            table.flags[row] |= flag
+
+        # The results log of the session is recreated if it's used again.
+        if log is not None and gone.intersection(self._shards):
+            log.reset()
+
+        if removed:
+            logging.info('Janitor removed {} files'.format(removed))
+        return removed
+
+    def _select(self, table: 'JobTable', now: float) \
+            -> Tuple[List[FilePaths], Dict[int, int]]:
+        """
+        Files that can be removed, and the flags to set in each row once
+        they are.
+        """
+        # A file is removed only if all the jobs using it allow it.
+        allowed: Dict[FilePaths, bool] = dict()
+        done: Dict[int, int] = dict()
+        for row in range(len(table)):
+            flags = table.flags[row]
+            code = table.states[row]
+            finished = bool(flags & LAUNCHED) and code in _DONE_CODES
+            age = now - table.updated[row]
+            job = table.view(row)
+            for flag, keep, paths in self._categories(job,
+                                                      code in _GOOD_CODES):
+                if flags & flag:
+                    continue
+                ok = finished and keep is not None and age >= keep
+                if ok:
+                    done[row] = done.get(row, 0) | flag
+                for p in paths:
+                    allowed[p] = allowed.get(p, True) and ok
+        return [p for p, ok in allowed.items() if ok], done
+
+    def _remove(self, paths: List[FilePaths]) -> int:
+        removed = 0
+        for i in range(0, len(paths), self.batch_size):
+            if i and self.pause:
+                time.sleep(self.pause)
+            batch = paths[i:i + self.batch_size]
+            if self.remote:
+                removed += self.client.server.remove_files(
+                    [remote for _, remote in batch]
+                    )
+                continue
+            for local, _ in batch:
+                try:
+                    os.remove(local)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def start(self, interval: float = 600) -> None:
+        """
+        Run the janitor every ``interval`` seconds in a daemon thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            logging.warning('Janitor already running')
+            return
+
+        def loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.run()
+                except Exception as e:
+                    logging.error('Janitor failed: {}'.format(e))
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread, if it's running.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -1,10 +1,17 @@
-from typing import Dict, Union, Callable, List, Optional, Any, TYPE_CHECKING
+from typing import Dict, Union, Callable, List, Optional, Any, Tuple, \
+    Iterator, TYPE_CHECKING
 import marshal
 import types
 import logging
+import time
 import os
 
-from .states import DONE_STATES, ACTIVE_STATES
+from .states import ACTIVE_STATES, DONE_STATES, INIT_STATE, STATE_NAMES, \
+    STATE_CODES
+from .table import JobTable, LAUNCHED, PROFILING, REMOVED, BACKLOGGED, \
+    INPUTS_REMOVED, format_job_id
+from .errors import ClusterClientError
+from . import logs
 
 from carcosa import scripts
 
@@ -12,6 +19,14 @@ if TYPE_CHECKING:
     # This is a cyclic dependency at runtime, but it's necessary when
     # performing the type checking.
     from carcosa.cluster import ClusterClient
+    import pstats
+
+
+_DONE_CODES = frozenset(STATE_CODES[s] for s in DONE_STATES)
+_ACTIVE_CODES = frozenset(STATE_CODES[s] for s in ACTIVE_STATES)
+
+# Allocation site found by tracemalloc: (filename, lineno, size, count)
+Allocation = Tuple[str, int, int, int]
 
 
 class JobResultError(Exception):
@@ -22,13 +37,22 @@ class JobResultError(Exception):
 
 
 class Job:
-    INIT_STATUS: str = 'carcosa_not_launched'
+    """
+    A job of a client. The state of the job is stored in the
+    :class:`~carcosa.cluster.table.JobTable` of its client, a job object is
+    just a view of a row of the table, so there may be several job objects
+    for the same job (they compare equal).
+    """
+    __slots__ = ('_table', '_row')
+
+    INIT_STATUS: str = INIT_STATE
 
     def __init__(self,
                  f: Union[Callable, str],
                  s: scripts.Script,
                  o: Dict,
-                 client: 'ClusterClient') -> None:
+                 client: 'ClusterClient',
+                 profile: bool = False) -> None:
         """
         .. todo:: Cluster client type annotation
 
@@ -40,24 +64,15 @@ class Job:
             o (dict):
                 Options for the batch system scripts. It can be an empty dict.
             client (ClusterClient):
-                Client object.
+                Client object, the job is added to its jobs table.
+            profile (bool, optional):
+                Profile the function when it runs in the queue system, see
+                :py:attr:`profile`.
         """
-        self.id: Optional[str] = None
-        self.client: 'ClusterClient' = client
-
-        self.launched: bool = False
-
-        # Status updated when performing an "update"
-        self.status: str = self.INIT_STATUS
-
-        # Metrics, will be filled when the job finishes
-        # TODO
-        self.metrics: Dict = dict()
-
-        # Parameters needed to construct and launch the scripts
-        self.f = f
-        self.script = s
-        self.options = o
+        self._table: JobTable = client.jobs
+        self._row: int = self._table.add(
+            f, s, o, flags=PROFILING if profile else 0
+            )
 
         # Make sure that stdout and stderr is saved
         if not self.outfile:
@@ -77,6 +92,169 @@ class Job:
 
         logging.info('Created new job {}'.format(self.script.name))
 
+    @classmethod
+    def _view(cls, table: JobTable, row: int) -> 'Job':
+        job = cls.__new__(cls)
+        job._table = table
+        job._row = row
+        return job
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Job):
+            return NotImplemented
+        return self._table is other._table and self._row == other._row
+
+    def __hash__(self) -> int:
+        return hash((id(self._table), self._row))
+
+    # Row accessors
+
+    @property
+    def client(self) -> 'ClusterClient':
+        return self._table.client
+
+    @property
+    def id(self) -> Optional[str]:
+        """
+        Id of the job in the queue system, None if it have not been
+        submitted.
+        """
+        t = self._table
+        return format_job_id(t.ids[self._row], t.tasks[self._row])
+
+    @id.setter
+    def id(self, val: Optional[str]) -> None:
+        self._table.set_id(self._row, val)
+
+    @property
+    def status(self) -> str:
+        """
+        Status of the job, updated when performing an :meth:`update`, or
+        refreshed on read if it's older than :py:attr:`max_staleness`.
+        """
+        self._refresh_stale()
+        return STATE_NAMES[self._table.states[self._row]]
+
+    @status.setter
+    def status(self, val: str) -> None:
+        self._table.set_state(self._row, val)
+
+    @property
+    def updated(self) -> float:
+        """
+        Time of the last status change.
+        """
+        return self._table.updated[self._row]
+
+    @property
+    def checked(self) -> float:
+        """
+        Time the status was last confirmed by the queue system (or set).
+        """
+        return self._table.checked[self._row]
+
+    @property
+    def max_staleness(self) -> Optional[float]:
+        """
+        Seconds the status of the launched job can be used without asking
+        the queue system again. When it's older, reading :py:attr:`status`,
+        :py:attr:`finished` or :py:attr:`running` refreshes the status of
+        all the jobs of the client in one request, see
+        :meth:`ClusterClient.refresh_states
+        <carcosa.cluster.ClusterClient.refresh_states>`. None (the default)
+        uses the one of the client, see
+        :meth:`ClusterClient.enable_state_cache
+        <carcosa.cluster.ClusterClient.enable_state_cache>`.
+        """
+        staleness = self._table.staleness[self._row]
+        if staleness < 0:
+            return self.client.max_staleness
+        return staleness
+
+    @max_staleness.setter
+    def max_staleness(self, val: Optional[float]) -> None:
+        self._table.staleness[self._row] = -1.0 if val is None else val
+
+    def _refresh_stale(self) -> None:
+        t = self._table
+        row = self._row
+        if not t.flags[row] & LAUNCHED or t.states[row] in _DONE_CODES:
+            return
+        staleness = self.max_staleness
+        if staleness is None or time.time() - t.checked[row] <= staleness:
+            return
+        self.client._refresh_stale(row, staleness)
+
+    def _flag(self, flag: int) -> bool:
+        return bool(self._table.flags[self._row] & flag)
+
+    def _set_flag(self, flag: int, val: bool) -> None:
+        if val:
+            self._table.flags[self._row] |= flag
+        else:
+            self._table.flags[self._row] &= ~flag
+
+    @property
+    def launched(self) -> bool:
+        return self._flag(LAUNCHED)
+
+    @launched.setter
+    def launched(self, val: bool) -> None:
+        self._set_flag(LAUNCHED, val)
+
+    @property
+    def profiling(self) -> bool:
+        """
+        Profile the function when it runs, see :py:attr:`profile`.
+        """
+        return self._flag(PROFILING)
+
+    @profiling.setter
+    def profiling(self, val: bool) -> None:
+        self._set_flag(PROFILING, val)
+
+    @property
+    def backlogged(self) -> bool:
+        """
+        The job is held by the submission throttle of the client, it'll be
+        submitted when there's room in the queue.
+        """
+        return self._flag(BACKLOGGED)
+
+    @property
+    def f(self) -> Union[Callable, str]:
+        """
+        Function or command executed by the job.
+        """
+        return self._table.functions[self._row]
+
+    @property
+    def script(self) -> scripts.Script:
+        return self._table.scripts[self._row]
+
+    @property
+    def options(self) -> Dict:
+        """
+        Options for the batch system scripts.
+        """
+        return self._table.options[self._row]
+
+    @property
+    def metrics(self) -> Dict:
+        """
+        Metrics of the finished job, filled by
+        :meth:`ClusterClient.record_usage
+        <carcosa.cluster.ClusterClient.record_usage>`: ``elapsed`` (seconds),
+        ``max_rss`` (bytes) and ``alloc_cpus``.
+        """
+        return self._extra().setdefault('metrics', dict())
+
+    def _extra(self) -> Dict[str, Any]:
+        extra = self._table.extra[self._row]
+        if extra is None:
+            extra = self._table.extra[self._row] = dict()
+        return extra
+
     # Path related properties
 
     @property
@@ -141,18 +319,16 @@ class Job:
         Returns True if the job have finished (may be with errors), False if
         not.
         """
-        if self.status.lower() in DONE_STATES:
-            return True
-        return False
+        self._refresh_stale()
+        return self._table.states[self._row] in _DONE_CODES
 
     @property
     def running(self) -> bool:
         """
         Returns True if the job is running, False if not
         """
-        if self.status.lower() in ACTIVE_STATES:
-            return True
-        return False
+        self._refresh_stale()
+        return self._table.states[self._row] in _ACTIVE_CODES
 
     # Data properties
 
@@ -170,7 +346,7 @@ class Job:
             return None
 
         if self.outfile:
-            with open(self.outfile, 'r') as f:
+            with open(self._log_paths('stdout')[0], 'r') as f:
                 return f.read()
         return None
 
@@ -188,14 +364,15 @@ class Job:
             return None
 
         if self.errfile:
-            with open(self.errfile, 'r') as f:
+            with open(self._log_paths('stderr')[0], 'r') as f:
                 return f.read()
         return None
 
     @property
     def retval(self) -> Any:
         """
-        Gets the return value for the job.
+        Gets the return value for the job, from the results log of the client
+        if it's there, or from the result file.
         """
         if not self.finished:
             logging.warning(
@@ -203,39 +380,265 @@ class Job:
                 )
             return
 
-        if not os.path.isfile(self.script.out_file):
+        log = self.client.results_log
+        if log is not None:
+            payload = log.get(self.script.out_file)
+            if payload is not None:
+                return self._decode_result(payload)
+
+        out_file = self.script.local.filepath('out')
+        if not os.path.isfile(out_file):
             logging.error(
                 'Result marshal file does not exist! Aborting. ({})'.format(
-                    self.script.out_file
+                    out_file
                     )
                 )
             raise FileNotFoundError('Marshal file not found')
 
-        with open(self.script.out_file, 'rb') as f:
+        with open(out_file, 'rb') as f:
+            return self._decode_result(f.read())
+
+    @staticmethod
+    def _decode_result(payload: bytes) -> Any:
+        """
+        Load a marshal result, raising it if it's an exception.
+        """
+        try:
+            v = marshal.loads(payload)
+            if isinstance(v, Exception):
+                raise v
+            elif isinstance(v, type) and issubclass(v, Exception):
+                raise v
+            else:
+                return v
+        except (EOFError, ValueError, TypeError) as e:
+            logging.error(
+                'Error loading the result marshal file: {}'.format(e)
+                )
+            raise JobResultError()
+
+    @property
+    def profile(self) -> Optional[Tuple['pstats.Stats', List[Allocation]]]:
+        """
+        Profile of a function job launched with profiling enabled. Returns
+        the cProfile stats and the top allocation sites found by tracemalloc,
+        as a list of ``(filename, lineno, size, count)`` sorted by size.
+        """
+        if not self.profiling:
+            logging.warning('Job have not been launched with profiling.')
+            return None
+
+        if not self.finished:
+            logging.warning(
+                'Job have not finished yet, won\'t read profile files.'
+                )
+            return None
+
+        prof_file = self.script.local.filepath('prof')
+        alloc_file = self.script.local.filepath('alloc')
+        if not os.path.isfile(prof_file) or not os.path.isfile(alloc_file):
+            logging.error(
+                'Profile files does not exist! Aborting. ({})'.format(
+                    prof_file
+                    )
+                )
+            raise FileNotFoundError('Profile files not found')
+
+        import pstats
+
+        stats = pstats.Stats(prof_file)
+        with open(alloc_file, 'rb') as f:
             try:
-                v = marshal.load(f)
-                if isinstance(v, Exception):
-                    raise v
-                elif isinstance(v, type) and issubclass(v, Exception):
-                    raise v
-                else:
-                    return v
+                allocs = marshal.load(f)
             except (EOFError, ValueError, TypeError) as e:
                 logging.error(
-                    'Error loading the result marshal file: {}'.format(e)
+                    'Error loading the allocations file: {}'.format(e)
                     )
                 raise JobResultError()
 
+        return stats, [tuple(a) for a in allocs]
+
+    @property
+    def timings(self) -> Optional[Dict[str, Dict[str, int]]]:
+        """
+        Timings of the job phases, in nanoseconds, written by the runner:
+
+        - ``phases``: wall clock time of ``script_start``, ``runner_start``,
+          ``payload_loaded``, ``function_done``, ``result_written`` and
+          ``exit``. Command jobs only have ``script_start`` and ``exit``.
+        - ``durations``: ``startup`` (until the python interpreter is
+          running), ``load``, ``run``, ``write``, ``teardown``, ``total`` and
+          ``overhead`` (``total`` minus ``run``, all the time not spent in the
+          function). The phases inside the runner are measured with the
+          monotonic clock.
+
+        The tasks of an array job share the timings file, only the lines of
+        the task of this job are used.
+        """
+        import json
+
+        if not self.finished:
+            logging.warning(
+                'Job have not finished yet, won\'t read timings file.'
+                )
+            return None
+
+        timings_file = self.script.local.filepath('timings')
+        if not os.path.isfile(timings_file):
+            logging.error(
+                'Timings file does not exist! Aborting. ({})'.format(
+                    timings_file
+                    )
+                )
+            raise FileNotFoundError('Timings file not found')
+
+        task = self._table.tasks[self._row]
+        real: Dict[str, int] = dict()
+        mono: Dict[str, int] = dict()
+        with open(timings_file, 'r') as f:
+            for line in f:
+                try:
+                    p = json.loads(line)
+                except ValueError:
+                    logging.warning('Invalid timings line: {}'.format(line))
+                    continue
+                if p.get('task', -1) != task:
+                    continue
+                real[p['phase']] = p['realtime']
+                if 'monotonic' in p:
+                    mono[p['phase']] = p['monotonic']
+
+        durations: Dict[str, int] = dict()
+        for name, start, end, clock in (
+                ('startup', 'script_start', 'runner_start', real),
+                ('load', 'runner_start', 'payload_loaded', mono),
+                ('run', 'payload_loaded', 'function_done', mono),
+                ('write', 'function_done', 'result_written', mono),
+                ('teardown', 'result_written', 'exit', real),
+                ('total', 'script_start', 'exit', real)):
+            if start in clock and end in clock:
+                durations[name] = clock[end] - clock[start]
+        if 'total' in durations:
+            durations['overhead'] = \
+                durations['total'] - durations.get('run', 0)
+
+        return {'phases': real, 'durations': durations}
+
     # Methods
 
+    def _log_paths(self, stream: str) -> Tuple[str, str]:
+        """
+        Local and remote paths of the ``stdout`` or ``stderr`` file. Relative
+        paths are relative to the working directory of the job.
+        """
+        if stream == 'stdout':
+            fname = self.outfile
+        elif stream == 'stderr':
+            fname = self.errfile
+        else:
+            raise ValueError('Stream must be stdout or stderr')
+        workdir = self.options.get('workdir', self.remote_path)
+        return (
+            os.path.join(self.local_path or '', fname),
+            os.path.join(workdir or '', fname)
+            )
+
+    def tail(self,
+             from_offset: int = 0,
+             stream: str = 'stdout',
+             max_bytes: int = logs.TAIL_CHUNK) -> Tuple[str, int]:
+        """
+        Read the output of the job written after ``from_offset``, it can be
+        called while the job is running. If the log is not reachable from the
+        local host, it's read through the server.
+
+        Args:
+            from_offset (int, optional):
+                Offset (in bytes) returned by the previous call.
+            stream (str, optional):
+                ``stdout`` or ``stderr``.
+            max_bytes (int, optional):
+                Maximum number of bytes to read.
+
+        Returns:
+            data (str):
+                New output, empty if there's nothing new.
+            offset (int):
+                Offset for the next call.
+        """
+        if not self.launched:
+            logging.warning('Job have not been submitted yet. Aborting')
+            return ('', from_offset)
+
+        local, remote = self._log_paths(stream)
+        if os.path.isfile(local):
+            return logs.read_chunk(local, from_offset, max_bytes)
+
+        data, offset = self.client.server.tail(remote, from_offset, max_bytes)
+        return (data, offset)
+
+    def follow(self,
+               stream: str = 'stdout',
+               interval: float = 1.0,
+               from_offset: int = 0) -> Iterator[str]:
+        """
+        Generator of the output of the job as it's written, it finishes when
+        the job finishes and all its output have been read.
+
+        Args:
+            stream (str, optional):
+                ``stdout`` or ``stderr``.
+            interval (float, optional):
+                Seconds between polls when there's no new output.
+            from_offset (int, optional):
+                Offset (in bytes) to start reading from.
+        """
+        if not self.launched:
+            logging.warning('Job have not been submitted yet. Aborting')
+            return
+
+        offset = from_offset
+        while True:
+            # Check the state before reading, so everything written before
+            # the job finished is read.
+            finished = self.finished
+            data, offset = self.tail(offset, stream)
+            while data:
+                yield data
+                data, offset = self.tail(offset, stream)
+            if finished:
+                return
+            time.sleep(interval)
+            self.update()
+
+    def search(self,
+               pattern: str,
+               stream: str = 'stdout',
+               max_matches: int = 1000) -> List[Tuple[int, str]]:
+        """
+        Search a regular expression in the output of the job. The log is
+        mapped in memory instead of read, so it works with huge logs.
+
+        Returns:
+            matches (list):
+                ``(offset, line)`` of the lines that contain a match.
+        """
+        local, remote = self._log_paths(stream)
+        if os.path.isfile(local):
+            return logs.search(local, pattern, max_matches)
+        return [
+            (offset, line) for offset, line in
+            self.client.server.search_log(remote, pattern, max_matches)
+            ]
+
     def update(self) -> None:
         """
         Queries the remote queue system to update the status of the job.
 
         Raises:
             ValueError:
-                The id returned by the remote queue system is different than
-                the local id, this **MUST NOT** happen.
+                The queue system doesn't know the id of the job, this **MUST
+                NOT** happen.
             Pyro4.errors.ConnectionClosedError:
                 The connection with the remote object is lost.
         """
@@ -243,21 +646,25 @@ class Job:
             logging.warning('Job have not been submitted yet. Aborting')
             return
 
-        if self.finished:
+        if self._table.states[self._row] in _DONE_CODES:
             logging.warning('Job already finished')
             return
 
-        server = self.client.server
-        id_, status = server.queue_parser(job_id=self.id)
+        allocation = self._extra().get('allocation')
+        if allocation is not None:
+            self.client.update_steps(allocation, [self])
+            return
+
+        states = dict(self.client.server.queue_parser(job_id=self.id))
+        status = states.get(self.id)
 
         # This *MUST NOT* happen
-        if id_ != self.id:
+        if status is None:
             logging.critical(
-                'Queue system id for the job is not the same as the local job '
-                'id. This *MUST NOT* happen and probably there\'s a bug in '
-                'the code.'
+                'Job {} is not in the queue system. This *MUST NOT* happen '
+                'and probably there\'s a bug in the code.'.format(self.id)
                 )
-            raise ValueError('Local job id is different from remote job id')
+            raise ValueError('Local job id is not in the queue system')
 
         self.status = status
 
@@ -268,7 +675,9 @@ class Job:
     def launch(self,
                args: List = [],
                kwargs: Dict = {},
-               force: bool = False) -> None:
+               force: bool = False,
+               profile: Optional[bool] = None,
+               allocation: Optional[str] = None) -> None:
         """
         Launch a job to the queue system.
 
@@ -279,6 +688,14 @@ class Job:
                 If the job is a python function, the keyword arguments for it.
             force (bool):
                 Relaunch the job even if it have been already launched.
+            profile (bool, optional):
+                Profile the function with cProfile and tracemalloc, if not set
+                the value given when the job was created is used.
+            allocation (str, optional):
+                Run the job as a step of an allocation of the client (see
+                :meth:`ClusterClient.allocate
+                <carcosa.cluster.ClusterClient.allocate>`) instead of
+                submitting it to the queue.
 
         Raises:
             ValueError:
@@ -290,6 +707,9 @@ class Job:
         if not force and self.status != self.INIT_STATUS:
             logging.warning('Job have been already launched. Aborting')
             return
+        if self.backlogged:
+            logging.warning('Job is waiting to be submitted. Aborting')
+            return
         if not force and self.finished:
             logging.warning('Job have already finished.')
             return
@@ -301,11 +721,23 @@ class Job:
             logging.error(e_msg)
             raise ValueError(e_msg)
 
+        if self._cached_result(args, kwargs):
+            return
+
+        # A relaunched job is not finished anymore, and its new files must be
+        # kept by the janitor.
+        if force:
+            self.status = self.INIT_STATUS
+            self._table.flags[self._row] &= ~REMOVED
+
         script_kwargs: Dict[str, Any] = dict()
         if isinstance(self.f, types.FunctionType):
             script_kwargs['function'] = self.f
             script_kwargs['args'] = args
             script_kwargs['kwargs'] = kwargs
+            if profile is not None:
+                self.profiling = profile
+            script_kwargs['profile'] = self.profiling
         elif isinstance(self.f, str):
             script_kwargs['cmd'] = self.f
 
@@ -317,10 +749,92 @@ class Job:
             **script_kwargs
             )
 
-        self.id = self.client.submit(self.script)
-        self.launched = True
+        if allocation is not None:
+            self.client.run_step(self, allocation)
+            return
+
+        if not self.client._launch(self.script, [self]) and self.backlogged:
+            logging.info('Job {} held by the submission throttle'.format(
+                self.script.name
+                ))
 
-        logging.info('Job launched with id {}'.format(self.id))
+    def resubmit(self, sbatch_args: Optional[List[str]] = None) -> None:
+        """
+        Submit again the scripts generated by the last launch, the payload
+        of a function job included, e.g. to retry a job that failed. Only the
+        task of this job is resubmitted for array tasks.
+
+        Args:
+            sbatch_args (list, optional):
+                Options for the queue system that override the ones in the
+                script, e.g. ``['--time=02:00:00']``.
+
+        Raises:
+            ValueError:
+                The job was not launched, or its scripts have been removed.
+            ClusterClientError:
+                The queue system didn't return a job id, the job is left as
+                it was.
+            SubmitLimitError:
+                The submit limit of the queue system was reached, and the
+                client has no throttle to hold the job.
+        """
+        if not self.launched or self._flag(INPUTS_REMOVED):
+            e_msg = 'Job {} has no scripts to resubmit'.format(self)
+            logging.error(e_msg)
+            raise ValueError(e_msg)
+
+        args = list(sbatch_args or [])
+        task = self._table.tasks[self._row]
+        if task >= 0:
+            args.append('--array={}'.format(task))
+
+        # The state of the job only changes once it's submitted.
+        if self.client._launch(self.script, [self], task >= 0, args):
+            logging.info('Job resubmitted with id {}'.format(self.id))
+        elif self.backlogged:
+            logging.info('Job {} resubmission held by the throttle'.format(
+                self.script.name
+                ))
+        else:
+            e_msg = 'Job {} could not be resubmitted'.format(self)
+            logging.error(e_msg)
+            raise ClusterClientError(e_msg)
+
+    def _cached_result(self, args: List, kwargs: Dict) -> bool:
+        """
+        If the client has a result cache, point the result file of the job to
+        the cache. Returns True if the result is already there, so the job
+        doesn't need to be launched.
+        """
+        cache = self.client.result_cache
+        if cache is None or not isinstance(self.f, types.FunctionType):
+            return False
+
+        if os.path.abspath(self.local_path) != os.path.abspath(cache.root):
+            logging.warning(
+                'Job local path is not the cache root, not using the cache.'
+                )
+            return False
+
+        try:
+            key = cache.key(self.f, args, kwargs)
+        except ValueError:
+            logging.warning('Can not hash the job arguments, not cached.')
+            return False
+
+        self.script.out_file = cache.relpath(key)
+        if cache.lookup(key) is None:
+            return False
+
+        logging.info('Result of job {} found in cache ({})'.format(
+            self.script.name, key
+            ))
+        self.launched = True
+        self.status = 'completed'
+        return True
 
     def __str__(self):
-        return '<JOB-{jid}({status})>'.format(jid=self.id, status=self.status)
+        return '<JOB-{jid}({status})>'.format(
+            jid=self.id, status=STATE_NAMES[self._table.states[self._row]]
+            )
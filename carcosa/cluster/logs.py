@@ -0,0 +1,73 @@
+"""
+Incremental reading of the job logs. These functions are used both by
+:class:`~carcosa.cluster.Job` when the logs are reachable from the local host,
+and by the server when they're only in the remote filesystem.
+"""
+from typing import Tuple, List
+import mmap
+import re
+import os
+
+# Default maximum number of bytes returned by a single read.
+TAIL_CHUNK = 1 << 20
+
+
+def read_chunk(path: str,
+               offset: int = 0,
+               size: int = TAIL_CHUNK) -> Tuple[str, int]:
+    """
+    Read at most ``size`` bytes of a file starting at ``offset``.
+
+    An incomplete UTF-8 sequence at the end of the chunk is left for the
+    next read, so the text is never split in the middle of a character.
+
+    Returns:
+        data (str):
+            Text read, empty if there's nothing new.
+        offset (int):
+            Offset to pass to the next read.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        raw = f.read(size)
+
+    try:
+        return raw.decode('utf-8'), offset + len(raw)
+    except UnicodeDecodeError as e:
+        if e.reason == 'unexpected end of data' and len(raw) - e.start < 4:
+            raw = raw[:e.start]
+            return raw.decode('utf-8'), offset + len(raw)
+        return raw.decode('utf-8', errors='replace'), offset + len(raw)
+
+
+def search(path: str,
+           pattern: str,
+           max_matches: int = 1000) -> List[Tuple[int, str]]:
+    """
+    Search a regular expression in a file without reading it in memory, the
+    file is mapped and the pages are loaded by the OS as they're scanned.
+
+    Returns:
+        matches (list):
+            ``(offset, line)`` of the lines that contain a match.
+    """
+    if os.path.getsize(path) == 0:
+        return []
+
+    regex = re.compile(pattern.encode('utf-8'), re.MULTILINE)
+    matches: List[Tuple[int, str]] = []
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        pos = 0
+        while len(matches) < max_matches:
+            match = regex.search(m, pos)
+            if match is None:
+                break
+            start = m.rfind(b'\n', 0, match.start()) + 1
+            end = m.find(b'\n', match.end())
+            if end == -1:
+                end = len(m)
+            line = m[start:end].decode('utf-8', errors='replace')
+            matches.append((start, line))
+            pos = end + 1
+    return matches
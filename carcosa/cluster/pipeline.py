@@ -0,0 +1,148 @@
+"""
+Pipelines of jobs submitted all at once. The order between the stages is
+enforced by the queue system (``--dependency=afterok:<ids>``), so the client
+doesn't need to wait for a stage to finish before submitting the next one.
+"""
+from typing import Union, Callable, List, Dict, Optional, Tuple, Any, \
+    TYPE_CHECKING
+import logging
+
+from carcosa import scripts
+
+from .job import Job
+from .errors import ClusterClientError
+
+if TYPE_CHECKING:
+    from carcosa.cluster import ClusterClient
+
+
+class Pipeline:
+    """
+    DAG of jobs. A job passed as an argument of another job is replaced, when
+    the downstream job runs, by its return value. The value is read from the
+    result file of the upstream job, so it never goes through the client.
+
+    Example::
+
+        p = Pipeline(client)
+        a = p.add(preprocess, args=['input.txt'])
+        b = p.add(compute, args=[a, 10])
+        c = p.add(report, kwargs={'data': b}, after=[a])
+        p.submit()
+    """
+    def __init__(self, client: 'ClusterClient') -> None:
+        """
+        Args:
+            client (ClusterClient):
+                Client used to create and launch the jobs.
+        """
+        self.client = client
+        self._stages: List[Tuple[Job, List, Dict, List[Job]]] = []
+
+    @property
+    def jobs(self) -> List[Job]:
+        """
+        Jobs of the pipeline, in submission order.
+        """
+        return [s[0] for s in self._stages]
+
+    def add(self,
+            f: Union[Callable, str],
+            args: List = [],
+            kwargs: Dict = {},
+            after: List[Job] = [],
+            options: Dict = {},
+            jobname: Optional[str] = None) -> Job:
+        """
+        Add a stage to the pipeline.
+
+        Args:
+            f (Union[Callable, str]):
+                Function or command to execute.
+            args (list, optional):
+                Arguments for the function, jobs are passed by reference.
+            kwargs (dict, optional):
+                Keyword arguments for the function, jobs are passed by
+                reference.
+            after (list, optional):
+                Jobs that must finish successfully before this one starts,
+                besides the ones passed as arguments.
+            options (dict, optional):
+                Options for the queue system, see
+                :meth:`ClusterClient.new_job`.
+            jobname (str, optional):
+                Name of the job.
+
+        Returns:
+            Job: The job of the new stage, not launched yet.
+        """
+        upstream = [a for a in args if isinstance(a, Job)]
+        upstream += [v for v in kwargs.values() if isinstance(v, Job)]
+        if upstream and isinstance(f, str):
+            raise TypeError('Only python functions can take job results')
+
+        deps: List[Job] = []
+        for j in list(after) + upstream:
+            if j not in self.jobs and not j.launched:
+                e_msg = 'Dependency {} is not part of the pipeline'.format(j)
+                logging.error(e_msg)
+                raise ValueError(e_msg)
+            if j not in deps:
+                deps.append(j)
+
+        job = self.client.new_job(f, options=dict(options), jobname=jobname)
+        self._stages.append((job, list(args), dict(kwargs), deps))
+        return job
+
+    def submit(self) -> List[Job]:
+        """
+        Submit all the stages. Stages can only depend on previous stages, so
+        submitting them in insertion order is a valid topological order.
+
+        Returns:
+            jobs (list): Launched jobs.
+
+        If the client throttles the submissions, the stages after a held
+        one are not submitted, call this method again once it's released.
+
+        Raises:
+            ClusterClientError:
+                The queue system didn't return an id for a stage, so its
+                dependants can not be submitted.
+        """
+        for job, args, kwargs, deps in self._stages:
+            if job.launched or job.backlogged:
+                continue
+
+            if any(d.backlogged for d in deps):
+                logging.info('Stages after {} are held'.format(job))
+                break
+
+            dep_ids = []
+            for d in deps:
+                if d.id is None:
+                    e_msg = 'Dependency {} have not been submitted'.format(d)
+                    logging.error(e_msg)
+                    raise ClusterClientError(e_msg)
+                dep_ids.append(str(d.id))
+            if dep_ids:
+                job.options['dependency'] = 'afterok:' + ':'.join(dep_ids)
+
+            job.launch(
+                [self._resolve(a) for a in args],
+                {k: self._resolve(v) for k, v in kwargs.items()}
+                )
+            if job.backlogged:
+                continue
+            if job.id is None:
+                e_msg = 'Can not submit pipeline stage {}'.format(job)
+                logging.error(e_msg)
+                raise ClusterClientError(e_msg)
+
+        return self.jobs
+
+    @staticmethod
+    def _resolve(arg: Any) -> Any:
+        if isinstance(arg, Job):
+            return scripts.ref(arg.script.remote.filepath('out'))
+        return arg
@@ -0,0 +1,206 @@
+"""
+Registry of the running servers, stored in ``config.path``.
+
+The registry is a JSON file protected by an ``fcntl`` lock, so concurrent
+daemons get different ids, and ids are never reused after a crash. Entries
+of processes that don't exist anymore are pruned on every access.
+
+``config.path`` is usually in a home shared by several hosts (e.g. the login
+nodes of a cluster), so each entry records the host of its process. Only the
+entries of the current host can be checked, the rest are kept as they are
+and are not returned by :meth:`ServerRegistry.lookup`.
+"""
+from typing import Dict, Any, Optional, List, Iterator
+from contextlib import contextmanager
+import fcntl
+import errno
+import socket
+import json
+import logging
+import time
+import os
+
+from carcosa import config
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    """
+    Check if a process exists.
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # If EPERM is the error we don't have permissions to send the signal
+        # to the process, but it exists.
+        return e.errno == errno.EPERM
+    return True
+
+
+class ServerRegistry:
+    """
+    Each entry records the id, qsystem, host, pid, URI and start time of a
+    server. The pid is the one of the process that reserved the id until the
+    daemon registers itself, so an id reserved by a process that died is
+    pruned too.
+    """
+    REGISTRY_FILE = 'servers.json'
+    LOCK_FILE = 'servers.lock'
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """
+        Args:
+            path (str, optional):
+                Directory of the registry, ``config.path`` by default.
+        """
+        self._path = path
+
+    @property
+    def path(self) -> str:
+        return self._path or config.path
+
+    @property
+    def filepath(self) -> str:
+        return os.path.join(self.path, self.REGISTRY_FILE)
+
+    @contextmanager
+    def _locked(self, write: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Hold the registry lock and yield its content, pruned of the dead
+        servers of this host. If ``write`` is set, the content is saved when
+        the context exits.
+        """
+        with open(os.path.join(self.path, self.LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                data = self._load()
+                dead = [
+                    k for k, v in data['servers'].items()
+                    if self._local(v) and not pid_alive(v['pid'])
+                    ]
+                for k in dead:
+                    logging.info('Pruning dead server {}'.format(k))
+                    self._drop(data, k)
+
+                yield data
+
+                if write or dead:
+                    self._save(data)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.filepath, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.error('Corrupted server registry, starting a new one')
+        return {'next_id': 0, 'servers': {}, 'latest': {}}
+
+    def _save(self, data: Dict[str, Any]) -> None:
+        tmp = self.filepath + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.filepath)
+
+    @staticmethod
+    def _local(entry: Dict[str, Any]) -> bool:
+        """
+        Check if an entry is of a process of this host. Entries written
+        before the hosts were recorded are taken as local.
+        """
+        host = socket.gethostname()
+        return entry.get('host', host) == host
+
+    @staticmethod
+    def _drop(data: Dict[str, Any], key: str) -> None:
+        entry = data['servers'].pop(key)
+        qsystem = entry['qsystem']
+        if data['latest'].get(qsystem) != entry['id']:
+            return
+        # Fall back to the newest remaining server of the same qsystem.
+        candidates = [
+            v['id'] for v in data['servers'].values()
+            if v['qsystem'] == qsystem and v['uri']
+            ]
+        if candidates:
+            data['latest'][qsystem] = max(candidates)
+        else:
+            del data['latest'][qsystem]
+
+    def reserve(self, qsystem: str) -> int:
+        """
+        Get a new server id for a qsystem.
+
+        Returns:
+            id (int)
+        """
+        with self._locked() as data:
+            id_ = data['next_id']
+            data['next_id'] += 1
+            data['servers'][str(id_)] = {
+                'id': id_,
+                'qsystem': qsystem,
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'uri': None,
+                'started': time.time()
+                }
+        return id_
+
+    def register(self, id_: int, pid: int, uri: str) -> None:
+        """
+        Record the pid and URI of a started daemon, making it the server
+        returned by :meth:`lookup` for its qsystem.
+        """
+        with self._locked() as data:
+            entry = data['servers'].get(str(id_))
+            if entry is None:
+                raise KeyError('Server {} is not reserved'.format(id_))
+            entry['host'] = socket.gethostname()
+            entry['pid'] = pid
+            entry['uri'] = uri
+            data['latest'][entry['qsystem']] = id_
+
+    def remove(self, id_: int) -> None:
+        with self._locked() as data:
+            if str(id_) in data['servers']:
+                self._drop(data, str(id_))
+
+    def servers(self, qsystem: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Live servers, optionally filtered by qsystem. The servers of other
+        hosts are included, but they can't be checked.
+        """
+        with self._locked(write=False) as data:
+            return [
+                v for v in data['servers'].values()
+                if qsystem is None or v['qsystem'] == qsystem
+                ]
+
+    def lookup(self, qsystem: str) -> Optional[Dict[str, Any]]:
+        """
+        Latest live server of a qsystem that can accept connections, of this
+        host. If the latest server is of another host, the newest one of this
+        host is returned instead.
+
+        Returns:
+            entry (dict): None if there's no live server in this host.
+        """
+        with self._locked(write=False) as data:
+            id_ = data['latest'].get(qsystem)
+            if id_ is None:
+                return None
+            entry = data['servers'][str(id_)]
+            if self._local(entry):
+                return entry
+            local = [
+                v for v in data['servers'].values()
+                if v['qsystem'] == qsystem and v['uri'] and self._local(v)
+                ]
+            if not local:
+                return None
+            return max(local, key=lambda v: v['id'])
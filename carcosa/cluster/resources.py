@@ -0,0 +1,235 @@
+"""
+Right-sizing of the resources requested by the jobs.
+
+The usage of the finished jobs (elapsed time, resident memory and allocated
+CPUs, as accounted by ``sacct``) is recorded per family of jobs: function
+jobs are grouped by function, and command jobs by job name. New jobs of a
+family get their ``time``, ``memory`` and ``cpus_per_task`` options from a
+high percentile of the recorded usage plus some headroom, so they don't
+over-request resources and can be backfilled earlier.
+
+The history is a JSON file in ``config.path`` protected by an ``fcntl``
+lock, shared by all the clients of the user.
+"""
+from typing import Dict, Any, Optional, List, Iterable, Iterator, Tuple, \
+    Union, Callable
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+import math
+import re
+import os
+
+from .retry import parse_walltime, format_walltime
+from .stats import percentile
+
+from carcosa import config
+
+# Usage of a finished job: (elapsed seconds, max RSS bytes, allocated CPUs)
+Usage = Tuple[int, int, int]
+
+MEMORY_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+# Fields of the sacct rows, see SlurmServer.metrics
+_JOBID, _ALLOC_CPUS, _AVE_RSS, _ELAPSED = 0, 2, 8, 13
+
+
+def parse_memory(value: str) -> int:
+    """
+    Bytes of a memory value of ``sacct``, e.g. ``2048K``. Values without
+    unit are bytes, empty values are 0.
+    """
+    value = value.strip()
+    if not value:
+        return 0
+    unit = MEMORY_UNITS.get(value[-1].upper())
+    if unit is None:
+        return int(float(value))
+    return int(float(value[:-1]) * unit)
+
+
+def family(f: Union[Callable, str], jobname: Optional[str]) -> str:
+    """
+    Family of a job: the qualified name of its function, or for commands its
+    job name without a trailing sequence number (``sim_12`` is ``sim``).
+    """
+    if not isinstance(f, str):
+        return '{}.{}'.format(f.__module__, f.__qualname__)
+    name = jobname or f
+    return re.sub(r'[_.-]?\d+$', '', name) or name
+
+
+def parse_usage(rows: Iterable[Tuple[str, ...]]) -> Dict[str, Usage]:
+    """
+    Usage of each job from the rows of ``sacct``. The memory is the maximum
+    of the steps of the job (``123.batch``, ``123.extern``...).
+
+    Returns:
+        usage (dict): Usage by job id.
+    """
+    elapsed: Dict[str, int] = dict()
+    cpus: Dict[str, int] = dict()
+    rss: Dict[str, int] = dict()
+    for row in rows:
+        if len(row) <= _ELAPSED or not row[_JOBID]:
+            continue
+        job_id, _, step = row[_JOBID].partition('.')
+        try:
+            rss[job_id] = max(rss.get(job_id, 0), parse_memory(row[_AVE_RSS]))
+            if not step:
+                elapsed[job_id] = parse_walltime(row[_ELAPSED])
+                cpus[job_id] = int(row[_ALLOC_CPUS] or 0)
+        except ValueError:
+            logging.warning('Invalid sacct row: {}'.format('|'.join(row)))
+
+    return {
+        job_id: (elapsed[job_id], rss.get(job_id, 0), cpus[job_id])
+        for job_id in elapsed
+        }
+
+
+class ResourceHistory:
+    """
+    Recorded usage of each family of jobs, and the options suggested from
+    it. See :meth:`ClusterClient.enable_right_sizing
+    <carcosa.cluster.ClusterClient.enable_right_sizing>`.
+    """
+    HISTORY_FILE = 'resources.json'
+    LOCK_FILE = 'resources.lock'
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 quantile: float = 95,
+                 headroom: float = 1.2,
+                 min_samples: int = 3,
+                 max_samples: int = 200) -> None:
+        """
+        Args:
+            path (str, optional):
+                Directory of the history, ``config.path`` by default.
+            quantile (float, optional):
+                Percentile (0-100) of the recorded usage used for the
+                suggestions.
+            headroom (float, optional):
+                Multiplier of the percentile, so jobs that use a bit more
+                than the previous ones are not killed.
+            min_samples (int, optional):
+                Recorded jobs of a family needed to suggest options.
+            max_samples (int, optional):
+                Most recent jobs kept per family.
+        """
+        self._path = path
+        self.quantile = quantile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+
+        # Suggestions by family, valid while the history file is not
+        # modified (by any client), so new jobs don't lock and parse it.
+        self._suggested: Dict[str, Dict[str, Any]] = dict()
+        self._mtime: Optional[int] = None
+
+    @property
+    def path(self) -> str:
+        return self._path or config.path
+
+    @property
+    def filepath(self) -> str:
+        return os.path.join(self.path, self.HISTORY_FILE)
+
+    @contextmanager
+    def _locked(self, write: bool = True) -> Iterator[Dict[str, Any]]:
+        with open(os.path.join(self.path, self.LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                data = self._load()
+                yield data
+                if write:
+                    self._save(data)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.filepath, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.error('Corrupted resource history, starting a new one')
+        return {'families': {}}
+
+    def _save(self, data: Dict[str, Any]) -> None:
+        tmp = self.filepath + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.filepath)
+
+    def record(self, usage: Dict[str, List[Usage]]) -> None:
+        """
+        Add the usage of finished jobs to the history.
+
+        Args:
+            usage (dict): Usage of the jobs, by family.
+        """
+        with self._locked() as data:
+            families = data['families']
+            for name, samples in usage.items():
+                kept = families.get(name, []) + [list(s) for s in samples]
+                families[name] = kept[-self.max_samples:]
+        self._suggested.clear()
+
+    def samples(self, name: str) -> List[Usage]:
+        """
+        Recorded usage of a family, oldest first.
+        """
+        with self._locked(write=False) as data:
+            return [tuple(s) for s in data['families'].get(name, [])]
+
+    def suggest(self, name: str) -> Dict[str, Any]:
+        """
+        Options suggested for a new job of a family: ``time``, ``memory``
+        (in megabytes) and ``cpus_per_task``. Slurm accounts the allocated
+        CPUs and not the used ones, so the suggested CPUs are the usual
+        allocation of the family, without headroom.
+
+        The suggestions are cached until the history changes.
+
+        Returns:
+            options (dict): Empty if there are not enough recorded jobs.
+        """
+        try:
+            mtime: Optional[int] = os.stat(self.filepath).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._mtime:
+            self._suggested.clear()
+            self._mtime = mtime
+        options = self._suggested.get(name)
+        if options is None:
+            options = self._suggested[name] = self._suggest(name)
+        return dict(options)
+
+    def _suggest(self, name: str) -> Dict[str, Any]:
+        samples = self.samples(name)
+        if not samples or len(samples) < self.min_samples:
+            return dict()
+
+        elapsed, rss, cpus = zip(*samples)
+        options: Dict[str, Any] = dict()
+
+        seconds = percentile(list(elapsed), self.quantile) * self.headroom
+        # Rounded up to minutes, the granularity of the slurm time limits.
+        options['time'] = format_walltime(max(1, math.ceil(seconds / 60)) * 60)
+
+        memory = percentile(list(rss), self.quantile) * self.headroom
+        if memory > 0:
+            options['memory'] = '{}M'.format(
+                max(1, math.ceil(memory / MEMORY_UNITS['M']))
+                )
+
+        allocated = int(percentile(list(cpus), self.quantile))
+        if allocated > 0:
+            options['cpus_per_task'] = allocated
+        return options
@@ -0,0 +1,219 @@
+"""
+Shared log of function job results, an alternative to a result file per job.
+
+The runners append a framed record per result to a shard of the log, one
+shard per node, so the appends of different nodes never share a file. A
+frame is a header (``MAGIC``, key length, payload length and CRC32 of the key
+and the payload), the key (the name of the result file the job would have
+written) and the marshal payload. A torn or corrupted frame is skipped when
+reading, the rest of the shard is still readable.
+
+The runners also append the location of each record to an index bucket
+(``{name}-idx.XX``), used to resolve the references of the pipelines without
+scanning the shards, see :data:`carcosa.scripts.RESULT_FRAME`.
+"""
+from typing import Dict, Tuple, Iterator, Optional, List, Set
+import logging
+import zlib
+import os
+
+from carcosa.scripts import RESULT_FRAME, RESULT_MAGIC
+
+# Location of a record payload: (shard path, offset, length)
+Location = Tuple[str, int, int]
+
+
+def frame(key: str, payload: bytes) -> bytes:
+    """
+    Frame a record, as the runners do.
+    """
+    k = key.encode('utf-8')
+    return RESULT_FRAME.pack(
+        RESULT_MAGIC, len(k), len(payload), zlib.crc32(k + payload)
+        ) + k + payload
+
+
+def scan(path: str,
+         offset: int = 0,
+         payloads: bool = False) -> Iterator[Tuple[str, int, int, bytes]]:
+    """
+    Read the frames of a shard sequentially from ``offset``.
+
+    Args:
+        path (str):
+            Path of the shard.
+        offset (int, optional):
+            Offset of the first frame.
+        payloads (bool, optional):
+            Yield the payloads, if not set an empty string is yielded
+            instead.
+
+    Yields:
+        key (str), offset (int), length (int), payload (bytes):
+            Offset and length of the payload of each valid frame. The offset
+            after the last complete frame is yielded last, with an empty
+            key, so the scan can be resumed from there.
+    """
+    size = RESULT_FRAME.size
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+
+    pos = 0
+    while pos + size <= len(data):
+        magic, klen, plen, crc = RESULT_FRAME.unpack_from(data, pos)
+        end = pos + size + klen + plen
+        if magic != RESULT_MAGIC:
+            pos = _resync(data, pos + 1)
+            continue
+        if end > len(data):
+            # Incomplete frame, it's being written.
+            break
+        body = data[pos + size:end]
+        if zlib.crc32(body) != crc:
+            logging.warning('Corrupted result frame in {} at {}'.format(
+                path, offset + pos
+                ))
+            pos = _resync(data, pos + 1)
+            continue
+        key = body[:klen].decode('utf-8', errors='replace')
+        yield (
+            key, offset + pos + size + klen, plen,
+            body[klen:] if payloads else b''
+            )
+        pos = end
+    yield ('', offset + pos, 0, b'')
+
+
+def _resync(data: bytes, pos: int) -> int:
+    # Next possible frame after a corrupted one.
+    found = data.find(RESULT_MAGIC, pos)
+    return len(data) if found == -1 else found
+
+
+class ResultsLog:
+    """
+    Results log of a client session, stored as ``{name}.{hostname}`` shards
+    in a job directory.
+
+    The keys found in the shards are indexed with the location of their
+    payload, so getting a result is a seek and a read. The index is updated
+    incrementally, only the bytes appended since the last update are read.
+    If a key is written more than once (a relaunched job), the last record
+    wins.
+    """
+    SUFFIX = '.results'
+    INDEX_SUFFIX = '-idx.'
+
+    def __init__(self,
+                 name: str,
+                 local_path: str,
+                 remote_path: str) -> None:
+        """
+        Args:
+            name (str):
+                Name of the session, the shards are named after it.
+            local_path (str):
+                Directory of the shards in the local filesystem.
+            remote_path (str):
+                Directory of the shards in the remote filesystem.
+        """
+        self.name = name + self.SUFFIX
+        self.local_path = local_path
+        self.remote_path = remote_path
+
+        self._index: Dict[str, Location] = dict()
+        # Offset up to which each shard is indexed.
+        self._offsets: Dict[str, int] = dict()
+
+    def prefix(self, remote: bool = False) -> str:
+        """
+        Path of the log without the shard suffix, it's passed to the runners.
+        """
+        return os.path.join(
+            self.remote_path if remote else self.local_path, self.name
+            )
+
+    def shards(self) -> List[str]:
+        """
+        Local paths of the shards of the log.
+        """
+        start = self.name + '.'
+        with os.scandir(self.local_path) as it:
+            return sorted(
+                e.path for e in it
+                if e.name.startswith(start) and not e.name.endswith('.tmp')
+                )
+
+    def index_files(self) -> List[str]:
+        """
+        Local paths of the index buckets written by the runners.
+        """
+        start = self.name + self.INDEX_SUFFIX
+        with os.scandir(self.local_path) as it:
+            return sorted(e.path for e in it if e.name.startswith(start))
+
+    def refresh(self) -> int:
+        """
+        Index the records appended since the last refresh.
+
+        Returns:
+            new (int): Number of records read.
+        """
+        new = 0
+        for shard in self.shards():
+            offset = self._offsets.get(shard, 0)
+            if os.path.getsize(shard) == offset:
+                continue
+            for key, poff, plen, _ in scan(shard, offset):
+                if key:
+                    self._index[key] = (shard, poff, plen)
+                    new += 1
+                else:
+                    self._offsets[shard] = poff
+        return new
+
+    def reset(self) -> None:
+        """
+        Forget the index, after the shards have been removed.
+        """
+        self._index.clear()
+        self._offsets.clear()
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._index)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Payload of the last record of a key, None if it's not in the log.
+        The index is refreshed first, a resubmitted job may have appended a
+        new record of a key already indexed.
+        """
+        self.refresh()
+        loc = self._index.get(key)
+        if loc is None:
+            return None
+
+        shard, offset, length = loc
+        with open(shard, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def items(self, keys: Optional[Set[str]] = None) \
+            -> Iterator[Tuple[str, bytes]]:
+        """
+        Read all the records of the log (or only the ones of ``keys``) with
+        a sequential scan of the shards. The index is updated on the way.
+        """
+        for shard in self.shards():
+            for key, poff, plen, payload in scan(shard, payloads=True):
+                if not key:
+                    self._offsets[shard] = poff
+                    continue
+                self._index[key] = (shard, poff, plen)
+                if keys is None or key in keys:
+                    yield key, payload
@@ -0,0 +1,266 @@
+"""
+Automatic resubmission of failed jobs.
+
+The final state of a job decides what to do with it: jobs that failed
+because of the cluster (a node failure, a preemption...) are resubmitted
+after an exponential backoff, jobs that reached their time limit are
+resubmitted with a longer one, and jobs that failed by themselves are left
+alone. Resubmissions reuse the scripts and the payload generated when the
+job was launched, see :meth:`Job.resubmit
+<carcosa.cluster.Job.resubmit>`.
+"""
+from typing import Optional, Dict, List, TYPE_CHECKING
+import threading
+import logging
+import time
+
+from .states import STATE_NAMES
+from .table import LAUNCHED, INPUTS_REMOVED, BACKLOGGED
+
+if TYPE_CHECKING:
+    from carcosa.cluster import ClusterClient, Job
+
+# Actions for a final state
+RETRY = 'retry'
+EXTEND = 'extend'
+TERMINAL = 'terminal'
+
+
+def parse_walltime(walltime: str) -> int:
+    """
+    Seconds of a slurm time limit: ``minutes``, ``minutes:seconds``,
+    ``hours:minutes:seconds``, ``days-hours``, ``days-hours:minutes`` or
+    ``days-hours:minutes:seconds``.
+
+    Raises:
+        ValueError: Invalid time limit.
+    """
+    days, sep, rest = str(walltime).strip().rpartition('-')
+    parts = [int(p) for p in rest.split(':')]
+    if sep:
+        # days-hours[:minutes[:seconds]]
+        parts += [0] * (3 - len(parts))
+        hours, minutes, seconds = parts
+        return ((int(days) * 24 + hours) * 60 + minutes) * 60 + seconds
+    if len(parts) == 1:
+        return parts[0] * 60
+    if len(parts) == 2:
+        return parts[0] * 60 + parts[1]
+    if len(parts) == 3:
+        return (parts[0] * 60 + parts[1]) * 60 + parts[2]
+    raise ValueError('Invalid time limit: {}'.format(walltime))
+
+
+def format_walltime(seconds: int) -> str:
+    """
+    Time limit in ``DD-HH:MM:SS`` format.
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return '{}-{:02d}:{:02d}:{:02d}'.format(days, hours, minutes, seconds)
+
+
+class RetryPolicy:
+    """
+    What to do with each final state, and how long to wait before retrying.
+    """
+    ACTIONS = {
+        'node_fail': RETRY,
+        'preempted': RETRY,
+        'boot_fail': RETRY,
+        'timeout': EXTEND,
+        'failed': TERMINAL
+        }
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 backoff: float = 60.0,
+                 factor: float = 2.0,
+                 max_backoff: float = 3600.0,
+                 time_factor: float = 2.0,
+                 max_time: Optional[str] = None,
+                 actions: Optional[Dict[str, str]] = None) -> None:
+        """
+        Args:
+            max_retries (int, optional):
+                Maximum number of resubmissions of a job.
+            backoff (float, optional):
+                Seconds to wait before the first retry.
+            factor (float, optional):
+                Multiplier of the wait for each following retry.
+            max_backoff (float, optional):
+                Maximum wait, in seconds.
+            time_factor (float, optional):
+                Multiplier of the time limit of the jobs that timed out.
+            max_time (str, optional):
+                Maximum time limit, e.g. the limit of the partition.
+            actions (dict, optional):
+                Action (``'retry'``, ``'extend'`` or ``'terminal'``) for the
+                states, they override the default ones in :data:`ACTIONS`.
+                States without an action are terminal.
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.time_factor = time_factor
+        self.max_time = max_time
+
+        self.actions = dict(self.ACTIONS)
+        self.actions.update(actions or {})
+        for state, action in self.actions.items():
+            if action not in (RETRY, EXTEND, TERMINAL):
+                e_msg = 'Unknown retry action {} for {}'.format(action, state)
+                logging.error(e_msg)
+                raise ValueError(e_msg)
+
+    def action(self, status: str) -> str:
+        return self.actions.get(status, TERMINAL)
+
+    def delay(self, attempt: int) -> float:
+        """
+        Seconds to wait before the retry number ``attempt`` (from 0).
+        """
+        return min(self.max_backoff, self.backoff * self.factor ** attempt)
+
+    def extend(self, walltime: str) -> Optional[str]:
+        """
+        Time limit for the retry of a job that timed out, None if it can not
+        be extended.
+        """
+        seconds = parse_walltime(walltime) * self.time_factor
+        if self.max_time is not None:
+            limit = parse_walltime(self.max_time)
+            if parse_walltime(walltime) >= limit:
+                return None
+            seconds = min(seconds, limit)
+        return format_walltime(seconds)
+
+
+class Retrier:
+    """
+    Resubmits the failed jobs of a client following a :class:`RetryPolicy`.
+
+    :meth:`check` looks at the states the jobs already have, so they must be
+    updated before. It can be called on demand, or periodically in a
+    background thread with :meth:`start`.
+    """
+    def __init__(self,
+                 client: 'ClusterClient',
+                 policy: Optional[RetryPolicy] = None) -> None:
+        self.client = client
+        self.policy = policy or RetryPolicy()
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def check(self, jobs: Optional[List['Job']] = None) -> int:
+        """
+        Schedule the retry of the failed jobs, and resubmit the ones whose
+        backoff has expired.
+
+        Args:
+            jobs (list, optional):
+                Jobs to check, all the jobs of the client by default.
+
+        Returns:
+            resubmitted (int): Number of resubmitted jobs.
+        """
+        table = self.client.jobs
+        if jobs is None:
+            rows = range(len(table))
+        else:
+            rows = [j._row for j in jobs]
+
+        now = time.monotonic()
+        resubmitted = 0
+        for row in rows:
+            flags = table.flags[row]
+            if not flags & LAUNCHED or flags & (INPUTS_REMOVED | BACKLOGGED):
+                continue
+            status = STATE_NAMES[table.states[row]]
+            action = self.policy.action(status)
+            if action == TERMINAL:
+                continue
+
+            job = table.view(row)
+            extra = job._extra()
+            attempts = extra.get('attempts', 0)
+            if attempts >= self.policy.max_retries:
+                continue
+
+            retry_at = extra.get('retry_at')
+            if retry_at is None:
+                delay = self.policy.delay(attempts)
+                extra['retry_at'] = now + delay
+                logging.info('Retrying {} ({}) in {:.0f}s'.format(
+                    job, status, delay
+                    ))
+                if delay > 0:
+                    continue
+            elif retry_at > now:
+                continue
+
+            if self._resubmit(job, action):
+                resubmitted += 1
+        return resubmitted
+
+    def _resubmit(self, job: 'Job', action: str) -> bool:
+        extra = job._extra()
+        options = job.options
+        sbatch_args: List[str] = []
+        if action == EXTEND:
+            walltime = job.options.get('time')
+            new_time = self.policy.extend(walltime) if walltime else None
+            if new_time is None:
+                logging.warning(
+                    'Can not extend the time limit of {}, not retrying'.format(
+                        job
+                        )
+                    )
+                extra['attempts'] = self.policy.max_retries
+                return False
+            # The options may be shared by the tasks of an array job.
+            job._table.options[job._row] = dict(job.options, time=new_time)
+            sbatch_args.append('--time={}'.format(new_time))
+
+        # The retry is only spent if the job is submitted.
+        retry_at = extra.pop('retry_at')
+        attempts = extra.get('attempts', 0)
+        extra['attempts'] = attempts + 1
+        try:
+            job.resubmit(sbatch_args)
+        except Exception:
+            extra['retry_at'], extra['attempts'] = retry_at, attempts
+            job._table.options[job._row] = options
+            raise
+        return True
+
+    def start(self, interval: float = 60.0) -> None:
+        """
+        Check the jobs every ``interval`` seconds in a daemon thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            logging.warning('Retrier already running')
+            return
+
+        def loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    logging.error('Retrier failed: {}'.format(e))
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread, if it's running.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,96 @@
+"""
+Helpers to mark the remote methods of the servers without importing Pyro4.
+
+Pyro4 takes a long time to import (it pulls ssl, socket, serializers...), and
+it's only needed when a client connects or a daemon starts. The server
+classes are defined at import time, so they use :func:`expose` instead of
+``Pyro4.expose``; it sets the same ``_pyroExposed`` attribute that Pyro4
+looks for when it lists the members of an object.
+"""
+from typing import TypeVar, Any, List
+import importlib.util
+import base64
+import logging
+import types
+
+from carcosa import config
+
+T = TypeVar('T')
+
+
+def expose(method_or_class: T) -> T:
+    """
+    Equivalent to ``Pyro4.expose``, it can decorate a method, a property or a
+    whole class.
+    """
+    if isinstance(method_or_class, property):
+        for attr in ('fget', 'fset', 'fdel'):
+            func = getattr(method_or_class, attr, None)
+            if func is not None:
+                _check_public(func.__name__)
+                func._pyroExposed = True
+        return method_or_class
+
+    name = getattr(method_or_class, '__name__', None)
+    if name is None:
+        raise AttributeError(
+            '@expose can not determine what this is: {!r}'.format(
+                method_or_class
+                )
+            )
+    _check_public(name)
+
+    if isinstance(method_or_class, type):
+        for attr, thing in vars(method_or_class).items():
+            if attr.startswith('_'):
+                continue
+            if isinstance(thing, types.FunctionType):
+                thing._pyroExposed = True
+            elif isinstance(thing, property):
+                for a in ('fget', 'fset', 'fdel'):
+                    func = getattr(thing, a, None)
+                    if func is not None:
+                        func._pyroExposed = True
+    method_or_class._pyroExposed = True  # type: ignore
+    return method_or_class
+
+
+def _check_public(name: str) -> None:
+    if name.startswith('_'):
+        raise AttributeError(
+            'exposing private names (starting with _) is not allowed'
+            )
+
+
+def to_bytes(data: Any) -> bytes:
+    """
+    Bytes received through Pyro4. The serpent serializer sends them as a dict
+    with the base64 encoded data, other serializers as bytes.
+    """
+    if isinstance(data, dict) and data.get('encoding') == 'base64':
+        return base64.b64decode(data['data'])
+    return bytes(data)
+
+
+def available_serializers() -> List[str]:
+    """
+    Serializers of :py:attr:`Config.SERIALIZERS
+    <carcosa.config.Config.SERIALIZERS>` whose packages are installed.
+    """
+    return [
+        name for name in config.SERIALIZERS
+        if name != 'msgpack' or importlib.util.find_spec('msgpack')
+        ]
+
+
+def client_serializer() -> str:
+    """
+    Serializer for a new proxy: the configured one if it's available.
+    """
+    name = config.serializer
+    if name not in available_serializers():
+        logging.warning('Serializer {} is not available, using {}'.format(
+            name, config.DEFAULT_SERIALIZER
+            ))
+        return config.DEFAULT_SERIALIZER
+    return name
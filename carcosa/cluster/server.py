@@ -1,6 +1,8 @@
-from typing import Tuple, Union, Optional, Iterator, List
-import Pyro4
+from typing import Tuple, Union, Optional, List, Dict, Set, Any, \
+    TYPE_CHECKING
 import subprocess
+import threading
+import time
 import os
 import errno
 import logging
@@ -8,6 +10,16 @@ import logging
 from carcosa import config
 
 from . import errors
+from .stats import ServerStats, instrument
+from .rpc import expose, to_bytes, available_serializers
+from .inline import InlinePool
+from .events import EventLog
+from .aggregate import parse_jobs, summarize
+from .registry import ServerRegistry
+from . import logs
+
+if TYPE_CHECKING:
+    import Pyro4
 
 
 class ClusterServer:
@@ -21,10 +33,85 @@ class ClusterServer:
     PID_FILE = '{qtype}-{id}.pid'
     URI_FILE = '{qtype}-{id}.uri'
     LOG_FILE = '{qtype}-{id}.log'
-
-    def __init__(self) -> None:
+    STATS_FILE = '{qtype}-{id}.prom'
+
+    def __init__(self,
+                 stats_interval: Optional[float] = None,
+                 inline_workers: int = 2,
+                 inline_cpu_time: Optional[int] = 10,
+                 inline_memory: Optional[int] = 512 << 20,
+                 events_refresh: float = 5.0) -> None:
+        """
+        Args:
+            stats_interval (float, optional):
+                If set, the daemon writes its stats in Prometheus text format
+                to :py:attr:`stats_filepath` every ``stats_interval`` seconds.
+            inline_workers (int, optional):
+                Worker processes for :meth:`run_inline`.
+            inline_cpu_time (int, optional):
+                Seconds of CPU an inline call can use.
+            inline_memory (int, optional):
+                Memory limit of the inline workers, in bytes.
+            events_refresh (float, optional):
+                Minimum seconds between queries of the queue system for
+                :meth:`changes_since`, the clients polling more often share
+                the same query.
+        """
         self._id: Optional[int] = None
-        self._daemon: Pyro4.daemon = None
+        self._daemon: Optional['Pyro4.Daemon'] = None
+        self._stats = ServerStats()
+        self.stats_interval = stats_interval
+        self.registry = ServerRegistry()
+        self.inline = InlinePool(
+            workers=inline_workers,
+            cpu_time=inline_cpu_time,
+            memory=inline_memory
+            )
+
+        # State changes of the jobs, see :meth:`changes_since`.
+        self.events = EventLog()
+        self.events_refresh = events_refresh
+        self._events_polled: Optional[float] = None
+        self._events_lock = threading.Lock()
+
+        # Directories of the scripts submitted through this server, the only
+        # ones where :meth:`remove_files` removes files, and where
+        # :meth:`tail` and :meth:`search_log` read them. The working
+        # directories of the scripts, where the logs are written, can only
+        # be read.
+        self._job_dirs: Set[str] = set()
+        self._work_dirs: Set[str] = set()
+
+    def _add_job_dir(self, script_path: str) -> None:
+        """
+        Allow :meth:`remove_files` in the directory of a submitted script,
+        and reading the logs there and in its working directory
+        (``--workdir``).
+        """
+        self._job_dirs.add(os.path.dirname(os.path.realpath(script_path)))
+        try:
+            with open(script_path) as f:
+                for line in f:
+                    if line.startswith('#') and '--workdir=' in line:
+                        workdir = line.split('--workdir=', 1)[1].strip()
+                        self._work_dirs.add(os.path.realpath(workdir))
+        except OSError:
+            pass
+
+    def _in_job_dir(self, path: str, read: bool = False) -> bool:
+        """
+        Check if a path is under the directory of a submitted script, or
+        under its working directory if ``read`` is set.
+        """
+        dirs = self._job_dirs | self._work_dirs if read else self._job_dirs
+        d = os.path.dirname(os.path.realpath(path))
+        while True:
+            if d in dirs:
+                return True
+            parent = os.path.dirname(d)
+            if parent == d:
+                return False
+            d = parent
 
     @property
     def qsystem(self) -> str:
@@ -77,6 +164,21 @@ class ClusterServer:
                 )
             raise ValueError('ID not defined')
 
+    @property
+    def stats_filepath(self) -> str:
+        if self.id is not None:
+            stats_file = self.STATS_FILE.format(
+                qtype=self.qsystem,
+                id=self.id
+                )
+            return os.path.join(config.path, stats_file)
+        else:
+            logging.error(
+                'ID for this server is not defined. Make sure that you started'
+                ' the server through the daemonize method'
+                )
+            raise ValueError('ID not defined')
+
     @property
     def id(self) -> Optional[int]:
         return self._id
@@ -84,7 +186,9 @@ class ClusterServer:
     @classmethod
     def start(cls,
               host: Optional[str] = None,
-              port: int = 0) -> Tuple[str, str]:
+              port: int = 0,
+              stats_interval: Optional[float] = None,
+              reuse: bool = False) -> Tuple[str, str]:
         """
         Creates a new server instance and create a listening daemon.
 
@@ -95,6 +199,12 @@ class ClusterServer:
                 Host to bind the server.
             port (int, optional):
                 Port to bind the server.
+            stats_interval (float, optional):
+                Seconds between writes of the Prometheus stats file, if not
+                set the file is only written on demand.
+            reuse (bool, optional):
+                If there's a live server for the same queue system in the
+                registry, return it instead of starting a new one.
 
         Returns:
             pid (str):
@@ -102,47 +212,78 @@ class ClusterServer:
             uri (str):
                 URI of the remote server.
         """
-        obj = cls()
+        obj = cls(stats_interval=stats_interval)
+        if reuse:
+            entry = obj.registry.lookup(obj.qsystem)
+            if entry is not None:
+                logging.info('Reusing server {}'.format(entry['id']))
+                return (str(entry['pid']), entry['uri'])
         pid, uri = obj.daemonize(host=host, port=port)
         return (pid, uri)
 
     def _get_id(self) -> int:
         """
-        Get the current ClusterServer id, this is done by reading the PID files
-        in ~/.carcosa to look if there're more server instances running.
+        Get a new ClusterServer id from the server registry. Ids are reserved
+        under a lock, so servers started at the same time get different ids,
+        and they're never reused.
         """
-        id_ = 0
-        for f in os.listdir(config.path):
-            f_lst = f.split('.')
-            if len(f_lst) != 2:
-                continue
-
-            fname, ext = f_lst
-            if ext == 'pid':
-                fname_lst = fname.split('-')
-                if len(fname_lst) == 2 and fname_lst[0] == self.qsystem:
-                    id_ += 1
-
-        return id_
+        return self.registry.reserve(self.qsystem)
 
-    def _cmd(self, args) -> subprocess.CompletedProcess:
+    def _cmd(self, args, env=None) -> subprocess.CompletedProcess:
         # Python 3.5 > required
         logging.info('Executing {}'.format(' '.join(args)))
-        return subprocess.run(args)
+        binary = os.path.basename(args[0])
+        t0 = time.perf_counter()
+        res = subprocess.run(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            env=env
+            )
+        self._stats.cmd(binary, time.perf_counter() - t0, res.returncode)
+        return res
+
+    def export_stats(self) -> None:
+        """
+        Write the server stats in Prometheus text format to
+        :py:attr:`stats_filepath`. The file is replaced atomically, so it can
+        be scraped at any moment (e.g. by the node exporter textfile
+        collector).
+        """
+        labels = {'qsystem': self.qsystem, 'server': str(self.id)}
+        tmp = self.stats_filepath + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self._stats.prometheus(labels))
+        os.replace(tmp, self.stats_filepath)
+
+    def _stats_loop(self) -> None:
+        while self._daemon is not None:
+            try:
+                self.export_stats()
+            except OSError as e:
+                logging.error('Can not write the stats file: {}'.format(e))
+            time.sleep(self.stats_interval)
 
     def cleanup(self) -> None:
         """
-        Remove the pid, uri and log files.
+        Remove the pid, uri and log files, and the server from the registry.
         """
         self._daemon = None
+        self.inline.shutdown()
+        if self.id is not None:
+            self.registry.remove(self.id)
         if os.path.exists(self.pid_filepath):
             os.remove(self.pid_filepath)
         if os.path.exists(self.uri_filepath):
             os.remove(self.uri_filepath)
         if os.path.exists(self.log_filepath):
             os.remove(self.log_filepath)
+        if os.path.exists(self.stats_filepath):
+            os.remove(self.stats_filepath)
 
-    @Pyro4.expose
+    @expose
+    @instrument
     def shutdown(self) -> None:
         if self._daemon:
             self._daemon.shutdown()
@@ -152,10 +293,202 @@ class ClusterServer:
                 'Trying to shutdown a non existing server. Aborting'
                 )
 
-    @Pyro4.expose
+    @expose
+    @instrument
     def ping(self) -> str:
         return 'pong'
 
+    @expose
+    @instrument
+    def stats(self, export: bool = False) -> Dict[str, Any]:
+        """
+        Get the server stats: latency histograms, in-flight calls and errors
+        per remote method, and count, p50/p99 wall time and exit codes per
+        executed binary.
+
+        Args:
+            export (bool, optional):
+                Also write the stats in Prometheus text format to
+                :py:attr:`stats_filepath`.
+
+        Returns:
+            stats (dict)
+        """
+        if export:
+            self.export_stats()
+        return self._stats.snapshot()
+
+    def _check_readable(self, path: str) -> None:
+        if not self._in_job_dir(path, read=True):
+            e_msg = 'Refusing to read {}, not in a job directory'.format(path)
+            logging.error(e_msg)
+            raise errors.ClusterServerError(e_msg)
+
+    @expose
+    @instrument
+    def tail(self,
+             path: str,
+             offset: int = 0,
+             size: int = logs.TAIL_CHUNK) -> Tuple[str, int]:
+        """
+        Read a chunk of a file in the server host, used to follow the logs of
+        the jobs when the filesystem is not shared. See
+        :func:`carcosa.cluster.logs.read_chunk`.
+
+        Raises:
+            ClusterServerError:
+                The file is not in the directories of the jobs submitted
+                through this server.
+        """
+        self._check_readable(path)
+        if not os.path.isfile(path):
+            return ('', offset)
+        return logs.read_chunk(path, offset, size)
+
+    @expose
+    @instrument
+    def search_log(self,
+                   path: str,
+                   pattern: str,
+                   max_matches: int = 1000) -> List[Tuple[int, str]]:
+        """
+        Search a regular expression in a file in the server host. See
+        :func:`carcosa.cluster.logs.search`.
+
+        Raises:
+            ClusterServerError:
+                The file is not in the directories of the jobs submitted
+                through this server.
+        """
+        self._check_readable(path)
+        if not os.path.isfile(path):
+            return []
+        return logs.search(path, pattern, max_matches)
+
+    @expose
+    @instrument
+    def remove_files(self, paths: List[str]) -> int:
+        """
+        Remove files in the server host, used by the
+        :class:`~carcosa.cluster.janitor.Janitor` when the filesystem is not
+        shared. Files that don't exist are ignored. Only the files under the
+        directories of the scripts submitted through this server are
+        removed, the rest are refused.
+
+        Returns:
+            removed (int): Number of removed files.
+        """
+        removed = 0
+        for p in paths:
+            if not self._in_job_dir(p):
+                logging.warning(
+                    'Refusing to remove {}, not in a job directory'.format(p)
+                    )
+                continue
+            try:
+                os.remove(p)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error('Can not remove {}: {}'.format(p, e))
+        return removed
+
+    @expose
+    @instrument
+    def run_inline(self, payload: bytes) -> bytes:
+        """
+        Run a function in the server host and return its result, without
+        going through the queue system. It's meant for small tasks, like
+        checking files or aggregating results in the remote path: the calls
+        run in a small pool of processes with CPU time and memory limits,
+        see :mod:`carcosa.cluster.inline`.
+
+        Args:
+            payload (bytes):
+                Marshal of ``(code, args, kwargs)``, see
+                :func:`~carcosa.cluster.inline.encode_call`.
+
+        Returns:
+            result (bytes): Marshal of the result or the error of the call.
+
+        Raises:
+            ClusterServerError:
+                The call was refused, timed out or reached a limit.
+        """
+        return self.inline.run(to_bytes(payload))
+
+    @expose
+    @instrument
+    def changes_since(self,
+                      seq: int = 0,
+                      job_filter: Optional[Dict[str, Any]] = None) \
+            -> Dict[str, Any]:
+        """
+        State changes of the jobs of the user after a sequence number, see
+        :class:`~carcosa.cluster.events.EventLog`. The queue system is
+        queried at most every :py:attr:`events_refresh` seconds.
+
+        Args:
+            seq (int, optional):
+                Cursor returned by the previous call, 0 the first time.
+            job_filter (dict, optional):
+                Only the changes of the matching jobs, with the keys of
+                :meth:`cancel`.
+
+        Returns:
+            dict:
+                ``seq`` (the new cursor), ``changes`` (list of
+                ``(seq, job_id, state)``) and ``reset``.
+        """
+        with self._events_lock:
+            now = time.monotonic()
+            if self._events_polled is None or \
+                    now - self._events_polled >= self.events_refresh:
+                self.events.observe(self._queue_states())
+                self._events_polled = now
+        return self.events.since(seq, job_filter)
+
+    @expose
+    @instrument
+    def metrics_summary(self,
+                        group_by: List[str] = [],
+                        filters: Optional[Dict[str, Any]] = None,
+                        aggregates: List[str] = ['count'],
+                        since: Optional[str] = None,
+                        until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Aggregated accounting of the jobs of the user, computed here so only
+        the aggregated table is sent to the client, e.g. the mean wait per
+        partition::
+
+            server.metrics_summary(['partition'], aggregates=['mean:wait'])
+
+        See :func:`carcosa.cluster.aggregate.summarize` for the fields,
+        filters and aggregates.
+
+        Args:
+            group_by (list, optional):
+                Fields to group by.
+            filters (dict, optional):
+                Jobs to aggregate.
+            aggregates (list, optional):
+                Aggregates of each group.
+            since (str, optional):
+                Only the jobs since this time (e.g. ``2020-05-01`` or
+                ``now-7days``), since midnight by default.
+            until (str, optional):
+                Only the jobs until this time.
+
+        Returns:
+            rows (list): A dict per group.
+
+        Raises:
+            ValueError: Invalid group field, filter or aggregate.
+        """
+        jobs = parse_jobs(self._accounting(since, until))
+        return summarize(jobs.values(), group_by, filters, aggregates)
+
     def daemonize(self,
                   host: Optional[str] = None,
                   port: int = 0) -> Tuple[str, str]:
@@ -178,6 +511,8 @@ class ClusterServer:
             ClusterServerError:
                 When the server was not started correctly
         """
+        import Pyro4
+
         self._id = self._get_id()
         r_fd, w_fd = os.pipe()
         pid = os.fork()
@@ -189,6 +524,10 @@ class ClusterServer:
                 # process start.
                 os.close(r_fd)
                 w = os.fdopen(w_fd, 'w')
+                # Clients choose the serializer, see config.serializer.
+                Pyro4.config.SERIALIZERS_ACCEPTED = set(
+                    available_serializers()
+                    )
                 with Pyro4.Daemon(host=host, port=port) as daemon:
                     logging.info('Registering daemon')
                     uri = daemon.register(self)
@@ -202,6 +541,13 @@ class ClusterServer:
                     with open(self.uri_filepath, 'w') as f:
                         logging.info('URI {}. Saving to file'.format(uri))
                         f.write(str(uri))
+                    self.registry.register(self.id, os.getpid(), str(uri))
+
+                    if self.stats_interval:
+                        threading.Thread(
+                            target=self._stats_loop,
+                            daemon=True
+                            ).start()
 
                     # Avoid IO errors with stderr and stdout, redirect them to
                     # a logfile.
@@ -229,6 +575,10 @@ class ClusterServer:
                 # avoid blocking the parent process.
                 w.write('finish')
                 w.close()
+                try:
+                    self.registry.remove(self.id)
+                except OSError:
+                    pass
                 os._exit(0)
         else:
             os.close(w_fd)
@@ -264,8 +614,31 @@ class ClusterServer:
 
     # Pure virtual functions
     def metrics(self,
-                job_id: Optional[int] = None) -> Iterator[Tuple[str, ...]]:
+                job_id: Optional[int] = None) -> List[Tuple[str, ...]]:
+        """
+        ..note::
+
+            Pure virtual, this must be implemented by any subclass.
+        """
+        raise NotImplementedError('This must be implemented by subclasses.')
+
+    def _accounting(self,
+                    since: Optional[str] = None,
+                    until: Optional[str] = None) -> List[Tuple[str, ...]]:
         """
+        Accounting rows of the jobs of the user, with the fields of
+        :data:`~carcosa.cluster.aggregate.SUMMARY_FIELDS`.
+
+        ..note::
+
+            Pure virtual, this must be implemented by any subclass.
+        """
+        raise NotImplementedError('This must be implemented by subclasses.')
+
+    def _queue_states(self) -> Dict[str, Tuple[str, str]]:
+        """
+        State and name of the jobs of the user, by job id.
+
         ..note::
 
             Pure virtual, this must be implemented by any subclass.
@@ -288,6 +661,17 @@ class ClusterServer:
         """
         raise NotImplementedError('This must be implemented by subclasses.')
 
+    def queue_count(self) -> int:
+        """
+        Number of jobs of the user in the queue system, used to throttle
+        the submissions.
+
+        ..note::
+
+            Pure virtual, this must be implemented by any subclass.
+        """
+        raise NotImplementedError('This must be implemented by subclasses.')
+
     def kill(self, job_ids: List[Union[int, str]]) -> bool:
         """
         ..note::
@@ -296,8 +680,16 @@ class ClusterServer:
         """
         raise NotImplementedError('This must be implemented by subclasses.')
 
+    def cancel(self, job_filter: Dict[str, Any]) -> Dict[str, int]:
+        """
+        ..note::
+
+            Pure virtual, this must be implemented by any subclass.
+        """
+        raise NotImplementedError('This must be implemented by subclasses.')
+
     def queue_parser(self, job_id: Optional[str] = None) \
-            -> Iterator[Tuple[str, ...]]:
+            -> List[Tuple[str, str]]:
         """
         ..note::
 
@@ -0,0 +1,145 @@
+"""
+Snapshot of the jobs in the queue system, merged from several listings.
+
+The listings of the queue system (``squeue`` and ``sacct`` in Slurm) are
+merged in a single pass into a dict keyed by job id, with indexes by state
+and by name, so looking up a job or selecting the jobs in some states doesn't
+scan the listings again.
+"""
+from typing import Optional, Dict, List, Set, Tuple, Any, Iterator
+
+from .events import job_matcher
+
+
+def parent_id(job_id: str) -> str:
+    """
+    Id of the job of a step (``123.batch``, ``123_4.0``), the same id if it's
+    not a step.
+    """
+    return job_id.split('.', 1)[0]
+
+
+class QueueSnapshot:
+    """
+    State and name of the jobs of a snapshot of the queue system, by job id.
+    Steps are collapsed into their job.
+    """
+    def __init__(self) -> None:
+        # (state, name) by job id
+        self.jobs: Dict[str, Tuple[str, str]] = dict()
+        self._by_state: Dict[str, Set[str]] = dict()
+        self._by_name: Dict[str, Set[str]] = dict()
+
+    def add(self, job_id: str, state: str, name: str) -> None:
+        """
+        Add or replace a job. A step only adds its job if the job itself
+        has not been added, and it's replaced by the job once it is.
+        """
+        # Slurm adds the uid to cancelled jobs ("CANCELLED by 1000")
+        state = state.split(' ', 1)[0].lower()
+        jid = parent_id(job_id)
+        if jid != job_id and jid in self.jobs:
+            return
+
+        old = self.jobs.get(jid)
+        if old is not None:
+            self._by_state[old[0]].discard(jid)
+            self._by_name[old[1]].discard(jid)
+        self.jobs[jid] = (state, name)
+        self._by_state.setdefault(state, set()).add(jid)
+        self._by_name.setdefault(name, set()).add(jid)
+
+    def merge(self,
+              output: str,
+              array_parents: bool = False) -> 'QueueSnapshot':
+        """
+        Add the jobs of a listing, one ``id|state|name`` line per job. The
+        jobs already in the snapshot are replaced, so the listings are merged
+        from the oldest to the most current. Lines that are not jobs (e.g.
+        headers) are skipped.
+
+        Args:
+            output (str):
+                The listing.
+            array_parents (bool, optional):
+                Keep the lines of the pending tasks of an array
+                (``123_[1-10]``), skipped by default.
+
+        Returns:
+            QueueSnapshot: The snapshot.
+        """
+        for line in output.splitlines():
+            fields = line.split('|', 2)
+            if len(fields) != 3:
+                continue
+            jid, state, name = fields
+            if not jid[:1].isdigit() or \
+                    ('[' in jid and not array_parents):
+                continue
+            self.add(jid, state, name)
+        return self
+
+    def state(self, job_id: str) -> Optional[str]:
+        """
+        State of a job, None if it's not in the snapshot.
+        """
+        job = self.jobs.get(job_id)
+        return job[0] if job is not None else None
+
+    def with_state(self, state: str) -> Set[str]:
+        """
+        Ids of the jobs in a state.
+        """
+        return set(self._by_state.get(state.lower(), ()))
+
+    def with_name(self, name: str) -> Set[str]:
+        """
+        Ids of the jobs with a name.
+        """
+        return set(self._by_name.get(name, ()))
+
+    def select(self,
+               job_filter: Optional[Dict[str, Any]] = None) -> List[str]:
+        """
+        Ids of the jobs that match a filter, see
+        :func:`~carcosa.cluster.events.job_matcher`. The indexes narrow down
+        the jobs checked when the filter has ids or states.
+
+        Raises:
+            ValueError: Unknown keys in the filter.
+        """
+        job_filter = job_filter or {}
+        match = job_matcher(job_filter)
+        if job_filter.get('ids') is not None:
+            candidates: Any = [str(i) for i in job_filter['ids']]
+        elif job_filter.get('states') is not None:
+            candidates = set()
+            for state in job_filter['states']:
+                candidates |= self._by_state.get(state.lower(), set())
+        else:
+            candidates = self.jobs
+
+        selected = []
+        for jid in candidates:
+            job = self.jobs.get(jid)
+            if job is not None and match(jid, job[1], job[0]):
+                selected.append(jid)
+        return sorted(selected, key=_id_key)
+
+    def __contains__(self, job_id: object) -> bool:
+        return job_id in self.jobs
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.jobs)
+
+
+def _id_key(job_id: str) -> Tuple[int, int, str]:
+    jid, _, task = job_id.partition('_')
+    return (
+        int(jid) if jid.isdigit() else -1,
+        int(task) if task.isdigit() else -1,
+        job_id
+        )
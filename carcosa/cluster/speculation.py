@@ -0,0 +1,200 @@
+"""
+Speculative execution of the stragglers of an array job.
+
+Once most of the tasks of a :meth:`map <carcosa.cluster.ClusterClient.map>`
+are done, the tasks that have been running for much longer than their
+siblings (usually because they landed in a slow or overloaded node) are
+submitted again. Both copies compute the same result, the first one that
+writes it wins and the rest are cancelled.
+
+The copies are not jobs of the client, only the task they duplicate is. Once
+a copy wins, the task is completed and the cancellation of the original is
+not applied to it. Copies take a token of the submission throttle, if it's
+enabled, and are not submitted when there's no room for them.
+
+The start and end of the tasks are read from the timings file shared by the
+tasks (see :py:attr:`Job.timings <carcosa.cluster.Job.timings>`), so this
+needs the job directory to be reachable from the local host.
+"""
+from typing import List, Dict, Optional, Tuple, TYPE_CHECKING
+import threading
+import logging
+import time
+import os
+
+from .errors import SubmitLimitError
+from .stats import percentile
+from .table import RESOLVED
+
+if TYPE_CHECKING:
+    from carcosa.cluster import ClusterClient, Job
+
+
+class Speculator:
+    """
+    Watches the tasks of an array job and duplicates the stragglers.
+    """
+    def __init__(self,
+                 client: 'ClusterClient',
+                 jobs: List['Job'],
+                 quantile: float = 90,
+                 factor: float = 1.5,
+                 min_done: float = 0.75,
+                 max_duplicates: int = 1) -> None:
+        """
+        Args:
+            client (ClusterClient):
+                Client of the jobs.
+            jobs (list):
+                Tasks of an array job, as returned by ``map``.
+            quantile (float, optional):
+                Percentile (0-100) of the elapsed time of the finished tasks
+                used as reference.
+            factor (float, optional):
+                A running task is a straggler when its elapsed time is over
+                ``factor`` times the reference.
+            min_done (float, optional):
+                Fraction of the tasks that must be done before speculating.
+            max_duplicates (int, optional):
+                Maximum number of copies of a task.
+        """
+        self.client = client
+        self.jobs = jobs
+        self.quantile = quantile
+        self.factor = factor
+        self.min_done = min_done
+        self.max_duplicates = max_duplicates
+
+        # Ids of the copies of each task, by job row.
+        self.duplicates: Dict[int, List[str]] = dict()
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _times(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """
+        First start and first exit (realtime, ns) of each task.
+        """
+        import json
+
+        starts: Dict[int, int] = dict()
+        ends: Dict[int, int] = dict()
+        timings_file = self.jobs[0].script.local.filepath('timings')
+        if not os.path.isfile(timings_file):
+            return starts, ends
+
+        with open(timings_file) as f:
+            for line in f:
+                try:
+                    p = json.loads(line)
+                except ValueError:
+                    continue
+                if p['phase'] == 'script_start':
+                    starts.setdefault(p.get('task', -1), p['realtime'])
+                elif p['phase'] == 'exit':
+                    ends.setdefault(p.get('task', -1), p['realtime'])
+        return starts, ends
+
+    def _has_result(self, job: 'Job') -> bool:
+        log = self.client.results_log
+        if log is not None and job.script.out_file in log:
+            return True
+        return os.path.isfile(job.script.local.filepath('out'))
+
+    def check(self) -> int:
+        """
+        Cancel the remaining copies of the tasks that have a result, and
+        duplicate the stragglers.
+
+        Returns:
+            duplicated (int): Number of copies submitted.
+        """
+        starts, ends = self._times()
+        table = self.client.jobs
+
+        # The first copy that writes the result wins.
+        for row, ids in list(self.duplicates.items()):
+            job = table.view(row)
+            if job.finished or not self._has_result(job):
+                continue
+            logging.info('Task {} done, cancelling its copies'.format(job))
+            # The queue system reports the losers as cancelled.
+            job._set_flag(RESOLVED, True)
+            job.status = 'completed'
+            self.client.server.kill([job.id] + ids)
+
+        done: List[int] = []
+        running: List[Tuple['Job', int]] = []
+        for job in self.jobs:
+            task = table.tasks[job._row]
+            if job.finished or task in ends:
+                if task in starts and task in ends:
+                    done.append(ends[task] - starts[task])
+            elif task in starts:
+                running.append((job, task))
+
+        if not done or len(done) < self.min_done * len(self.jobs):
+            return 0
+
+        threshold = self.factor * percentile(done, self.quantile)
+        now = time.time() * 1e9
+        duplicated = 0
+        for job, task in running:
+            ids = self.duplicates.get(job._row, [])
+            if len(ids) >= self.max_duplicates:
+                continue
+            if now - starts[task] <= threshold or self._has_result(job):
+                continue
+
+            throttle = self.client.throttle
+            if throttle is not None and not throttle.reserve():
+                break
+            try:
+                array_id = self.client.submit(
+                    job.script, ['--array={}'.format(task)]
+                    )
+            except SubmitLimitError:
+                logging.warning('Submit limit reached, not duplicating')
+                break
+            if not array_id:
+                logging.error('Can not duplicate task {}'.format(job))
+                continue
+            logging.info('Task {} is a straggler, duplicated as {}_{}'.format(
+                job, array_id, task
+                ))
+            self.duplicates[job._row] = ids + [
+                '{}_{}'.format(array_id, task)
+                ]
+            duplicated += 1
+        return duplicated
+
+    def start(self, interval: float = 60.0) -> None:
+        """
+        Check the tasks every ``interval`` seconds in a daemon thread, until
+        all of them are finished.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            logging.warning('Speculator already running')
+            return
+
+        def loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    logging.error('Speculator failed: {}'.format(e))
+                if all(j.finished for j in self.jobs):
+                    break
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread, if it's running.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -1,3 +1,5 @@
+from typing import List
+
 GOOD_STATES = ['complete', 'completed', 'special_exit']
 ACTIVE_STATES = ['configuring', 'completing', 'pending',
                  'held', 'running', 'submitted']
@@ -7,3 +9,34 @@ UNCERTAIN_STATES = ['preempted', 'stopped',
                     'suspended']
 ALL_STATES = GOOD_STATES + ACTIVE_STATES + BAD_STATES + UNCERTAIN_STATES
 DONE_STATES = GOOD_STATES + BAD_STATES
+
+# Integer codes of the states, used by the compact job table. Code 0 is the
+# state of the jobs that have not been launched, and 1 the state of the
+# strings that are not a known state.
+INIT_STATE = 'carcosa_not_launched'
+UNKNOWN_STATE = 'unknown'
+STATE_NAMES = [INIT_STATE, UNKNOWN_STATE] + ALL_STATES
+STATE_CODES = {name: code for code, name in enumerate(STATE_NAMES)}
+
+
+def state_code(status: str) -> int:
+    """
+    Code of a state string. Slurm may add details after the state name (e.g.
+    ``CANCELLED by 1000``), only the first word is used.
+    """
+    status = status.lower()
+    if status in STATE_CODES:
+        return STATE_CODES[status]
+    words = status.split()
+    if words and words[0] in STATE_CODES:
+        return STATE_CODES[words[0]]
+    return STATE_CODES[UNKNOWN_STATE]
+
+
+def state_mask(states: List[str]) -> bytes:
+    """
+    Translation table (for ``bytes.translate``) that maps the codes of the
+    given states to 1 and the rest to 0.
+    """
+    codes = set(STATE_CODES[s] for s in states)
+    return bytes(1 if i in codes else 0 for i in range(256))
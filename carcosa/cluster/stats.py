@@ -0,0 +1,231 @@
+"""
+Instrumentation of the cluster server.
+
+Keeps latency histograms, in-flight counters and error counters for every
+remote call served by a :class:`~carcosa.cluster.ClusterServer`, and timings
+and exit codes for every subprocess executed by the queue system (``sbatch``,
+``squeue``, ``sacct``...).
+"""
+from typing import Dict, Any, Callable, Tuple, List, Optional, TypeVar, cast
+from collections import deque
+import functools
+import threading
+import time
+
+# Upper bounds (in seconds) of the RPC latency histogram buckets, the last
+# bucket (+Inf) is implicit.
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+    )
+
+# Number of wall times kept per binary to compute the percentiles.
+CMD_SAMPLES: int = 1024
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """
+    Nearest rank percentile of a list of samples.
+
+    Args:
+        samples (list):
+            Samples, they don't need to be sorted.
+        q (float):
+            Percentile to compute, between 0 and 100.
+
+    Returns:
+        value (float): 0.0 if there are no samples.
+    """
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    idx = int(round(q / 100.0 * (len(s) - 1)))
+    return s[min(max(idx, 0), len(s) - 1)]
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets, following the Prometheus
+    semantics.
+    """
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        List of ``(upper_bound, cumulative_count)``, the last one is ``+Inf``.
+        """
+        res = []
+        acc = 0
+        for bound, c in zip(self.buckets, self.counts):
+            acc += c
+            res.append((repr(bound), acc))
+        res.append(('+Inf', acc + self.counts[-1]))
+        return res
+
+
+class ServerStats:
+    """
+    Thread safe container of the server metrics. Pyro4 serves the requests
+    from a thread pool, so every update is done with the lock held.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started: float = time.time()
+        self._latency: Dict[str, Histogram] = {}
+        self._inflight: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        self._cmd_count: Dict[str, int] = {}
+        self._cmd_samples: Dict[str, deque] = {}
+        self._cmd_codes: Dict[str, Dict[int, int]] = {}
+
+    def rpc_start(self, method: str) -> None:
+        with self._lock:
+            self._inflight[method] = self._inflight.get(method, 0) + 1
+
+    def rpc_end(self, method: str, elapsed: float, error: bool) -> None:
+        with self._lock:
+            self._inflight[method] -= 1
+            if method not in self._latency:
+                self._latency[method] = Histogram()
+            self._latency[method].observe(elapsed)
+            if error:
+                self._errors[method] = self._errors.get(method, 0) + 1
+
+    def cmd(self, binary: str, elapsed: float, returncode: int) -> None:
+        with self._lock:
+            self._cmd_count[binary] = self._cmd_count.get(binary, 0) + 1
+            if binary not in self._cmd_samples:
+                self._cmd_samples[binary] = deque(maxlen=CMD_SAMPLES)
+                self._cmd_codes[binary] = {}
+            self._cmd_samples[binary].append(elapsed)
+            codes = self._cmd_codes[binary]
+            codes[returncode] = codes.get(returncode, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get all the metrics as a dictionary of builtin types, so it can be
+        serialized by Pyro4.
+        """
+        with self._lock:
+            rpc = {}
+            for m in set(self._latency) | set(self._inflight):
+                h = self._latency.get(m, Histogram())
+                rpc[m] = {
+                    'count': h.count,
+                    'sum': h.sum,
+                    'buckets': h.cumulative(),
+                    'inflight': self._inflight.get(m, 0),
+                    'errors': self._errors.get(m, 0)
+                    }
+            cmds = {}
+            for b, n in self._cmd_count.items():
+                samples = list(self._cmd_samples[b])
+                cmds[b] = {
+                    'count': n,
+                    'p50': percentile(samples, 50),
+                    'p99': percentile(samples, 99),
+                    'exit_codes': {
+                        str(k): v for k, v in self._cmd_codes[b].items()
+                        }
+                    }
+        return {'uptime': time.time() - self.started, 'rpc': rpc, 'cmd': cmds}
+
+    def prometheus(self, labels: Optional[Dict[str, str]] = None) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        Args:
+            labels (dict, optional):
+                Extra labels added to every sample (e.g. the qsystem and the
+                server id).
+        """
+        snap = self.snapshot()
+        base = dict(labels or {})
+
+        def fmt(extra: Dict[str, str]) -> str:
+            lbl = dict(base)
+            lbl.update(extra)
+            if not lbl:
+                return ''
+            return '{' + ','.join(
+                '{}="{}"'.format(k, v) for k, v in sorted(lbl.items())
+                ) + '}'
+
+        lines = [
+            '# TYPE carcosa_uptime_seconds gauge',
+            'carcosa_uptime_seconds{} {}'.format(fmt({}), snap['uptime']),
+            '# TYPE carcosa_rpc_latency_seconds histogram'
+            ]
+        for m, r in sorted(snap['rpc'].items()):
+            for le, c in r['buckets']:
+                lines.append('carcosa_rpc_latency_seconds_bucket{} {}'.format(
+                    fmt({'method': m, 'le': le}), c))
+            lines.append('carcosa_rpc_latency_seconds_sum{} {}'.format(
+                fmt({'method': m}), r['sum']))
+            lines.append('carcosa_rpc_latency_seconds_count{} {}'.format(
+                fmt({'method': m}), r['count']))
+        lines.append('# TYPE carcosa_rpc_inflight gauge')
+        for m, r in sorted(snap['rpc'].items()):
+            lines.append('carcosa_rpc_inflight{} {}'.format(
+                fmt({'method': m}), r['inflight']))
+        lines.append('# TYPE carcosa_rpc_errors_total counter')
+        for m, r in sorted(snap['rpc'].items()):
+            lines.append('carcosa_rpc_errors_total{} {}'.format(
+                fmt({'method': m}), r['errors']))
+
+        lines.append('# TYPE carcosa_cmd_total counter')
+        for b, c in sorted(snap['cmd'].items()):
+            lines.append('carcosa_cmd_total{} {}'.format(
+                fmt({'binary': b}), c['count']))
+        lines.append('# TYPE carcosa_cmd_seconds summary')
+        for b, c in sorted(snap['cmd'].items()):
+            for q, k in (('0.5', 'p50'), ('0.99', 'p99')):
+                lines.append('carcosa_cmd_seconds{} {}'.format(
+                    fmt({'binary': b, 'quantile': q}), c[k]))
+        lines.append('# TYPE carcosa_cmd_exit_codes_total counter')
+        for b, c in sorted(snap['cmd'].items()):
+            for code, n in sorted(c['exit_codes'].items()):
+                lines.append('carcosa_cmd_exit_codes_total{} {}'.format(
+                    fmt({'binary': b, 'code': code}), n))
+
+        return '\n'.join(lines) + '\n'
+
+
+def instrument(method: F) -> F:
+    """
+    Decorator for the remote methods of a
+    :class:`~carcosa.cluster.ClusterServer`, it records the latency, the
+    in-flight calls and the errors of every call in the server stats.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        stats = self._stats
+        stats.rpc_start(name)
+        error = False
+        t0 = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            stats.rpc_end(name, time.perf_counter() - t0, error)
+
+    return cast(F, wrapper)
@@ -0,0 +1,228 @@
+"""
+Compact storage of the jobs of a client.
+
+The ids, state codes, flags and timestamps of the jobs are stored in typed
+arrays, one row per job. :class:`~carcosa.cluster.Job` objects are just views
+of a row (a table and an index), created on access, so holding a lot of jobs
+doesn't hold a lot of python objects. Counting states and selecting jobs by
+state are done on the arrays instead of comparing strings job by job.
+"""
+from typing import List, Optional, Dict, Any, Iterator, Union, Callable, \
+    Tuple, overload, TYPE_CHECKING
+from array import array
+from collections import Counter
+from itertools import compress
+import time
+
+from .states import STATE_NAMES, STATE_CODES, DONE_STATES, INIT_STATE, \
+    state_code, state_mask
+
+from carcosa import scripts
+
+if TYPE_CHECKING:
+    from carcosa.cluster import ClusterClient, Job
+
+# Row flags
+LAUNCHED = 1 << 0
+PROFILING = 1 << 1
+# Files removed by the janitor, see carcosa.cluster.janitor
+INPUTS_REMOVED = 1 << 2
+RESULTS_REMOVED = 1 << 3
+LOGS_REMOVED = 1 << 4
+REMOVED = INPUTS_REMOVED | RESULTS_REMOVED | LOGS_REMOVED
+# Held by the submission throttle, see carcosa.cluster.throttle
+BACKLOGGED = 1 << 5
+# Usage added to the resource history, see carcosa.cluster.resources
+USAGE_RECORDED = 1 << 6
+# Finished by the client (a copy of the task won), the state changes of the
+# queue system are ignored, see carcosa.cluster.speculation
+RESOLVED = 1 << 7
+
+_UNFINISHED_MASK = state_mask(
+    [s for s in STATE_NAMES if s not in DONE_STATES]
+    )
+
+
+def _job_class() -> type:
+    # carcosa.cluster.job imports this module, so Job is imported on first
+    # use.
+    global _JOB
+    if _JOB is None:
+        from .job import Job
+        _JOB = Job
+    return _JOB
+
+
+_JOB: Optional[type] = None
+
+
+def parse_job_id(job_id: str) -> Tuple[int, int]:
+    """
+    Split a job id into the job id and the array task id (-1 if it's not an
+    array task), e.g. ``'123_4'`` is ``(123, 4)``.
+    """
+    jid, sep, task = str(job_id).strip().partition('_')
+    return int(jid), int(task) if sep else -1
+
+
+def format_job_id(jid: int, task: int) -> Optional[str]:
+    if jid < 0:
+        return None
+    if task < 0:
+        return str(jid)
+    return '{}_{}'.format(jid, task)
+
+
+class JobTable:
+    """
+    Sequence of the jobs of a client. It behaves as a list of
+    :class:`~carcosa.cluster.Job` (indexing, iteration, ``len``, ``in``), but
+    the jobs are created on access.
+    """
+    def __init__(self, client: 'ClusterClient') -> None:
+        self.client = client
+
+        # Packed columns
+        self.ids = array('q')
+        self.tasks = array('i')
+        self.states = array('B')
+        self.flags = array('B')
+        self.updated = array('d')
+        # Time the state was last confirmed by the queue system, and the
+        # max staleness of the state (negative: the default of the client),
+        # see Job.max_staleness
+        self.checked = array('d')
+        self.staleness = array('d')
+
+        # Object columns, for what can not be packed
+        self.functions: List[Union[Callable, str]] = []
+        self.scripts: List[scripts.Script] = []
+        self.options: List[Dict] = []
+        # Rarely used attributes, created on demand
+        self.extra: List[Optional[Dict[str, Any]]] = []
+
+        # Row of each (job id, task), see :meth:`find`.
+        self._index: Dict[Tuple[int, int], int] = dict()
+
+    def add(self,
+            f: Union[Callable, str],
+            script: scripts.Script,
+            options: Dict,
+            flags: int = 0) -> int:
+        """
+        Add a row for a new job.
+
+        Returns:
+            row (int): Index of the job in the table.
+        """
+        self.ids.append(-1)
+        self.tasks.append(-1)
+        self.states.append(STATE_CODES[INIT_STATE])
+        self.flags.append(flags)
+        now = time.time()
+        self.updated.append(now)
+        self.checked.append(now)
+        self.staleness.append(-1.0)
+        self.functions.append(f)
+        self.scripts.append(script)
+        self.options.append(options)
+        self.extra.append(None)
+        return len(self.ids) - 1
+
+    def set_id(self, row: int, job_id: Optional[str]) -> None:
+        """
+        Set the queue system id of a job, keeping the index of
+        :meth:`find` up to date.
+        """
+        old = (self.ids[row], self.tasks[row])
+        if self._index.get(old) == row:
+            del self._index[old]
+        if job_id is None:
+            jid, task = -1, -1
+        else:
+            jid, task = parse_job_id(job_id)
+            self._index[(jid, task)] = row
+        self.ids[row] = jid
+        self.tasks[row] = task
+
+    def find(self, job_id: str) -> Optional[int]:
+        """
+        Row of the job with a queue system id, None if there's none. If
+        several jobs had the same id, the last one that got it.
+        """
+        try:
+            return self._index.get(parse_job_id(job_id))
+        except ValueError:
+            return None
+
+    def view(self, row: int) -> 'Job':
+        return _job_class()._view(self, row)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @overload
+    def __getitem__(self, idx: int) -> 'Job':
+        ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> List['Job']:
+        ...
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.view(i) for i in range(len(self))[idx]]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('job index out of range')
+        return self.view(idx)
+
+    def __iter__(self) -> Iterator['Job']:
+        for i in range(len(self)):
+            yield self.view(i)
+
+    def __contains__(self, job: object) -> bool:
+        return getattr(job, '_table', None) is self
+
+    # Operations over the packed columns
+
+    def set_state(self, row: int, status: str) -> None:
+        self.states[row] = state_code(status)
+        self.updated[row] = self.checked[row] = time.time()
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Number of jobs in each state.
+        """
+        return {
+            STATE_NAMES[code]: n for code, n in Counter(self.states).items()
+            }
+
+    def count(self, state: str) -> int:
+        """
+        Number of jobs in a state.
+        """
+        return self.states.tobytes().count(bytes([STATE_CODES[state]]))
+
+    def rows(self, states: List[str]) -> List[int]:
+        """
+        Rows of the jobs in any of the given states.
+        """
+        mask = self.states.tobytes().translate(state_mask(states))
+        return list(compress(range(len(self)), mask))
+
+    def select(self, states: List[str]) -> List['Job']:
+        """
+        Jobs in any of the given states.
+        """
+        view = _job_class()._view
+        return [view(self, i) for i in self.rows(states)]
+
+    def unfinished(self) -> List['Job']:
+        """
+        Jobs that have not finished (including the ones not launched).
+        """
+        view = _job_class()._view
+        mask = self.states.tobytes().translate(_UNFINISHED_MASK)
+        return [view(self, i) for i in compress(range(len(self)), mask)]
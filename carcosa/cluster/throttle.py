@@ -0,0 +1,228 @@
+"""
+Client side throttling of the submissions, so bursts of launches don't hit
+the submit limits of the queue system (and lose the jobs refused by it).
+
+Submissions take a token from a bucket refilled at a fixed rate, and the
+jobs they add to the queue (the tasks, for array jobs) must fit in the
+limit of queued jobs. The limit may be given, or learned: when the queue
+system refuses a submission because of a limit, the current number of jobs
+in the queue is taken as the limit. Submissions that can't be done are held
+in a backlog, in order, and released as tokens and queue slots are
+available.
+"""
+from typing import Optional, List, Deque, Tuple, TYPE_CHECKING
+from collections import deque
+import threading
+import logging
+import time
+
+from .errors import SubmitLimitError
+from .table import BACKLOGGED
+
+from carcosa import scripts
+
+if TYPE_CHECKING:
+    from carcosa.cluster import ClusterClient, Job
+
+# Submission held in the backlog: (script, jobs, array, queue system args)
+Submission = Tuple[scripts.Script, List['Job'], bool, Optional[List[str]]]
+
+
+class SubmitThrottle:
+    """
+    Token bucket and limit of queued jobs for the submissions of a client.
+    See :meth:`ClusterClient.enable_throttle
+    <carcosa.cluster.ClusterClient.enable_throttle>`.
+    """
+    def __init__(self,
+                 client: 'ClusterClient',
+                 rate: float = 1.0,
+                 burst: int = 10,
+                 max_queued: Optional[int] = None,
+                 refresh: float = 30.0) -> None:
+        """
+        Args:
+            client (ClusterClient):
+                Client whose submissions are throttled.
+            rate (float, optional):
+                Submissions per second, in the long run.
+            burst (int, optional):
+                Submissions that can be done at once.
+            max_queued (int, optional):
+                Maximum number of jobs of the user in the queue. If it's not
+                set it's learned from the submit limit errors.
+            refresh (float, optional):
+                Seconds between queries of the number of jobs in the queue,
+                while there are held submissions.
+        """
+        self.client = client
+        self.rate = rate
+        self.burst = burst
+        self.max_queued = max_queued
+        self.refresh = refresh
+
+        self.backlog: Deque[Submission] = deque()
+
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        # Estimation of the jobs in the queue: the last count of the queue
+        # system plus the jobs submitted since then.
+        self._queued = 0
+        self._counted: Optional[float] = None
+        # The queue system returned a job id for the last submission.
+        self._assigned = False
+
+        self._lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._stamp) * self.rate
+            )
+        self._stamp = now
+
+    def _count(self, force: bool = False) -> int:
+        """
+        Jobs in the queue, queried from the server at most every
+        ``refresh`` seconds.
+        """
+        now = time.monotonic()
+        if force or self._counted is None or \
+                now - self._counted >= self.refresh:
+            self._queued = self.client.server.queue_count()
+            self._counted = now
+        return self._queued
+
+    def _fits(self, cost: int) -> bool:
+        if self._tokens < 1:
+            return False
+        if self.max_queued is None:
+            return True
+        queued = self._count()
+        # A submission bigger than the limit is only done on an empty queue,
+        # otherwise it would be held forever.
+        return queued + cost <= self.max_queued or queued == 0
+
+    def submit(self,
+               script: scripts.Script,
+               jobs: List['Job'],
+               array: bool = False,
+               args: Optional[List[str]] = None) -> bool:
+        """
+        Submit a job, or hold it in the backlog if it can't be submitted
+        now. Held jobs are flagged as backlogged.
+
+        Args:
+            script (scripts.Script):
+                Script of the job, already generated.
+            jobs (list):
+                Jobs of the submission, the tasks of an array job or a single
+                job.
+            array (bool, optional):
+                The submission is an array job.
+            args (list, optional):
+                Options for the queue system that override the ones in the
+                script.
+
+        Returns:
+            submitted (bool):
+                False if the job is held, or the queue system didn't return a
+                job id.
+        """
+        with self._lock:
+            for j in jobs:
+                j._set_flag(BACKLOGGED, True)
+            self.backlog.append((script, jobs, array, args))
+            self.pump()
+            return not jobs[0].backlogged and self._assigned
+
+    def reserve(self, cost: int = 1) -> bool:
+        """
+        Take a token for a submission done outside the backlog, e.g. the
+        copies of :class:`~carcosa.cluster.speculation.Speculator` that are
+        not jobs of the client. Held submissions go first.
+
+        Args:
+            cost (int, optional):
+                Jobs added to the queue by the submission.
+
+        Returns:
+            reserved (bool): False if there's no room for the submission.
+        """
+        with self._lock:
+            self._refill()
+            if self.backlog or not self._fits(cost):
+                return False
+            self._tokens -= 1
+            self._queued += cost
+            return True
+
+    def pump(self) -> int:
+        """
+        Submit the held jobs, in order, while there are tokens and slots in
+        the queue.
+
+        Returns:
+            submitted (int): Number of submissions done.
+        """
+        submitted = 0
+        with self._lock:
+            while self.backlog:
+                self._refill()
+                script, jobs, array, args = self.backlog[0]
+                if not self._fits(len(jobs)):
+                    break
+
+                self._tokens -= 1
+                try:
+                    job_id = self.client.submit(script, args)
+                except SubmitLimitError:
+                    # The jobs in the queue are the limit.
+                    self.max_queued = max(1, self._count(force=True))
+                    logging.warning(
+                        'Submit limit reached, holding submissions until '
+                        'there are less than {} jobs queued'.format(
+                            self.max_queued
+                            )
+                        )
+                    break
+
+                self.backlog.popleft()
+                for j in jobs:
+                    j._set_flag(BACKLOGGED, False)
+                self._assigned = self.client._assign(jobs, job_id, array)
+                if self._assigned:
+                    self._queued += len(jobs)
+                    submitted += 1
+        return submitted
+
+    def start(self, interval: float = 1.0) -> None:
+        """
+        Release the held jobs every ``interval`` seconds in a daemon thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            logging.warning('Throttle already running')
+            return
+
+        def loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.pump()
+                except Exception as e:
+                    logging.error('Throttle failed: {}'.format(e))
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread, if it's running. Held jobs stay in the
+        backlog.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
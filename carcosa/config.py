@@ -1,24 +1,65 @@
+from typing import Optional, Tuple
+import logging
 import os
 
 
 class Config:
     CARCOSA_PATH_ENV = 'CARCOSA_PATH'
     DEFAULT_PATH = '{home}/.carcosa/'
+    SERIALIZER_ENV = 'CARCOSA_SERIALIZER'
+    DEFAULT_SERIALIZER = 'serpent'
+    # Pyro4 serializers that can be used, msgpack needs the msgpack package.
+    SERIALIZERS = ('serpent', 'marshal', 'msgpack')
 
     def __init__(self):
-        pass
+        # (value of CARCOSA_PATH, resolved path). The path is resolved and
+        # created once, it's only resolved again if the environment variable
+        # changes.
+        self._path: Optional[Tuple[Optional[str], str]] = None
+        self._serializer: Optional[str] = None
 
     @property
     def path(self):
-        path = os.getenv(self.CARCOSA_PATH_ENV)
+        env = os.getenv(self.CARCOSA_PATH_ENV)
+        if self._path is not None and self._path[0] == env:
+            return self._path[1]
+
+        path = env
         if path is None:
             path = self._get_default_path()
 
-        if not os.path.exists(path):
-            os.mkdir(path)
+        os.makedirs(path, exist_ok=True)
 
+        self._path = (env, path)
         return path
 
+    @property
+    def serializer(self) -> str:
+        """
+        Pyro4 serializer used by the clients: the one set here, or the one in
+        the ``CARCOSA_SERIALIZER`` environment variable, ``serpent`` by
+        default. The servers accept all the available ones.
+        """
+        if self._serializer is not None:
+            return self._serializer
+        name = os.getenv(self.SERIALIZER_ENV)
+        if name is None:
+            return self.DEFAULT_SERIALIZER
+        if name not in self.SERIALIZERS:
+            logging.warning('Unknown serializer {}, using {}'.format(
+                name, self.DEFAULT_SERIALIZER
+                ))
+            return self.DEFAULT_SERIALIZER
+        return name
+
+    @serializer.setter
+    def serializer(self, val: Optional[str]) -> None:
+        if val is not None and val not in self.SERIALIZERS:
+            e_msg = 'Serializer must be one of {}'.format(self.SERIALIZERS)
+            logging.error(e_msg)
+            raise ValueError(e_msg)
+        self._serializer = val
+
     def _get_default_path(self):
         home = os.getenv('HOME')
         return self.DEFAULT_PATH.format(home=home)
@@ -1,7 +1,50 @@
-from typing import List
+from typing import List, Dict, Tuple, TYPE_CHECKING
+import importlib
+import sys
 
-from . import slurm
+if TYPE_CHECKING:
+    from carcosa.cluster import ClusterClient, ClusterServer
 
 systems: List[str] = ['slurm']
 """ List of strings containing the valid queue systems.
 """
+
+# Module, client class and server class of each queue system. The modules are
+# only imported when the queue system is requested.
+_BACKENDS: Dict[str, Tuple[str, str, str]] = {
+    'slurm': ('slurm', 'SlurmClient', 'SlurmServer'),
+    }
+
+
+def get_queue_system(qsystem: str) \
+        -> Tuple['ClusterClient', 'ClusterServer']:
+    """
+    Get a client and a server for a queue system.
+
+    Args:
+        qsystem (str):
+            Name of the queue system, one of :py:data:`systems`.
+
+    Returns:
+        client (ClusterClient)
+        server (ClusterServer)
+    """
+    if qsystem not in systems:
+        raise ValueError('Queue system {} is not valid'.format(qsystem))
+    module, client, server = _BACKENDS[qsystem]
+    mod = importlib.import_module('.' + module, __name__)
+    return getattr(mod, client)(), getattr(mod, server)()
+
+
+def __getattr__(name: str):
+    # Lazy access to the backend modules (carcosa.qsystems.slurm...).
+    if name in _BACKENDS:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name)
+        )
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ (PEP 562) is not available.
+    from . import slurm
@@ -1,34 +1,40 @@
 """
 Classes for local execution of the jobs, without a queue system or a remote
 cluster.
-There's no queue system so job id is always 0, and queue_parse always returns
-'complete'.
+There's no queue system so job id is always 0 (``0_N`` for the tasks of an
+array job), and queue_parser always returns 'complete'.
 LocalServer.complete will not return until the scripts finished its execution.
 """
-from typing import Tuple, List, Any, Dict, Optional, Iterator, Callable, Union
-import types
+from typing import Tuple, List, Optional, Union, Dict, Any
 import logging
+import os
 
-from carcosa.cluster import ClusterServer, ClusterClient
-from carcosa import scripts
+from carcosa.cluster import ClusterServer
+from .slurm import SlurmClient, OPT_PREFIX
 
 JOB_ID = '0'
 STATUS = 'complete'
 
 
 class LocalServer(ClusterServer):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # Final state and name of the jobs run, by job id, see
+        # :meth:`_queue_states`.
+        self._ran: Dict[str, Tuple[str, str]] = dict()
+
     @property
     def qsystem(self) -> str:
         return 'slurm'
 
     def metrics(self,
-                job_id: Optional[int] = None) -> Iterator[Tuple[str, ...]]:
+                job_id: Optional[int] = None) -> List[Tuple[str, ...]]:
         """
         Get job metrics from ``sacct``.
         """
         logging.info('Getting job metrics')
 
-        yield tuple([''] * 14)
+        return [tuple([''] * 14)]
 
     def queue_test(self) -> bool:
         """
@@ -39,7 +45,9 @@ class LocalServer(ClusterServer):
         """
         return True
 
-    def submit(self, script_path: str) -> Optional[str]:
+    def submit(self,
+               script_path: str,
+               args: Optional[List[str]] = None) -> Optional[str]:
         """
         Execute a job, this will **NOT** return until the script have executed,
         because there's no underlying queue system.
@@ -47,19 +55,88 @@ class LocalServer(ClusterServer):
         Args:
             script_path (str):
                 Path to the sbatch script
+            args (list, optional):
+                Options for sbatch, only ``--array`` is used.
 
         Returns:
             job_id (str):
                 ID of the submitted job
         """
+        self._add_job_dir(script_path)
+        name = os.path.splitext(os.path.basename(script_path))[0]
+        tasks = self._array_tasks(script_path, args)
         args = ['bash', script_path]
-        res = self.cmd(args)
-        if res.returncode != 0:
-            logging.error('Local job failed with code {}'.format(
-                res.returncode)
+        if tasks is None:
+            res = self._cmd(args)
+            if res.returncode != 0:
+                logging.error('Local job failed with code {}'.format(
+                    res.returncode)
+                    )
+                return None
+            self._record({JOB_ID: (STATUS, name)})
+            return JOB_ID
+
+        # Array jobs run each task sequentially, with the environment set by
+        # slurm.
+        ran: Dict[str, Tuple[str, str]] = dict()
+        for task in tasks:
+            env = dict(os.environ, SLURM_ARRAY_TASK_ID=str(task))
+            res = self._cmd(args, env=env)
+            state = STATUS
+            if res.returncode != 0:
+                logging.error('Local task {} failed with code {}'.format(
+                    task, res.returncode)
+                    )
+                state = 'failed'
+            ran['{}_{}'.format(JOB_ID, task)] = (state, name)
+        self._record(ran)
+        return JOB_ID
+
+    def _record(self, jobs: Dict[str, Tuple[str, str]]) -> None:
+        """
+        Remember the final states of the jobs run. The ids are reused by
+        every submission, so each run goes through ``pending`` in the state
+        changes feed, and it's reported to the last job that got the id.
+        """
+        with self._events_lock:
+            self.events.observe(
+                {jid: ('pending', name) for jid, (_, name) in jobs.items()}
                 )
+            self.events.observe(jobs)
+            self._ran.update(jobs)
+
+    @staticmethod
+    def _array_tasks(script_path: str,
+                     args: Optional[List[str]] = None) -> Optional[List[int]]:
+        """
+        Task ids of the ``--array`` option (or directive of the script), None
+        if it's not an array job. Only ``first-last`` ranges and lists are
+        supported.
+        """
+        spec = None
+        for a in args or []:
+            if a.startswith('--array='):
+                spec = a
+        if spec is None:
+            with open(script_path) as f:
+                for line in f:
+                    if line.startswith(OPT_PREFIX + ' --array='):
+                        spec = line[len(OPT_PREFIX) + 1:]
+                        break
+        if spec is None:
             return None
-        return JOB_ID
+
+        tasks: List[int] = []
+        for part in spec.split('=', 1)[1].split('%')[0].strip().split(','):
+            first, _, last = part.partition('-')
+            tasks.extend(range(int(first), int(last or first) + 1))
+        return tasks
+
+    def queue_count(self) -> int:
+        """
+        Jobs are executed synchronously, the queue is always empty.
+        """
+        return 0
 
     def kill(self, job_ids: List[Union[int, str]]) -> bool:
         """
@@ -73,19 +150,47 @@ class LocalServer(ClusterServer):
         """
         return True
 
+    def cancel(self, job_filter: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Jobs are executed synchronously, there's never a job to cancel.
+        """
+        return {'matched': 0, 'cancelled': 0, 'failed': 0}
+
+    def _accounting(self,
+                    since: Optional[str] = None,
+                    until: Optional[str] = None) -> List[Tuple[str, ...]]:
+        """
+        Jobs are not recorded, there's no accounting.
+        """
+        return []
+
+    def _queue_states(self) -> Dict[str, Tuple[str, str]]:
+        """
+        Jobs are executed synchronously, they are reported with the state
+        they finished with.
+        """
+        return dict(self._ran)
+
     def queue_parser(self, job_id: Optional[str] = None) \
-            -> Iterator[Tuple[str, ...]]:
+            -> List[Tuple[str, str]]:
         """
         Get the information of the running jobs. Returns the job id and the
-        state of the jobs.
+        state of the jobs. Jobs are executed synchronously, so the job has
+        always finished.
 
         Args:
             job_id (int):
                 Job ID to check.
         """
-        yield (JOB_ID, STATUS)
+        job_id = job_id or JOB_ID
+        return [(job_id, self._ran.get(job_id, (STATUS, ''))[0])]
+
 
-class LocalClient(ClusterClient):
+class LocalClient(SlurmClient):
+    """
+    Client for local execution. The generated scripts are the same as in
+    slurm, as ``#SBATCH`` directives are just comments for bash.
+    """
     @property
     def server(self) -> LocalServer:
         if self._server is None:
@@ -97,178 +202,3 @@ class LocalClient(ClusterClient):
 
     def _get_server(self) -> LocalServer:
         return LocalServer()
-
-    def metrics(self, job_id: int = None) -> Iterator[Tuple[str, ...]]:
-        return self.server.metrics(job_id=job_id)
-
-    def gen_scripts(self,
-                    script: scripts.Script,
-                    options: Dict,
-                    function: Optional[Callable[..., Any]] = None,
-                    args: Optional[Tuple] = None,
-                    kwargs: Optional[Dict] = None,
-                    cmd: Optional[str] = None) -> bool:
-        """
-        Generate the scripts to run the job in slurm. The job to run can be a
-        python function or a plaintext command.
-
-        To run a function a ``function``, ``args`` and ``kwargs`` arguments
-        must be passed, if a function is passed the ``cmd`` attribute is
-        ignored.
-
-        If a function is not passed, a command may be passed through the
-        ``cmd`` argument.
-
-        Args:
-            local_path (str):
-                Path for the job in the local filesystem
-            remote_path (str):
-                Path for the job in the remote filesystem
-            jobname (str):
-                Identifier for the job, will be used to generate the scripts
-                files
-            options (dict):
-                Options for sbatch. See :meth:`SlurmClient.parse_options` for
-                the available arguments.
-            function (types.FunctionType, optional):
-                Function to be executed in the queue system
-            args (tuple):
-                Arguments to be passed to the function (only used if function
-                is not None).
-            kwargs (dict):
-                Keyword arguments passed to the function (only used if function
-                is not None)
-            cmd (str):
-                Command to be executed, if a function is passed this argument
-                is not used.
-
-        Returns:
-            success (bool)
-        """
-        if function:
-            if not isinstance(function, types.FunctionType):
-                raise TypeError(
-                    'A function must be passed, not {}'.format(type(function))
-                    )
-
-                # Execute the python file that loads and run the target
-                # function.
-                cmd = 'python {python_file}'.format(
-                    python_file=script.remote.filepath('python')
-                    )
-
-                # Generate the python file that loads the marshal serialized
-                # function, and runs it.
-                with open(script.local.filepath('python'), 'w') as f:
-                    f.write(
-                        scripts.FUNC_RUNNER.format(
-                            marshal_file=script.remote.filepath('marshal'),
-                            out_file=script.remote.filepath('out')
-                            )
-                        )
-
-                # Save the serialized function to a file.
-                with open(script.local.filepath('marshal'), 'wb') as f:
-                    m_obj = (function.__code__, args, kwargs)
-                    try:
-                        marshal.dump(m_obj, f)
-                    except ValueError:
-                        logging.error(
-                            'Marshal can not serialize some elements.'
-                            )
-                        self.cleanup()
-                        return False
-
-        script_args = dict(
-            precmd=self.parse_options(**options),
-            name=script.name,
-            command=cmd
-            )
-
-        # Generate the sbatch script that will be sent to slurm.
-        with open(script.local.sbatch, 'w') as f:
-            f.write(
-                scripts.SCRIPT_RUNNER.format(script_args)
-                )
-
-        return True
-
-    def submit(self, script: scripts.Script) -> str:
-        """
-        Submit a job to slurm and get the job id
-
-        Returns:
-            job_id (str)
-        """
-        return self.server.submit(script.remote.filepath('sbatch'))
-
-    def parse_options(self, **kwargs: Any) -> str:
-        """
-        Get options and convert it to the apropiate #SBATCH string.
-
-        Args:
-            kwargs (dict):
-                Available options:
-
-                - ``jname``: string (--job-name)
-                - ``time``: string (--time) format: DD-HH:MM:SS
-                - ``queue``: string (--qos)
-                - ``workdir``: string (--workdir)
-                - ``error``: string (--error)
-                - ``output``: string (--output)
-                - ``nodes``: int (--nodes)
-                - ``ntasks``: int (--ntasks)
-                - ``cpus_per_task``: int (--cpus-per-task)
-                - ``tasks_per_node``: int (--tasks-per-node)
-                - ``exclusive``: bool (--exclusive)
-        """
-        options = []
-
-        strings = {
-            'jname': '--job-name',
-            'queue': '--qos',
-            'workdir': '--workdir',
-            'error': '--error',
-            'output': '--output'
-            }
-        for k, v in strings.items():
-            if k not in kwargs:
-                continue
-            options.append(
-                '{prefix} {directive}={val}'.format(
-                    prefix=OPT_PREFIX,
-                    directive=v,
-                    val=kwargs[k]
-                    )
-                )
-
-        ints = {
-            'nodes': '--nodes',
-            'ntasks': '--ntasks',
-            'cpus_per_task': '--cpus-per-task',
-            'tasks_per_node': '--tasks-per-node'
-            }
-        for k, v in ints.items():
-            if k not in kwargs:
-                continue
-            options.append(
-                '{prefix} {directive}={val}'.format(
-                    prefix=OPT_PREFIX,
-                    directive=v,
-                    val=str(kwargs[k])
-                    )
-                )
-
-        bools = {'exclusive': '--exclusive'}
-        for k, v in bools.items():
-            if k not in kwargs:
-                continue
-            if kwargs[k]:
-                options.append(
-                    '{prefix} {directive}'.format(
-                        prefix=OPT_PREFIX,
-                        directive=v,
-                        )
-                    )
-
-        return '\n'.join(options)
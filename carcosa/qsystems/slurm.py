@@ -1,31 +1,81 @@
-from typing import Tuple, List, Any, Dict, Optional, Iterator, Callable, Union
+from typing import Tuple, List, Any, Dict, Optional, Callable, \
+    Union
 import types
-import Pyro4
 import logging
+import getpass
 import shutil
 import marshal
-
-from carcosa.cluster import ClusterServer, ClusterClient
+import subprocess
+import threading
+import os
+
+from carcosa.cluster import ClusterServer, ClusterClient, Job, errors
+from carcosa.cluster.stats import instrument
+from carcosa.cluster.rpc import expose
+from carcosa.cluster.snapshot import QueueSnapshot
+from carcosa.cluster.aggregate import SUMMARY_FIELDS
 from carcosa import scripts
 
 SBATCH = 'sbatch'
 SQUEUE = 'squeue'
 SCANCEL = 'scancel'
 SACCT = 'sacct'
+SRUN = 'srun'
 OPT_PREFIX = '#SBATCH'
 
+# Maximum number of job ids passed to a single scancel invocation.
+CANCEL_CHUNK = 1000
+
+# Messages of sbatch (lowercase) when a limit of submitted jobs is reached,
+# e.g. QOSMaxSubmitJobPerUserLimit or AssocMaxSubmitJobLimit.
+SUBMIT_LIMIT_MESSAGES = ('maxsubmitjob', 'job submit limit')
+
+# Job name and command of the jobs that hold an allocation for steps.
+ALLOCATION_NAME = 'carcosa-allocation'
+ALLOCATION_CMD = 'sleep infinity'
+
+# Command of the function jobs, it runs the task in the fork server of the
+# allocation if the job is a step of one with a fork server (the socket and
+# the client script are exported to the step), see SlurmClient.allocate.
+FORK_CMD = """\
+if [ -S "$CARCOSA_FORK_SERVER" ]; then
+    {env}python "$CARCOSA_FORK_CLIENT" "$CARCOSA_FORK_SERVER" {cmd}
+else
+    {env}{cmd}
+fi"""
+
+# Options of a job that apply to its step when it runs in an allocation.
+STEP_OPTIONS = ('time', 'memory', 'cpus_per_task')
 
-@Pyro4.expose
+
+@expose
 class SlurmServer(ClusterServer):
-    @Pyro4.expose
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # srun processes of the steps launched in each allocation, by step
+        # name.
+        self._steps: Dict[str, Dict[str, subprocess.Popen]] = dict()
+        self._steps_lock = threading.Lock()
+
+    @expose
     @property
     def qsystem(self) -> str:
         return 'slurm'
 
+    @instrument
     def metrics(self,
-                job_id: Optional[int] = None) -> Iterator[Tuple[str, ...]]:
+                job_id: Optional[Union[int, str]] = None) \
+            -> List[Tuple[str, ...]]:
         """
         Get job metrics from ``sacct``.
+
+        Args:
+            job_id (int or str, optional):
+                Job, or comma separated list of jobs, to get the metrics of.
+                By default, the jobs of the user since midnight.
+
+        Raises:
+            ClusterServerError: ``sacct`` failed.
         """
         logging.info('Getting job metrics')
 
@@ -39,21 +89,40 @@ class SlurmServer(ClusterServer):
             '--format={}'.format(','.join(fields))
             ]
         if job_id:
-            qargs.append('-j {}'.format(job_id))
+            qargs.append('--jobs={}'.format(job_id))
 
-        sacct: List[Tuple[str, ...]] = []
-        try:
-            res = self.run(qargs)
-            if res.returncode != 0:
-                logging.error('sacct returned non 0.')
-            else:
-                out = res.stdout
-                sacct = [tuple(i.split('|')) for i in out.split('\n')]
-        except Exception:
-            logging.error('Error running sacct to get the metrics')
+        # The rows are built here, a generator would be streamed by Pyro4
+        # one row per round trip, and run after the call is instrumented.
+        res = self._cmd(qargs)
+        if res.returncode != 0:
+            logging.error('sacct failed with code {}'.format(res.returncode))
+            raise errors.ClusterServerError('Can not get the metrics')
+        return [tuple(line.split('|')) for line in res.stdout.splitlines()]
+
+    def _accounting(self,
+                    since: Optional[str] = None,
+                    until: Optional[str] = None) -> List[Tuple[str, ...]]:
+        """
+        Accounting rows of the jobs of the user from ``sacct``, see
+        :meth:`metrics_summary`.
 
-        for line in sacct:
-            yield line
+        Raises:
+            ClusterServerError: ``sacct`` failed.
+        """
+        args = [
+            SACCT, '-P', '--noheader', '--noconvert',
+            '--format={}'.format(','.join(SUMMARY_FIELDS))
+            ]
+        if since:
+            args.append('--starttime={}'.format(since))
+        if until:
+            args.append('--endtime={}'.format(until))
+
+        res = self._cmd(args)
+        if res.returncode != 0:
+            logging.error('sacct failed with code {}'.format(res.returncode))
+            raise errors.ClusterServerError('Can not get the accounting')
+        return [tuple(line.split('|')) for line in res.stdout.splitlines()]
 
     def queue_test(self) -> bool:
         """
@@ -70,21 +139,37 @@ class SlurmServer(ClusterServer):
             return False
         return True
 
-    def submit(self, script_path: str) -> Optional[str]:
+    @instrument
+    def submit(self,
+               script_path: str,
+               args: Optional[List[str]] = None) -> Optional[str]:
         """
         Submit a sbatch job and return its job ID.
 
         Args:
             script_path (str):
                 Path to the sbatch script
+            args (list, optional):
+                Options for sbatch, they override the ``#SBATCH`` directives
+                of the script.
 
         Returns:
             job_id (str):
                 ID of the submitted job
+
+        Raises:
+            SubmitLimitError:
+                The job was refused because the user or the QOS reached its
+                limit of submitted jobs.
         """
-        args = [SBATCH, script_path]
-        res = self._cmd(args)
+        self._add_job_dir(script_path)
+        res = self._cmd([SBATCH] + list(args or []) + [script_path])
         if res.returncode != 0:
+            stderr = (res.stderr or '').lower()
+            if any(m in stderr for m in SUBMIT_LIMIT_MESSAGES):
+                e_msg = 'Submit limit reached: {}'.format(res.stderr.strip())
+                logging.warning(e_msg)
+                raise errors.SubmitLimitError(e_msg)
             logging.error('sbatch failed with code {}'.format(res.returncode))
             return None
 
@@ -93,6 +178,21 @@ class SlurmServer(ClusterServer):
             job_id = job_id.split('_')[0]
         return job_id.strip()
 
+    @instrument
+    def queue_count(self) -> int:
+        """
+        Number of jobs of the user in the queue, counting each array task,
+        as slurm does for the submit limits.
+        """
+        res = self._cmd([SQUEUE, '-h', '-r', '-u', getpass.getuser(),
+                         '-o', '%i'])
+        if res.returncode != 0:
+            e_msg = 'squeue failed with code {}'.format(res.returncode)
+            logging.error(e_msg)
+            raise errors.ClusterServerError(e_msg)
+        return len(res.stdout.split())
+
+    @instrument
     def kill(self, job_ids: List[Union[int, str]]) -> bool:
         """
         Terminate all jobs in job_ids
@@ -103,57 +203,292 @@ class SlurmServer(ClusterServer):
         Returns:
             success (bool)
         """
-        job_ids.insert(0, SCANCEL)
-        res = self._cmd(job_ids)
+        ids = [str(j) for j in job_ids]
+        success = True
+        for i in range(0, len(ids), CANCEL_CHUNK):
+            res = self._cmd([SCANCEL] + ids[i:i + CANCEL_CHUNK])
+            success = success and res.returncode == 0
 
-        return res.returncode == 0
+        return success
 
-    def queue_parser(self, job_id: Optional[str] = None) \
-            -> Iterator[Tuple[str, ...]]:
+    def _snapshot(self,
+                  job_id: Optional[str] = None,
+                  accounting: bool = True) -> QueueSnapshot:
         """
-        Get the information of the running jobs. Returns the job id and the
-        state of the jobs.
+        Snapshot of the jobs of the user, or of a job. ``sacct`` gives the
+        jobs that already left the queue (it also lists the running ones,
+        with a delay), and the states in ``squeue`` take precedence. The
+        steps in ``sacct`` are collapsed into their job.
 
         Args:
-            job_id (int):
-                Job ID to check.
+            job_id (str, optional):
+                Only this job.
+            accounting (bool, optional):
+                Add the jobs in ``sacct``, only the jobs in the queue if not.
+
+        Raises:
+            ClusterServerError: ``squeue`` failed.
+        """
+        select = ['-u', getpass.getuser()] if job_id is None else \
+            ['--jobs={}'.format(job_id)]
+        snapshot = QueueSnapshot()
+        if accounting:
+            res = self._cmd([
+                SACCT, '-X', '-P', '--noheader',
+                '--format=JobID,State,JobName'
+                ] + select)
+            if res.returncode != 0:
+                logging.warning(
+                    'sacct failed with code {}'.format(res.returncode)
+                    )
+            else:
+                snapshot.merge(res.stdout)
+
+        res = self._cmd([SQUEUE, '-h', '-r', '-o', '%i|%T|%j'] + select)
+        if res.returncode != 0 and job_id is None:
+            # squeue fails for the ids that left the queue
+            logging.error('squeue failed with code {}'.format(res.returncode))
+            raise errors.ClusterServerError('Can not list the queue')
+        snapshot.merge(res.stdout)
+        return snapshot
+
+    def _queue_states(self) -> Dict[str, Tuple[str, str]]:
         """
-        squeue_fields = ['%A', '%T']
-        sacct_fields = ['jobid', 'state']
+        State and name of the jobs of the user, see :meth:`_snapshot`.
+        """
+        return self._snapshot().jobs
 
-        squeue_args = [SQUEUE, '-h', '-o {}'.format('|'.join(squeue_fields))]
-        sacct_args = [
-            SACCT, '-P', '--format={}'.format(','.join(sacct_fields))
-            ]
-        if job_id is not None:
-            sacct_args.append('-j {}'.format(job_id))
-            squeue_args.append('-j {}'.format(job_id))
+    @instrument
+    def cancel(self, job_filter: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Cancel the jobs of the user that match a filter. The filter is
+        resolved here against a snapshot of ``squeue``, so the client doesn't
+        need to list the jobs, and ``scancel`` is called once per chunk of
+        :py:data:`CANCEL_CHUNK` jobs.
+
+        Args:
+            job_filter (dict):
+                All the given keys must match:
 
-        squeue_out = self._cmd(squeue_args).output
-        sacct_out = self._cmd(sacct_args).output
+                - ``ids``: list of job ids.
+                - ``name``: prefix of the job name.
+                - ``states``: list of states (e.g. ``['pending']``).
 
-        squeue = list(
-            map(lambda x: tuple(x.split('|')), squeue_out.split('\n'))
+        Returns:
+            counts (dict):
+                Number of ``matched``, ``cancelled`` and ``failed`` jobs.
+        """
+        args = [SQUEUE, '-h', '-u', getpass.getuser(), '-o', '%i|%T|%j']
+        res = self._cmd(args)
+        if res.returncode != 0:
+            logging.error('squeue failed with code {}'.format(res.returncode))
+            raise errors.ClusterServerError('Can not list the queue')
+        # Pending tasks of an array are cancelled with their parent line
+        matched = QueueSnapshot().merge(res.stdout, array_parents=True) \
+            .select(job_filter)
+
+        cancelled = 0
+        for i in range(0, len(matched), CANCEL_CHUNK):
+            chunk = matched[i:i + CANCEL_CHUNK]
+            if self._cmd([SCANCEL] + chunk).returncode == 0:
+                cancelled += len(chunk)
+            else:
+                logging.error(
+                    'scancel failed for {} jobs'.format(len(chunk))
+                    )
+
+        return {
+            'matched': len(matched),
+            'cancelled': cancelled,
+            'failed': len(matched) - cancelled
+            }
+
+    @instrument
+    def allocate(self,
+                 args: Optional[List[str]] = None,
+                 command: Optional[str] = None) -> Optional[str]:
+        """
+        Get an allocation to run steps in, see :meth:`run_step`. The
+        allocation is held by a batch job that sleeps until it's released
+        (or reaches its time limit).
+
+        Args:
+            args (list, optional):
+                Options for sbatch, e.g. ``['--nodes=2', '--time=2:00:00']``.
+            command (str, optional):
+                Command that holds the allocation instead of sleeping, e.g.
+                a server for the steps. The allocation ends if it exits.
+
+        Returns:
+            allocation (str): Id of the allocation job, None on error.
+        """
+        res = self._cmd(
+            [SBATCH, '--parsable', '--job-name={}'.format(ALLOCATION_NAME)] +
+            list(args or []) +
+            ['--wrap={}'.format(command or ALLOCATION_CMD)]
             )
-        sacct = map(lambda x: tuple(x.split('|')), sacct_out.split('\n'))
+        if res.returncode != 0:
+            logging.error('sbatch failed with code {}: {}'.format(
+                res.returncode, (res.stderr or '').strip()
+                ))
+            return None
+
+        allocation = res.stdout.strip().split(';')[0]
+        with self._steps_lock:
+            self._steps[allocation] = dict()
+        logging.info('Allocation {} requested'.format(allocation))
+        return allocation
+
+    def _spawn(self, args: List[str]) -> subprocess.Popen:
+        logging.info('Spawning {}'.format(' '.join(args)))
+        return subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+            )
+
+    @instrument
+    def run_step(self,
+                 allocation: str,
+                 script_path: str,
+                 name: str,
+                 args: Optional[List[str]] = None) -> None:
+        """
+        Run a job script as a step of an allocation, with ``srun --exact``
+        so steps only use the resources they request and several of them
+        share the allocation. The step starts as soon as the allocation
+        has free resources, without going through the queue. This returns
+        once ``srun`` is spawned, the state of the step is given by
+        :meth:`steps`.
+
+        Args:
+            allocation (str):
+                Id of the allocation, see :meth:`allocate`.
+            script_path (str):
+                Path of the script, it's run with ``bash``.
+            name (str):
+                Name of the step, unique in the allocation.
+            args (list, optional):
+                Options for srun, e.g. ``['--cpus-per-task=4']``.
+
+        Raises:
+            ClusterServerError:
+                The allocation was not requested by this server, or the name
+                is already used.
+        """
+        self._add_job_dir(script_path)
+        with self._steps_lock:
+            steps = self._steps.get(allocation)
+            if steps is None or name in steps:
+                e_msg = 'Can not run step {} in allocation {}'.format(
+                    name, allocation
+                    )
+                logging.error(e_msg)
+                raise errors.ClusterServerError(e_msg)
+
+            steps[name] = self._spawn(
+                [SRUN, '--jobid={}'.format(allocation), '--exact',
+                 '--nodes=1', '--ntasks=1', '--job-name={}'.format(name)] +
+                list(args or []) + ['bash', script_path]
+                )
+
+    @instrument
+    def steps(self, allocation: str) -> List[Tuple[str, str, str]]:
+        """
+        Steps of an allocation, from the step rows of ``sacct``. The steps
+        launched by this server that are not accounted yet are waiting for
+        resources (``pending``), unless their ``srun`` failed.
 
-        # Yield the jobs catched by squeue
-        for sinfo in squeue:
-            yield sinfo
+        Args:
+            allocation (str):
+                Id of the allocation.
+
+        Returns:
+            steps (list):
+                Name, step id (``'123.4'``, empty if it's not known yet) and
+                state of each step.
+        """
+        res = self._cmd([
+            SACCT, '-P', '--noheader', '--jobs={}'.format(allocation),
+            '--format=JobID,JobName,State'
+            ])
+        if res.returncode != 0:
+            e_msg = 'sacct failed with code {}'.format(res.returncode)
+            logging.error(e_msg)
+            raise errors.ClusterServerError(e_msg)
+
+        found: Dict[str, Tuple[str, str, str]] = dict()
+        for line in res.stdout.splitlines():
+            fields = line.split('|')
+            if len(fields) != 3:
+                continue
+            step_id, name, state = fields
+            job_id, _, step = step_id.partition('.')
+            # Skip the allocation job, and its batch and extern steps.
+            if job_id != allocation or not step.isdigit():
+                continue
+            found[name] = (name, step_id, state.lower())
 
-        # Yield the jobs catched by sacct that are not in squeue
-        sjobs = [x[0] for x in squeue]
-        for sinfo in sacct:
-            jid, _ = sinfo
-            if jid not in sjobs:
-                yield sinfo
+        with self._steps_lock:
+            spawned = dict(self._steps.get(allocation, {}))
+        for name, proc in spawned.items():
+            if name in found:
+                continue
+            code = proc.poll()
+            if code is None:
+                state = 'pending'
+            elif code != 0:
+                state = 'failed'
+            else:
+                # Done, but not accounted yet.
+                state = 'completing'
+            found[name] = (name, '', state)
+        return list(found.values())
+
+    @instrument
+    def release(self, allocation: str) -> bool:
+        """
+        Cancel an allocation, and the steps still running in it.
+
+        Returns:
+            success (bool)
+        """
+        with self._steps_lock:
+            steps = self._steps.pop(allocation, {})
+        for proc in steps.values():
+            if proc.poll() is None:
+                proc.terminate()
+        return self.kill([allocation])
+
+    @instrument
+    def queue_parser(self, job_id: Optional[str] = None) \
+            -> List[Tuple[str, str]]:
+        """
+        Job id and state of the jobs of the user, or of a job, see
+        :meth:`_snapshot`.
+
+        Args:
+            job_id (str, optional):
+                Job ID to check.
+        """
+        jobs = self._snapshot(job_id).jobs
+        return [(jid, state) for jid, (state, _) in jobs.items()]
 
 
 class SlurmClient(ClusterClient):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # Environment of the steps of the allocations with a fork server,
+        # see :meth:`allocate`.
+        self._fork_servers: Dict[str, str] = dict()
+
     def cleanup(self) -> None:
         pass
 
-    def metrics(self, job_id: int = None) -> Iterator[Tuple[str, ...]]:
+    def metrics(self,
+                job_id: Optional[Union[int, str]] = None) \
+            -> List[Tuple[str, ...]]:
         return self.server.metrics(job_id=job_id)
 
     def gen_scripts(self,
@@ -162,7 +497,8 @@ class SlurmClient(ClusterClient):
                     function: Optional[Callable[..., Any]] = None,
                     args: Optional[Tuple] = None,
                     kwargs: Optional[Dict] = None,
-                    cmd: Optional[str] = None) -> bool:
+                    cmd: Optional[str] = None,
+                    profile: bool = False) -> bool:
         """
         Generate the scripts to run the job in slurm. The job to run can be a
         python function or a plaintext command.
@@ -196,71 +532,337 @@ class SlurmClient(ClusterClient):
             cmd (str):
                 Command to be executed, if a function is passed this argument
                 is not used.
+            profile (bool):
+                Run the function under cProfile and tracemalloc, the results
+                are saved next to the result file (only used if function is
+                not None).
 
         Returns:
             success (bool)
         """
         if function:
             # A python function will be executed, not a plain command. This
-            # implies serializing the function, saving its serialized
-            # representation to a file and generating the scripts to load the
-            # function again in the remote host.
+            # implies serializing the function and its arguments, and running
+            # them in the remote host with a runner that loads them again.
             if not isinstance(function, types.FunctionType):
                 raise TypeError(
                     'A function must be passed, not {}'.format(type(function))
                     )
 
-                # Execute the python file that loads and run the target
-                # function.
+            if profile:
+                if not self._gen_profile_runner(script, function, args,
+                                                kwargs):
+                    return False
                 cmd = 'python {python_file}'.format(
                     python_file=script.remote.filepath('python')
                     )
-
-                # Generate the python file that loads the marshal serialized
-                # function, and runs it.
-                with open(script.local.filepath('python'), 'w') as f:
-                    f.write(
-                        scripts.FUNC_RUNNER.format(
-                            marshal_file=script.remote.filepath('marshal'),
-                            out_file=script.remote.filepath('out')
-                            )
+            else:
+                # Append the call to the session pack, it's run by the
+                # shared runner.
+                try:
+                    with self._packs_lock:
+                        pack = self.pack(script)
+                        task = pack.add(function.__code__, [(args, kwargs)])
+                except ValueError:
+                    logging.error(
+                        'Marshal can not serialize some elements.'
                         )
+                    self.cleanup()
+                    return False
+                cmd = self._runner_cmd(
+                    script, pack, str(task), script.remote.filepath('out')
+                    )
+
+        self._write_sbatch(script, options, cmd)
+        return True
+
+    def gen_array_scripts(self,
+                          script: scripts.Script,
+                          options: Dict,
+                          function: Callable[..., Any],
+                          calls: List[Tuple[Tuple, Dict]]) -> bool:
+        """
+        Generate the scripts of an array job, whose task ``i`` runs the
+        function with the arguments ``calls[i]``. The calls are appended to
+        the session pack, and a single sbatch script runs any of them from
+        ``SLURM_ARRAY_TASK_ID``. The result of task ``i`` is written to the
+        result file of the job ``{script.name}_{i}``.
 
-                # Save the serialized function to a file.
-                with open(script.local.filepath('marshal'), 'wb') as f:
-                    m_obj = (function.__code__, args, kwargs)
-                    try:
-                        marshal.dump(m_obj, f)
-                    except ValueError:
-                        logging.error(
-                            'Marshal can not serialize some elements.'
-                            )
-                        self.cleanup()
-                        return False
+        Args:
+            script (scripts.Script):
+                Script of the array job.
+            options (dict):
+                Options for sbatch, they must include ``array``.
+            function (types.FunctionType):
+                Function run by the tasks.
+            calls (list):
+                ``(args, kwargs)`` of each task.
+
+        Returns:
+            success (bool)
+        """
+        try:
+            with self._packs_lock:
+                pack = self.pack(script)
+                first = pack.add(function.__code__, calls)
+        except ValueError:
+            logging.error('Marshal can not serialize some elements.')
+            self.cleanup()
+            return False
+
+        out_file = os.path.join(
+            script.remote_path,
+            script.FILES['out'].format(
+                script.name + '_${SLURM_ARRAY_TASK_ID}'
+                )
+            )
+        cmd = self._runner_cmd(
+            script, pack, '$(({} + SLURM_ARRAY_TASK_ID))'.format(first),
+            out_file
+            )
+        self._write_sbatch(script, options, cmd)
+        return True
+
+    def _gen_profile_runner(self,
+                            script: scripts.Script,
+                            function: Callable[..., Any],
+                            args: Optional[Tuple],
+                            kwargs: Optional[Dict]) -> bool:
+        # Profiled jobs keep their own runner and marshal file, as they
+        # save the profile next to the result.
+        runner = scripts.PROFILE_FUNC_RUNNER.format(
+            marshal_file=script.remote.filepath('marshal'),
+            out_file=script.remote.filepath('out'),
+            prof_file=script.remote.filepath('prof'),
+            alloc_file=script.remote.filepath('alloc'),
+            alloc_top=scripts.PROFILE_ALLOC_TOP
+            )
+        with open(script.local.filepath('python'), 'w') as f:
+            f.write(runner)
+
+        # Save the serialized function to a file.
+        with open(script.local.filepath('marshal'), 'wb') as f:
+            m_obj = (function.__code__, args, kwargs)
+            try:
+                marshal.dump(m_obj, f)
+            except ValueError:
+                logging.error(
+                    'Marshal can not serialize some elements.'
+                    )
+                self.cleanup()
+                return False
+        return True
 
+    def _runner_cmd(self,
+                    script: scripts.Script,
+                    pack: scripts.Pack,
+                    task: str,
+                    out_file: str) -> str:
+        """
+        Command that runs the task ``task`` of a pack with the shared runner.
+        The result is written to the results log of the client if it's
+        enabled for the job path, unless the result file is somewhere else
+        (e.g. in the result cache). Steps of an allocation with a fork server
+        run the task in the server.
+        """
+        runner = scripts.shared_runner(script.local_path)
+        cmd = 'python {runner} {pack} {index} {task} {out_file}'.format(
+            runner=os.path.join(script.remote_path, runner),
+            pack=pack.filepath('pack', remote=True),
+            index=pack.filepath('index', remote=True),
+            task=task,
+            out_file=out_file
+            )
+
+        env = ''
+        log = self.results_log
+        if (log is not None and
+                log.local_path == script.local_path and
+                os.path.dirname(out_file) == script.remote_path):
+            env = 'CARCOSA_RESULTS={} '.format(log.prefix(remote=True))
+        return FORK_CMD.format(env=env, cmd=cmd)
+
+    def _write_sbatch(self,
+                      script: scripts.Script,
+                      options: Dict,
+                      cmd: Optional[str]) -> None:
         script_args = dict(
             precmd=self.parse_options(**options),
+            usedir=options.get('workdir', script.remote_path),
+            timings_file=script.remote.filepath('timings'),
             name=script.name,
             command=cmd
             )
 
         # Generate the sbatch script that will be sent to slurm.
-        with open(script.local.sbatch, 'w') as f:
+        with open(script.local.filepath('sbatch'), 'w') as f:
             f.write(
-                scripts.SCRIPT_RUNNER.format(script_args)
+                scripts.SCRIPT_RUNNER.format(**script_args)
                 )
 
-        return True
-
-    def submit(self, script: scripts.Script) -> str:
+    def submit(self,
+               script: scripts.Script,
+               args: Optional[List[str]] = None) -> str:
         """
         Submit a job to slurm and get the job id
 
+        Args:
+            script (scripts.Script):
+                Script of the job.
+            args (list, optional):
+                Options for sbatch that override the ones in the script.
+
         Returns:
             job_id (str)
         """
+        if args:
+            return self.server.submit(script.remote.filepath('sbatch'), args)
         return self.server.submit(script.remote.filepath('sbatch'))
 
+    def _option_args(self, options: Dict) -> List[str]:
+        """
+        Command line arguments of the options of a job.
+        """
+        prefix = OPT_PREFIX + ' '
+        return [
+            line[len(prefix):]
+            for line in self.parse_options(**options).split('\n')
+            if line.startswith(prefix)
+            ]
+
+    def allocate(self,
+                 options: Dict = {},
+                 preload: Optional[List[str]] = None) -> Optional[str]:
+        """
+        Get an allocation to run jobs as steps, with low latency, see
+        :meth:`Job.launch <carcosa.cluster.Job.launch>`. The allocation is
+        held until it's released with :meth:`release` or reaches its time
+        limit.
+
+        If ``preload`` is given, the allocation runs a fork server in each
+        of its nodes that imports those modules once. The function jobs run
+        as steps are forked from it, with the modules already loaded,
+        instead of starting a new interpreter. The fork server scripts are
+        written to the paths of the client, so they must be set.
+
+        The forked jobs are children of the fork server, so they escape the
+        step they are launched in: the ``memory`` and ``cpus_per_task``
+        limits of the step (``srun --exact``) are not enforced on them, and
+        ``sacct`` charges their usage to the step of the fork server. The
+        state of a step is the exit status of the job, but its accounted
+        usage is not the usage of the job. Use it for jobs that are trusted
+        to stay within the resources of the allocation.
+
+        Args:
+            options (dict, optional):
+                Resources of the allocation, as the options of
+                :meth:`~carcosa.cluster.ClusterClient.new_job`.
+            preload (list, optional):
+                Modules to preload in the fork server, e.g.
+                ``['numpy', 'pandas']``. An empty list starts the fork server
+                without preloading anything.
+
+        Returns:
+            allocation (str): Id of the allocation, None on error.
+        """
+        command = None
+        if preload is not None:
+            if not self.local_path or not self.remote_path:
+                e_msg = 'Local and remote paths must be set for a fork server.'
+                logging.error(e_msg)
+                raise ValueError(e_msg)
+            fork_server, fork_client = scripts.shared_fork_server(
+                self.local_path
+                )
+            # A server per node, sharing the resources with the steps.
+            command = 'srun --overlap --ntasks-per-node=1 python {} {}'.format(
+                os.path.join(self.remote_path, fork_server),
+                ' '.join(
+                    [scripts.FORK_SOCKET.format('$SLURM_JOB_ID')] + preload
+                    )
+                )
+
+        allocation = self.server.allocate(self._option_args(options), command)
+        if allocation and preload is not None:
+            self._fork_servers[allocation] = (
+                'CARCOSA_FORK_SERVER={},CARCOSA_FORK_CLIENT={}'.format(
+                    scripts.FORK_SOCKET.format(allocation),
+                    os.path.join(self.remote_path, fork_client)
+                    )
+                )
+        return allocation
+
+    def run_step(self, job: Job, allocation: str) -> None:
+        """
+        Run the generated script of a job as a step of an allocation. The
+        ``time``, ``memory`` and ``cpus_per_task`` options of the job apply
+        to the step.
+        """
+        options = {k: job.options[k] for k in STEP_OPTIONS if k in job.options}
+        args = self._option_args(options) + [
+            '--output={}'.format(job._log_paths('stdout')[1]),
+            '--error={}'.format(job._log_paths('stderr')[1])
+            ]
+        if allocation in self._fork_servers:
+            args.append(
+                '--export=ALL,{}'.format(self._fork_servers[allocation])
+                )
+        self.server.run_step(
+            allocation, job.script.remote.filepath('sbatch'), job.script.name,
+            args
+            )
+
+        extra = job._extra()
+        extra['allocation'] = allocation
+        extra.pop('step', None)
+        job.id = None
+        job.launched = True
+        job.status = 'pending'
+        logging.info('Job {} launched in allocation {}'.format(
+            job.script.name, allocation
+            ))
+
+    def update_steps(self,
+                     allocation: str,
+                     jobs: Optional[List[Job]] = None) -> None:
+        """
+        Update the state of the jobs run as steps of an allocation, with a
+        single query. The id of the step is stored in the ``step`` key of
+        the job extra data once it's known.
+
+        Args:
+            allocation (str):
+                Id of the allocation.
+            jobs (list, optional):
+                Jobs to update, all the jobs of the client in the allocation
+                by default.
+        """
+        if jobs is None:
+            table = self.jobs
+            jobs = [
+                table.view(row) for row in range(len(table))
+                if (table.extra[row] or {}).get('allocation') == allocation
+                ]
+        steps = {
+            name: (step_id, state)
+            for name, step_id, state in self.server.steps(allocation)
+            }
+        for job in jobs:
+            step = steps.get(job.script.name)
+            if step is None or job.finished:
+                continue
+            step_id, state = step
+            if step_id:
+                job._extra()['step'] = step_id
+            job.status = state
+
+    def release(self, allocation: str) -> bool:
+        """
+        Cancel an allocation, and the steps still running in it.
+        """
+        self._fork_servers.pop(allocation, None)
+        return self.server.release(allocation)
+
     def parse_options(self, **kwargs: Any) -> str:
         """
         Get options and convert it to the apropiate #SBATCH string.
@@ -271,6 +873,7 @@ class SlurmClient(ClusterClient):
 
                 - ``jname``: string (--job-name)
                 - ``time``: string (--time) format: DD-HH:MM:SS
+                - ``memory``: string (--mem) e.g. ``4G`` or ``512M``
                 - ``queue``: string (--qos)
                 - ``workdir``: string (--workdir)
                 - ``error``: string (--error)
@@ -280,15 +883,25 @@ class SlurmClient(ClusterClient):
                 - ``cpus_per_task``: int (--cpus-per-task)
                 - ``tasks_per_node``: int (--tasks-per-node)
                 - ``exclusive``: bool (--exclusive)
+                - ``dependency``: string (--dependency) e.g.
+                  ``afterok:123:124``
+                - ``array``: string (--array) e.g. ``0-99%10``
+                - ``open_mode``: string (--open-mode) ``append`` or
+                  ``truncate``
         """
         options = []
 
         strings = {
             'jname': '--job-name',
+            'time': '--time',
+            'memory': '--mem',
             'queue': '--qos',
             'workdir': '--workdir',
             'error': '--error',
-            'output': '--output'
+            'output': '--output',
+            'dependency': '--dependency',
+            'array': '--array',
+            'open_mode': '--open-mode'
             }
         for k, v in strings.items():
             if k not in kwargs:
@@ -1,15 +1,30 @@
 from os import path
-from typing import TypeVar, Generic, Optional
+from typing import TypeVar, Generic, Optional, Tuple, Dict, List, Sequence
+import marshal
 import logging
+import struct
+import types
+import os
 
+# Each phase of the job is appended to the timings file as a JSON line, see
+# :py:attr:`carcosa.cluster.Job.timings`. The shell only has the realtime
+# clock, the python runners record both realtime and monotonic times. The
+# tasks of an array job share the timings file, each line has the array task
+# id (-1 for jobs that are not arrays).
 SCRIPT_RUNNER = """\
 #!/bin/bash
 {precmd}
 cd {usedir}
+export CARCOSA_TIMINGS={timings_file}
+export CARCOSA_TASK=${{SLURM_ARRAY_TASK_ID:--1}}
+echo '{{"phase": "script_start", "task": '$CARCOSA_TASK', \
+"realtime": '$(date +%s%N)'}}' >> $CARCOSA_TIMINGS
 date +'%y-%m-%d-%H:%M:%S'
 echo "Running {name}"
 {command}
 exitcode=$?
+echo '{{"phase": "exit", "task": '$CARCOSA_TASK', \
+"realtime": '$(date +%s%N)', "code": '$exitcode'}}' >> $CARCOSA_TIMINGS
 echo Done
 echo Code: $exitcode
 date +'%y-%m-%d-%H:%M:%S'
@@ -19,44 +34,718 @@ fi
 exit $exitcode
 """
 
-# TODO: Marshal can't serialize exceptions ??
-FUNC_RUNNER = """\
+# Tag of the arguments passed by reference, see :func:`ref`.
+REF_TAG = '__carcosa_ref__'
+
+# Common part of the python runners. It avoids importing anything that is not
+# strictly needed, as the imports are part of the job overhead.
+RUNNER_HEADER = """\
 import marshal
 import types
+import time
+import os
+
+monotonic_ns = getattr(
+    time, 'monotonic_ns', lambda: int(time.monotonic() * 1e9)
+    )
+time_ns = getattr(time, 'time_ns', lambda: int(time.time() * 1e9))
+phases = [('runner_start', time_ns(), monotonic_ns())]
+
+
+def phase(name):
+    phases.append((name, None, monotonic_ns()))
+
+
+def save_timings():
+    timings_file = os.environ.get('CARCOSA_TIMINGS')
+    if not timings_file:
+        return
+    task = int(os.environ.get('CARCOSA_TASK', -1))
+    _, real0, mono0 = phases[0]
+    with open(timings_file, 'a') as f:
+        for name, _, mono in phases:
+            f.write(
+                '{{"phase": "%s", "task": %d, "realtime": %d, '
+                '"monotonic": %d}}\\n' % (
+                    name, task, real0 + mono - mono0, mono
+                    )
+                )
+
+
+def read_indexed(prefix, key):
+    # Payload of a key found in its bucket of the index of the results log,
+    # a seek and a read in the shard. None if it's not indexed (yet).
+    import struct
+    import zlib
+
+    bucket = '%s-idx.%02x' % (prefix, zlib.crc32(key) & 0xff)
+    try:
+        with open(bucket, 'rb') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        fields = line.split(b'\\t', 3)
+        if len(fields) != 4 or fields[3] != key:
+            continue
+        offset, length = int(fields[1]), int(fields[2])
+        start = offset - 14 - len(key)
+        try:
+            with open(prefix + '.' + fields[0].decode(), 'rb') as f:
+                f.seek(start)
+                data = f.read(offset + length - start)
+        except OSError:
+            return None
+        if len(data) != 14 + len(key) + length:
+            return None
+        magic, klen, plen, crc = struct.unpack_from('<4sHII', data)
+        body = data[14:]
+        if (magic != b'CRL1' or klen != len(key) or plen != length or
+                body[:klen] != key or zlib.crc32(body) != crc):
+            return None
+        return body[klen:]
+    return None
+
+
+def read_results_log(key):
+    # Payload of the last record of a key in the results log of the session,
+    # see carcosa.cluster.results. The shards are only scanned if the key is
+    # not in the index.
+    import glob
+    import struct
+    import zlib
+
+    prefix = os.environ.get('CARCOSA_RESULTS')
+    if not prefix:
+        return None
+    key = key.encode()
+    found = read_indexed(prefix, key)
+    if found is not None:
+        return found
+    for shard in glob.glob(glob.escape(prefix) + '.*'):
+        with open(shard, 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos + 14 <= len(data):
+            magic, klen, plen, crc = struct.unpack_from('<4sHII', data, pos)
+            end = pos + 14 + klen + plen
+            body = data[pos + 14:end]
+            if (magic != b'CRL1' or end > len(data) or
+                    zlib.crc32(body) != crc):
+                pos = data.find(b'CRL1', pos + 1)
+                if pos == -1:
+                    break
+                continue
+            if body[:klen] == key:
+                found = body[klen:]
+            pos = end
+    return found
+
+
+def resolve_refs(args, kwargs):
+    # Arguments passed by reference are loaded from the result file of the
+    # job that produced them, or from the results log.
+    def load(a):
+        if isinstance(a, tuple) and len(a) == 2 and a[0] == '__carcosa_ref__':
+            try:
+                with open(a[1], 'rb') as f:
+                    return marshal.load(f)
+            except FileNotFoundError:
+                payload = read_results_log(os.path.basename(a[1]))
+                if payload is None:
+                    raise
+                return marshal.loads(payload)
+        return a
+    return [load(a) for a in args], {{k: load(v) for k, v in kwargs.items()}}
+
+
+"""
+
+# TODO: Marshal can't serialize exceptions ??
+FUNC_RUNNER = RUNNER_HEADER + """\
+with open('{marshal_file}', 'rb') as f:
+    code, args, kwargs = marshal.load(f)
+    args, kwargs = resolve_refs(args, kwargs)
+    function = types.FunctionType(code, globals())
+    phase('payload_loaded')
+    try:
+        out = function(*args, **kwargs)
+    except Exception as e:
+        out = e
+    phase('function_done')
+
+    # Write the result atomically, an existing result file is always complete.
+    with open('{out_file}.tmp', 'wb') as f:
+        marshal.dump(out, f)
+    os.replace('{out_file}.tmp', '{out_file}')
+    phase('result_written')
+    save_timings()
+"""
+
+# Number of allocation sites saved by the profiling runner.
+PROFILE_ALLOC_TOP = 25
+
+# Same as FUNC_RUNNER, but the call is run under cProfile and tracemalloc. The
+# profile is saved with pstats format and the top allocation sites as a
+# marshal list of (filename, lineno, size, count).
+PROFILE_FUNC_RUNNER = RUNNER_HEADER + """\
+import cProfile
+import tracemalloc
 
 with open('{marshal_file}', 'rb') as f:
     code, args, kwargs = marshal.load(f)
+    args, kwargs = resolve_refs(args, kwargs)
     function = types.FunctionType(code, globals())
+    phase('payload_loaded')
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
     try:
         out = function(*args, **kwargs)
     except Exception as e:
         out = e
+    profiler.disable()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    phase('function_done')
 
-    with open('{out_file}', 'wb') as f:
+    profiler.dump_stats('{prof_file}')
+    allocs = []
+    for stat in snapshot.statistics('lineno')[:{alloc_top}]:
+        frame = stat.traceback[0]
+        allocs.append((frame.filename, frame.lineno, stat.size, stat.count))
+    with open('{alloc_file}', 'wb') as f:
+        marshal.dump(allocs, f)
+
+    # Write the result atomically, an existing result file is always complete.
+    with open('{out_file}.tmp', 'wb') as f:
         marshal.dump(out, f)
+    os.replace('{out_file}.tmp', '{out_file}')
+    phase('result_written')
+    save_timings()
+"""
+
+# Header of the frames of the results log (magic, key length, payload length
+# and CRC32 of the key and the payload), see :mod:`carcosa.cluster.results`.
+# The runners use the same literal values.
+RESULT_FRAME = struct.Struct('<4sHII')
+RESULT_MAGIC = b'CRL1'
+# The runners also index the records in 256 buckets, ``PREFIX-idx.XX`` with
+# ``XX`` the low byte of the CRC32 of the key in hex, one line
+# ``HOST<tab>PAYLOAD_OFFSET<tab>PAYLOAD_LENGTH<tab>KEY`` per record. A runner
+# resolving a reference reads a bucket and seeks into the shard, instead of
+# scanning all the shards.
+
+# Runner shared by all the function jobs, see :class:`Pack`. It's called as
+# ``python runner.py PACK_FILE INDEX_FILE TASK OUT_FILE``, it reads the entry
+# ``TASK`` of the index and loads that record of the pack. If
+# ``CARCOSA_RESULTS`` is set, the result is appended to that results log
+# instead of written to ``OUT_FILE``, keyed by the file name.
+SHARED_FUNC_RUNNER = (RUNNER_HEADER + """\
+import struct
+import sys
+
+INDEX_ENTRY = struct.Struct('<qq')
+
+
+def read_record(f, offset, length):
+    f.seek(offset)
+    return marshal.loads(f.read(length))
+
+
+def write_result(out_file, out):
+    prefix = os.environ.get('CARCOSA_RESULTS')
+    if not prefix:
+        # Write atomically, an existing result file is always complete.
+        with open(out_file + '.tmp', 'wb') as f:
+            marshal.dump(out, f)
+        os.replace(out_file + '.tmp', out_file)
+        return
+
+    # Append a frame to the shard of this node. The tasks running in the
+    # node share it, so the frame is written under a lock.
+    import fcntl
+    import socket
+    import zlib
+
+    key = os.path.basename(out_file).encode()
+    payload = marshal.dumps(out)
+    frame = struct.pack(
+        '<4sHII', b'CRL1', len(key), len(payload), zlib.crc32(key + payload)
+        ) + key + payload
+    host = socket.gethostname()
+    fd = os.open(
+        prefix + '.' + host, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        offset = os.lseek(fd, 0, os.SEEK_END) + 14 + len(key)
+        while frame:
+            frame = frame[os.write(fd, frame):]
+    finally:
+        os.close(fd)
+
+    # Index the location of the payload once the frame is complete, the
+    # line is appended with a single write.
+    line = ('%s\\t%d\\t%d\\t' % (host, offset, len(payload))).encode() + key
+    fd = os.open(
+        '%s-idx.%02x' % (prefix, zlib.crc32(key) & 0xff),
+        os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+    try:
+        os.write(fd, line + b'\\n')
+    finally:
+        os.close(fd)
+
+
+pack_file, index_file, task, out_file = sys.argv[1:5]
+with open(index_file, 'rb') as f:
+    f.seek(int(task) * INDEX_ENTRY.size)
+    offset, length = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+with open(pack_file, 'rb') as f:
+    code_offset, code_length, args, kwargs = read_record(f, offset, length)
+    code = read_record(f, code_offset, code_length)
+args, kwargs = resolve_refs(args, kwargs)
+function = types.FunctionType(code, globals())
+phase('payload_loaded')
+try:
+    out = function(*args, **kwargs)
+except Exception as e:
+    out = e
+phase('function_done')
+
+write_result(out_file, out)
+phase('result_written')
+save_timings()
+""").format()
+
+# Socket of the fork server of an allocation in each of its nodes.
+FORK_SOCKET = '/tmp/carcosa-fork-{}.sock'
+
+# Fork server, it imports the modules given in the command line once, and
+# forks a child per task that runs a script with those modules already
+# loaded. It's called as ``python forkserver.py SOCKET [MODULE...]``, and
+# serves until it's terminated. The tasks are requested with
+# :data:`FORK_CLIENT`, which passes its standard streams, working directory
+# and environment to the child. The children are processes of the step of
+# the fork server, not of the step of the client: the limits of the step
+# don't apply to them, and their usage is accounted to the fork server step.
+# The socket is only accessible by the user.
+FORK_SERVER = """\
+import importlib
+import traceback
+import runpy
+import signal
+import socket
+import array
+import json
+import sys
+import os
+
+
+def recv_request(conn):
+    fds = array.array('i')
+    data = b''
+    while not data.endswith(b'\\n'):
+        msg, ancdata, _, _ = conn.recvmsg(
+            65536, socket.CMSG_SPACE(3 * fds.itemsize)
+            )
+        if not msg:
+            break
+        for level, kind, cdata in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+        data += msg
+    return json.loads(data.decode()), list(fds)
+
+
+def run_task(request, fds):
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.argv = request['argv']
+
+    code = 0
+    try:
+        runpy.run_path(sys.argv[0], run_name='__main__')
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            code = e.code
+        elif e.code is not None:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
+
+
+def handle(conn):
+    request, fds = recv_request(conn)
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        run_task(request, fds)
+    for fd in fds:
+        os.close(fd)
+
+    _, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        code = 128 + os.WTERMSIG(status)
+    else:
+        code = os.WEXITSTATUS(status)
+    conn.sendall('{}\\n'.format(code).encode())
+
+
+def main(path, modules):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print('Can not preload {}: {}'.format(module, e), file=sys.stderr)
+
+    # Connection handlers are reaped automatically.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(128)
+    print('Fork server listening on {}'.format(path))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        while True:
+            conn, _ = server.accept()
+            if os.fork() == 0:
+                server.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                try:
+                    handle(conn)
+                finally:
+                    os._exit(0)
+            conn.close()
+    finally:
+        server.close()
+        os.unlink(path)
+
+
+main(sys.argv[1], sys.argv[2:])
+"""
+
+# Client of the fork server, called as
+# ``python forkclient.py SOCKET COMMAND...``. It runs the script of the
+# python command (``python script.py ARGS...``) in the fork server and exits
+# with its code, or executes the command if the server is not reachable.
+FORK_CLIENT = """\
+import socket
+import array
+import json
+import sys
+import os
+
+
+def main(path, cmd):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        os.execvp(cmd[0], cmd)
+
+    request = json.dumps({
+        'argv': cmd[1:], 'cwd': os.getcwd(), 'env': dict(os.environ)
+        }).encode() + b'\\n'
+    fds = array.array('i', [0, 1, 2])
+    sent = conn.sendmsg(
+        [request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)]
+        )
+    conn.sendall(request[sent:])
+
+    reply = b''
+    while not reply.endswith(b'\\n'):
+        chunk = conn.recv(64)
+        if not chunk:
+            print('Fork server closed the connection', file=sys.stderr)
+            return 1
+        reply += chunk
+    return int(reply)
+
+
+sys.exit(main(sys.argv[1], sys.argv[2:]))
 """
 
 T = TypeVar('T')
 
 
+def _write_shared(dirpath: str, prefix: str, source: str) -> str:
+    """
+    Write a script to a directory, if it's not there yet. The file is named
+    after a hash of its content, so it's written once and shared by all the
+    clients and sessions using the directory.
+
+    Returns:
+        filename (str): Name of the file.
+    """
+    import hashlib
+
+    digest = hashlib.sha1(source.encode()).hexdigest()
+    fname = '{}-{}.py'.format(prefix, digest[:12])
+    filepath = path.join(dirpath, fname)
+    if not path.exists(filepath):
+        tmp = '{}.{}.tmp'.format(filepath, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(source)
+        os.replace(tmp, filepath)
+    return fname
+
+
+def shared_runner(dirpath: str) -> str:
+    """
+    Write :data:`SHARED_FUNC_RUNNER` to a directory, if it's not there yet.
+
+    Returns:
+        filename (str): Name of the runner file.
+    """
+    return _write_shared(dirpath, 'carcosa-runner', SHARED_FUNC_RUNNER)
+
+
+def shared_fork_server(dirpath: str) -> Tuple[str, str]:
+    """
+    Write :data:`FORK_SERVER` and :data:`FORK_CLIENT` to a directory, if
+    they're not there yet.
+
+    Returns:
+        filenames (tuple): Names of the server and the client files.
+    """
+    return (
+        _write_shared(dirpath, 'carcosa-forkserver', FORK_SERVER),
+        _write_shared(dirpath, 'carcosa-forkclient', FORK_CLIENT)
+        )
+
+
+class Pack:
+    """
+    Payloads of the function jobs of a client session, appended to a single
+    file instead of writing a marshal file and a runner per job.
+
+    The pack holds marshal records: the code of each function, stored once,
+    and a ``(code_offset, code_length, args, kwargs)`` record per call. The
+    index has a fixed size ``(offset, length)`` entry per call, so the
+    runner finds the record of task ``n`` with a single seek.
+    """
+    PACK_FILE = '{}.pack'
+    INDEX_FILE = '{}.idx'
+    INDEX_ENTRY = struct.Struct('<qq')
+
+    def __init__(self,
+                 name: str,
+                 local_path: str,
+                 remote_path: str) -> None:
+        """
+        Args:
+            name (str):
+                Name of the session, the files are named after it.
+            local_path (str):
+                Directory of the pack in the local filesystem.
+            remote_path (str):
+                Directory of the pack in the remote filesystem.
+        """
+        self.name = name
+        self.local_path = local_path
+        self.remote_path = remote_path
+
+        # Offset and length of the code records already written.
+        self._codes: Dict[types.CodeType, Tuple[int, int]] = dict()
+
+        pack_file = self.filepath('pack')
+        index_file = self.filepath('index')
+        self._size = path.getsize(pack_file) if path.exists(pack_file) else 0
+        self._count = (
+            path.getsize(index_file) // self.INDEX_ENTRY.size
+            if path.exists(index_file) else 0
+            )
+
+    def __len__(self) -> int:
+        return self._count
+
+    def filepath(self, f: str, remote: bool = False) -> str:
+        """
+        Path of the ``'pack'`` or the ``'index'`` file.
+        """
+        fname = (self.PACK_FILE if f == 'pack' else self.INDEX_FILE).format(
+            self.name
+            )
+        return path.join(self.remote_path if remote else self.local_path,
+                         fname)
+
+    def add(self,
+            code: types.CodeType,
+            calls: Sequence[Tuple[Sequence, Dict]]) -> int:
+        """
+        Append the payloads of some calls to a function. Nothing is written
+        if any of the calls can not be serialized.
+
+        Args:
+            code (types.CodeType):
+                Code of the function.
+            calls (list):
+                ``(args, kwargs)`` of each call.
+
+        Returns:
+            index (int):
+                Task number of the first call, the rest follow it.
+
+        Raises:
+            ValueError:
+                Marshal can not serialize the code or the arguments.
+        """
+        chunks: List[bytes] = []
+        offset = self._size
+
+        code_record = self._codes.get(code)
+        if code_record is None:
+            data = marshal.dumps(code)
+            code_record = (offset, len(data))
+            chunks.append(data)
+            offset += len(data)
+
+        index: List[bytes] = []
+        for args, kwargs in calls:
+            data = marshal.dumps(code_record + (tuple(args), dict(kwargs)))
+            index.append(self.INDEX_ENTRY.pack(offset, len(data)))
+            chunks.append(data)
+            offset += len(data)
+
+        with open(self.filepath('pack'), 'ab') as f:
+            f.write(b''.join(chunks))
+        with open(self.filepath('index'), 'ab') as f:
+            f.write(b''.join(index))
+
+        self._codes[code] = code_record
+        self._size = offset
+        first = self._count
+        self._count += len(index)
+        return first
+
+
+def ref(filepath: str) -> Tuple[str, str]:
+    """
+    Reference to the result file of a job, it can be passed as an argument of
+    a function job and it'll be replaced by the value stored in the file
+    before calling the function.
+
+    Args:
+        filepath (str):
+            Path of the marshal result file in the remote host.
+    """
+    return (REF_TAG, filepath)
+
+
 class Script(Generic[T]):
     """
     Class that manages the script paths.
+
+    A script is created for every job, so it only stores the job name and the
+    paths, the file names are derived from the job name on access. The tasks
+    of an array job share the files of their ``batch``.
     """
+    __slots__ = (
+        'name', 'local_path', 'remote_path', 'batch', '_mode', '_files'
+        )
+
+    # File name of each file of a job, from the job name.
+    FILES = {
+        'marshal': '{}.marshal',
+        'sbatch': '{}.sbatch',
+        'python': '{}.py',
+        'out': '{}.marshal.out',
+        'prof': '{}.prof',
+        'alloc': '{}.alloc',
+        'timings': '{}.timings'
+        }
+
+    # Files shared by the tasks of an array job.
+    BATCH_FILES = ('sbatch', 'timings')
+
     def __init__(self,
                  job_name: str,
                  local_path: Optional[str],
-                 remote_path: Optional[str]) -> None:
+                 remote_path: Optional[str],
+                 batch: Optional[str] = None) -> None:
         self.name = job_name
-        self.marshal_file = '{}.marshal'.format(job_name)
-        self.sbatch_file = '{}.sbatch'.format(job_name)
-        self.python_file = '{}.py'.format(job_name)
-        self.out_file = '{}.marshal.out'.format(job_name)
 
         self.local_path = local_path
         self.remote_path = remote_path
+        self.batch = batch
 
         self._mode = 'local'
+        # File names that don't follow FILES
+        self._files: Optional[Dict[str, str]] = None
+
+    def filename(self, f: str) -> str:
+        """
+        Name of a file of the job, relative to the job path.
+
+        Raises:
+            KeyError: Unknown file.
+        """
+        if self._files is not None and f in self._files:
+            return self._files[f]
+        if self.batch is not None and f in self.BATCH_FILES:
+            return self.FILES[f].format(self.batch)
+        return self.FILES[f].format(self.name)
+
+    def set_filename(self, f: str, fname: str) -> None:
+        """
+        Use a file name different from the default one.
+        """
+        if f not in self.FILES:
+            raise KeyError(f)
+        if self._files is None:
+            self._files = dict()
+        self._files[f] = fname
+
+    @property
+    def marshal_file(self) -> str:
+        return self.filename('marshal')
+
+    @property
+    def sbatch_file(self) -> str:
+        return self.filename('sbatch')
+
+    @property
+    def python_file(self) -> str:
+        return self.filename('python')
+
+    @property
+    def out_file(self) -> str:
+        return self.filename('out')
+
+    @out_file.setter
+    def out_file(self, val: str) -> None:
+        self.set_filename('out', val)
+
+    @property
+    def prof_file(self) -> str:
+        return self.filename('prof')
+
+    @property
+    def alloc_file(self) -> str:
+        return self.filename('alloc')
+
+    @property
+    def timings_file(self) -> str:
+        return self.filename('timings')
 
     @property
     def remote(self) -> 'Script[T]':
@@ -82,10 +771,7 @@ class Script(Generic[T]):
             raise ValueError(e_msg)
 
         try:
-            fname = {'marshal': self.marshal_file,
-                     'sbatch': self.sbatch_file,
-                     'python': self.python_file,
-                     'out': self.out_file}[f]
+            fname = self.filename(f)
             if self.path:
                 return path.join(self.path, fname)
             else:
@@ -144,6 +144,7 @@ setup(
     extras_require={  # Optional
         'dev': ['sphinx', 'pytest'],
         'test': ['pytest'],
+        'msgpack': ['msgpack'],
     },
 
     # To provide executable scripts, use entry points in preference to the
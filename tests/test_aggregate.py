@@ -0,0 +1,60 @@
+import pytest
+
+from carcosa.cluster.aggregate import parse_jobs, summarize, parse_aggregates
+
+T0 = '2020-05-01T10:00:{:02d}'
+SACCT_OUT = [
+    ('100', 'a_1', 'normal', 'COMPLETED', '4', '1', '', T0.format(0),
+     T0.format(10), '00:01:00'),
+    ('100.batch', 'batch', '', 'COMPLETED', '4', '1', '2048K', T0.format(10),
+     T0.format(10), '00:01:00'),
+    ('101', 'a_2', 'normal', 'FAILED', '2', '1', '', T0.format(0),
+     T0.format(30), '00:00:10'),
+    ('102', 'b', 'debug', 'CANCELLED by 1000', '1', '1', '', T0.format(0),
+     'Unknown', '00:00:00'),
+    ('JobID', 'JobName', 'bad'),
+    ]
+
+
+def test_parse_jobs():
+    jobs = parse_jobs(SACCT_OUT)
+    assert sorted(jobs) == ['100', '101', '102']
+    assert jobs['100'] == {
+        'name': 'a_1', 'partition': 'normal', 'state': 'completed',
+        'wait': 10.0, 'elapsed': 60, 'cpus': 4, 'nodes': 1,
+        'cpu_time': 240, 'max_rss': 2048 << 10
+        }
+    assert jobs['102']['state'] == 'cancelled'
+    assert jobs['102']['wait'] is None
+
+
+def test_summarize():
+    jobs = list(parse_jobs(SACCT_OUT).values())
+    rows = summarize(jobs, ['partition'],
+                     aggregates=['count', 'mean:wait', 'sum:cpu_time',
+                                 'p100:elapsed'])
+    assert rows == [
+        {'partition': 'debug', 'count': 1, 'mean:wait': None,
+         'sum:cpu_time': 0, 'p100:elapsed': 0},
+        {'partition': 'normal', 'count': 2, 'mean:wait': 20.0,
+         'sum:cpu_time': 260, 'p100:elapsed': 60},
+        ]
+
+    assert summarize(jobs) == [{'count': 3}]
+    assert summarize(jobs, ['state'], {'name': 'a_', 'states': ['FAILED']},
+                     ['max:cpus']) == [{'state': 'failed', 'max:cpus': 2}]
+    assert summarize(jobs, filters={'partitions': ['none']}) == []
+
+
+def test_invalid_summary():
+    assert parse_aggregates(['count', 'p99.5:max_rss']) == [
+        ('count', 'count', None), ('p99.5:max_rss', 'p99.5', 'max_rss')
+        ]
+    for aggregate in ('mean', 'avg:wait', 'p101:wait', 'px:wait',
+                      'sum:name'):
+        with pytest.raises(ValueError):
+            parse_aggregates([aggregate])
+    with pytest.raises(ValueError):
+        summarize([], ['user'])
+    with pytest.raises(ValueError):
+        summarize([], filters={'user': 'x'})
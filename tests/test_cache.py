@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+from carcosa.cluster.cache import ResultCache
+from carcosa.qsystems.local import LocalClient
+
+FACTOR = 3
+
+
+def scale(x):
+    return x * FACTOR
+
+
+def test_key():
+    assert ResultCache.key(scale, [1]) == ResultCache.key(scale, [1])
+    assert ResultCache.key(scale, [1]) != ResultCache.key(scale, [2])
+    assert ResultCache.key(scale, [1]) != ResultCache.key(scale, [], {'x': 1})
+
+    global FACTOR
+    k = ResultCache.key(scale, [1])
+    FACTOR = 4
+    try:
+        assert ResultCache.key(scale, [1]) != k
+    finally:
+        FACTOR = 3
+
+
+def test_cached_launch():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        cache = c.enable_cache()
+
+        j = c.new_job(lambda x: x + 1, jobname='first')
+        j.launch(args=[1])
+        j.status = 'completed'
+        assert j.retval == 2
+
+        j2 = c.new_job(j.f, jobname='second')
+        j2.launch(args=[1])
+        assert j2.finished
+        assert j2.id is None
+        assert not os.path.exists(j2.script.local.filepath('sbatch'))
+        assert j2.retval == 2
+
+        assert cache.invalidate() == 1
+        j3 = c.new_job(j.f, jobname='third')
+        j3.launch(args=[1])
+        assert j3.id is not None
+
+
+def test_evict():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResultCache(tmp, max_entries=2)
+        for i in range(4):
+            path = os.path.join(tmp, cache.relpath(str(i)))
+            with open(path, 'wb') as f:
+                f.write(b'x' * 10)
+            os.utime(path, (i, i))
+        assert cache.evict() == 2
+        assert cache.lookup('0') is None
+        assert cache.lookup('3') is not None
+
+        cache.max_entries = None
+        cache.max_bytes = 10
+        assert cache.evict() == 1
+        assert cache.lookup('3') is not None
+        os.utime(path, (0, 0))
+        cache.max_age = 60
+        assert cache.lookup('3') is None
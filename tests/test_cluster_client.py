@@ -1,6 +1,10 @@
+import tempfile
 import pytest
+import os
 
+from carcosa import scripts
 from carcosa.cluster import ClusterClient
+from carcosa.qsystems.local import LocalClient
 
 def test_no_uri():
     c = ClusterClient()
@@ -68,3 +72,106 @@ def test_not_implemented():
 
     with pytest.raises(NotImplementedError):
         c.submit('')
+
+def cube(x, offset):
+    return x ** 3 + offset
+
+def test_pack():
+    with tempfile.TemporaryDirectory() as tmp:
+        p = scripts.Pack('session', tmp, tmp)
+        assert p.add(cube.__code__, [((1,), {}), ((2,), {})]) == 0
+        assert p.add(cube.__code__, [((3,), {'offset': 1})]) == 2
+        assert len(p) == 3
+        with pytest.raises(ValueError):
+            p.add(cube.__code__, [((object(),), {})])
+        assert len(scripts.Pack('session', tmp, tmp)) == 3
+
+def test_map():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        single = c.new_job(cube, jobname='single')
+        single.launch(args=[5], kwargs={'offset': 0})
+        jobs = c.map(cube, range(4), kwargs={'offset': 1}, jobname='arr')
+        assert [j.id for j in jobs] == ['0_0', '0_1', '0_2', '0_3']
+        for j in jobs + [single]:
+            j.update()
+            assert j.status == 'complete'
+        assert [j.retval for j in jobs] == [1, 2, 9, 28]
+        assert single.retval == 125
+        assert jobs[2].timings['phases']['exit'] > 0
+
+        # A runner, a pack and an index shared by all the jobs, an sbatch
+        # and a timings file per submission and a result per call (the local
+        # server doesn't write the logs).
+        files = os.listdir(tmp)
+        assert len([f for f in files if f.startswith('carcosa-')]) == 3
+        assert len([f for f in files if f.endswith('.sbatch')]) == 2
+        assert not [f for f in files if f.endswith('.marshal')]
+        assert len(files) == 3 + 2 * 2 + 5
+
+def test_local_refresh():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        single = c.new_job(cube, jobname='single')
+        single.launch(args=[2], kwargs={'offset': 0})
+        jobs = c.map(cube, range(2), kwargs={'offset': 1}, jobname='arr')
+        assert not single.finished
+        c.refresh_states()
+        assert all(j.finished for j in jobs + [single])
+
+        # The ids are reused, the new job gets the state of its run
+        again = c.new_job('true', jobname='again')
+        again.launch()
+        assert not again.finished
+        c.refresh_states()
+        assert again.status == 'complete'
+
+
+def test_launch_job():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        j = c.new_job(cube, jobname='cube')
+        assert c.launch_job(args=[2], kwargs={'offset': 1}) == j
+        assert j.launched
+
+
+def test_serializer(monkeypatch):
+    import threading
+    import Pyro4
+    from carcosa import config
+
+    @Pyro4.expose
+    class Echo:
+        def rows(self, n):
+            return [('1', 'completed')] * n
+
+    def serve(accepted):
+        monkeypatch.setattr(Pyro4.config, 'SERIALIZERS_ACCEPTED', accepted)
+        daemon = Pyro4.Daemon()
+        uri = daemon.register(Echo())
+        threading.Thread(target=daemon.requestLoop, daemon=True).start()
+        return daemon, str(uri)
+
+    monkeypatch.setenv(config.SERIALIZER_ENV, 'pickle')
+    assert config.serializer == 'serpent'
+    monkeypatch.setenv(config.SERIALIZER_ENV, 'marshal')
+    assert config.serializer == 'marshal'
+    with pytest.raises(ValueError):
+        config.serializer = 'pickle'
+
+    daemon, uri = serve({'serpent', 'marshal'})
+    try:
+        c = ClusterClient(uri=uri)
+        assert c.server._pyroSerializer == 'marshal'
+        assert len(c.server.rows(1000)) == 1000
+    finally:
+        daemon.shutdown()
+
+    # Servers that don't accept it are used with the default serializer
+    daemon, uri = serve({'serpent'})
+    try:
+        c = ClusterClient(uri=uri)
+        assert c.server._pyroSerializer == 'serpent'
+        assert list(c.server.rows(1)[0]) == ['1', 'completed']
+    finally:
+        daemon.shutdown()
@@ -1,7 +1,10 @@
 import pytest
+import subprocess
+import socket
 import os
 
-from carcosa.cluster import ClusterServer
+from carcosa.cluster import ClusterServer, errors
+from carcosa.cluster.registry import ServerRegistry
 from carcosa import config
 
 TEST_QSYSTEM = 'test'
@@ -63,16 +66,140 @@ def test_log_file():
     assert s.log_filepath == path
 
 
-def test_get_id():
+def test_get_id(tmp_path, monkeypatch):
+    monkeypatch.setenv(config.CARCOSA_PATH_ENV, str(tmp_path))
     s = TServer()
     s._id = s._get_id()
     assert s.id == 0
+    assert s._get_id() == 1
 
-    with open(s.pid_filepath, 'w+') as f:
-        f.write('1')
+    # Ids are never reused, even if the server is gone
+    s.registry.remove(1)
+    assert s._get_id() == 2
+    assert [e['id'] for e in s.registry.servers(TEST_QSYSTEM)] == [0, 2]
+
+
+def test_registry(tmp_path):
+    reg = ServerRegistry(str(tmp_path))
+    id_ = reg.reserve(TEST_QSYSTEM)
+    assert reg.lookup(TEST_QSYSTEM) is None
+
+    reg.register(id_, os.getpid(), 'PYRO:obj@localhost:1234')
+    entry = reg.lookup(TEST_QSYSTEM)
+    assert entry['uri'] == 'PYRO:obj@localhost:1234'
+    assert entry['pid'] == os.getpid()
+    assert reg.lookup('other') is None
+
+    # A dead process is pruned
+    dead = subprocess.Popen(['true'])
+    dead.wait()
+    id2 = reg.reserve(TEST_QSYSTEM)
+    reg.register(id2, dead.pid, 'PYRO:obj@localhost:4321')
+    assert reg.lookup(TEST_QSYSTEM)['id'] == id_
+    assert [e['id'] for e in reg.servers()] == [id_]
+
+    reg.remove(id_)
+    assert reg.lookup(TEST_QSYSTEM) is None
+
+
+def test_registry_hosts(tmp_path, monkeypatch):
+    reg = ServerRegistry(str(tmp_path))
+    local = reg.reserve(TEST_QSYSTEM)
+    reg.register(local, os.getpid(), 'PYRO:obj@localhost:1234')
+
+    monkeypatch.setattr(socket, 'gethostname', lambda: 'login2')
+    foreign = reg.reserve(TEST_QSYSTEM)
+    reg.register(foreign, os.getpid(), 'PYRO:obj@login2:1234')
+    assert reg.lookup(TEST_QSYSTEM)['id'] == foreign
+    monkeypatch.undo()
+
+    # The pid of a server of another host can't be checked, it's kept but
+    # not used
+    dead = subprocess.Popen(['true'])
+    dead.wait()
+    with reg._locked() as data:
+        data['servers'][str(foreign)]['pid'] = dead.pid
+    assert reg.lookup(TEST_QSYSTEM)['id'] == local
+    assert [e['id'] for e in reg.servers()] == [local, foreign]
+    reg.remove(local)
+    assert reg.lookup(TEST_QSYSTEM) is None
+    assert [e['id'] for e in reg.servers()] == [foreign]
+
+
+def test_stats_rpc():
+    s = TServer()
+    s.ping()
+    s.ping()
+    st = s.stats()
+    assert st['rpc']['ping']['count'] == 2
+    assert st['rpc']['ping']['inflight'] == 0
+    assert st['rpc']['ping']['errors'] == 0
+    assert st['rpc']['ping']['buckets'][-1] == ('+Inf', 2)
+
+
+def test_stats_cmd():
+    s = TServer()
+    s._cmd(['true'])
+    s._cmd(['false'])
+    s._cmd(['/bin/true'])
+    st = s.stats()
+    assert st['cmd']['true']['count'] == 2
+    assert st['cmd']['true']['exit_codes'] == {'0': 2}
+    assert st['cmd']['false']['exit_codes'] == {'1': 1}
+    assert st['cmd']['true']['p99'] >= st['cmd']['true']['p50'] > 0
 
-    assert s._get_id() == 1
 
-    os.remove(s.pid_filepath)
+def test_stats_export():
+    s = TServer()
+    s._id = TEST_ID
+    s.ping()
+    s.stats(export=True)
+    with open(s.stats_filepath) as f:
+        prom = f.read()
+    os.remove(s.stats_filepath)
+    assert 'carcosa_rpc_latency_seconds_count{' in prom
+    assert 'method="ping"' in prom
+    assert 'qsystem="test"' in prom
+
 
-    assert s._get_id() == 0
+def test_remove_files(tmp_path):
+    s = TServer()
+    jobs = tmp_path / 'jobs'
+    (jobs / 'sub').mkdir(parents=True)
+    files = [jobs / 'a.out', jobs / 'sub' / 'b.out', tmp_path / 'other']
+    for f in files:
+        f.write_text('x')
+
+    assert s.remove_files([str(f) for f in files]) == 0
+    s._add_job_dir(str(jobs / 'a.sbatch'))
+    assert s.remove_files([str(f) for f in files] + [str(jobs / 'no')]) == 2
+    assert not files[0].exists() and not files[1].exists()
+    assert files[2].exists()
+    # Paths escaping the job directory are refused
+    assert s.remove_files([str(jobs / '..' / 'other')]) == 0
+
+
+def test_read_logs(tmp_path):
+    s = TServer()
+    jobs, work = tmp_path / 'jobs', tmp_path / 'work'
+    jobs.mkdir()
+    work.mkdir()
+    (jobs / 'a.sbatch').write_text(
+        '#!/bin/bash\n#SBATCH --workdir={}\n'.format(work)
+        )
+    (work / 'a.out').write_text('line 1\nline 2\n')
+    (tmp_path / 'secret').write_text('x')
+
+    with pytest.raises(errors.ClusterServerError):
+        s.tail(str(work / 'a.out'))
+    s._add_job_dir(str(jobs / 'a.sbatch'))
+    assert s.tail(str(work / 'a.out')) == ('line 1\nline 2\n', 14)
+    assert s.search_log(str(work / 'a.out'), '2') == [(7, 'line 2')]
+    assert s.tail(str(jobs / 'a.err')) == ('', 0)
+    for path in (tmp_path / 'secret', work / '..' / 'secret'):
+        with pytest.raises(errors.ClusterServerError):
+            s.tail(str(path))
+        with pytest.raises(errors.ClusterServerError):
+            s.search_log(str(path), 'x')
+    # The working directory can only be read
+    assert s.remove_files([str(work / 'a.out')]) == 0
@@ -0,0 +1,79 @@
+import subprocess
+import tempfile
+import time
+import sys
+import os
+
+from carcosa import scripts
+from carcosa.qsystems.local import LocalClient
+
+SCRIPT = """\
+import sys
+import os
+print(' '.join(sys.argv[1:]), os.environ.get('FORK_TEST'),
+      'json' in sys.modules)
+sys.exit(3)
+"""
+
+
+def square(x):
+    return x * x
+
+
+def start_server(tmp, modules):
+    server, client = scripts.shared_fork_server(tmp)
+    socket_path = os.path.join(tmp, 'fork.sock')
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(tmp, server), socket_path] + modules,
+        stdout=subprocess.DEVNULL
+        )
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+    return proc, socket_path, os.path.join(tmp, client)
+
+
+def test_fork_server():
+    with tempfile.TemporaryDirectory() as tmp:
+        proc, socket_path, client = start_server(tmp, ['json'])
+        try:
+            script = os.path.join(tmp, 'script.py')
+            with open(script, 'w') as f:
+                f.write(SCRIPT)
+
+            for path in (socket_path, os.path.join(tmp, 'none.sock')):
+                res = subprocess.run(
+                    [sys.executable, '-S', client, path, sys.executable,
+                     script, 'a', 'b'],
+                    stdout=subprocess.PIPE,
+                    env=dict(os.environ, FORK_TEST='x'),
+                    cwd=tmp
+                    )
+                assert res.returncode == 3
+                # json is only loaded in the fork server
+                forked = path == socket_path
+                assert res.stdout.decode().split() == [
+                    'a', 'b', 'x', str(forked)
+                    ]
+            assert os.stat(socket_path).st_mode & 0o777 == 0o600
+        finally:
+            proc.terminate()
+            proc.wait()
+        assert not os.path.exists(socket_path)
+
+
+def test_fork_server_jobs(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        proc, socket_path, client = start_server(tmp, [])
+        try:
+            monkeypatch.setenv('CARCOSA_FORK_SERVER', socket_path)
+            monkeypatch.setenv('CARCOSA_FORK_CLIENT', client)
+            c = LocalClient(local_path=tmp)
+            job = c.new_job(square)
+            job.launch(args=[7])
+            job.status = 'completed'
+            assert job.retval == 49
+        finally:
+            proc.terminate()
+            proc.wait()
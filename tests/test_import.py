@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+
+def loaded_modules(module):
+    """
+    Modules loaded by importing a module in a new interpreter.
+    """
+    code = 'import sys, {}; print("\\n".join(sys.modules))'.format(module)
+    out = subprocess.run(
+        [sys.executable, '-c', code],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+        ).stdout
+    return set(out.split())
+
+
+def test_lazy_imports():
+    modules = loaded_modules('carcosa.cluster')
+    assert 'Pyro4' not in modules
+    assert 'carcosa.qsystems.slurm' not in modules
+    assert 'carcosa.qsystems.local' not in modules
+
+    # The inline pool starts its processes on the first call
+    modules = loaded_modules('carcosa.qsystems.slurm')
+    assert 'concurrent.futures.process' not in modules
+    assert 'multiprocessing' not in modules
+
+    modules = loaded_modules('carcosa')
+    assert 'carcosa.cluster' not in modules
+    assert 'Pyro4' not in modules
@@ -0,0 +1,61 @@
+import pytest
+
+from carcosa.cluster.errors import ClusterServerError, InlineCallError
+from carcosa.cluster.inline import InlinePool
+from carcosa.qsystems.local import LocalClient
+
+
+def count_files(path):
+    import os
+    return len(os.listdir(path))
+
+
+def divide(a, b=1):
+    return a / b
+
+
+def spin():
+    while True:
+        pass
+
+
+def nap(seconds):
+    import time
+    time.sleep(seconds)
+
+
+def allocate(size):
+    return len(bytearray(size))
+
+
+def test_run_inline(tmp_path):
+    (tmp_path / 'a').touch()
+    c = LocalClient()
+    try:
+        assert c.run_inline(count_files, [str(tmp_path)]) == 1
+        assert c.run_inline(divide, [3], {'b': 2}) == 1.5
+        with pytest.raises(InlineCallError, match='ZeroDivisionError'):
+            c.run_inline(divide, [1, 0])
+        with pytest.raises(ValueError):
+            c.run_inline(divide, [object()])
+    finally:
+        c.server.inline.shutdown()
+
+
+def test_limits():
+    pool = InlinePool(workers=1, cpu_time=1, memory=256 << 20, timeout=5)
+    c = LocalClient()
+    c.server.inline = pool
+    try:
+        with pytest.raises(ClusterServerError):
+            c.run_inline(spin)
+        with pytest.raises(InlineCallError, match='MemoryError'):
+            c.run_inline(allocate, [512 << 20])
+        assert c.run_inline(allocate, [1 << 20]) == 1 << 20
+
+        pool.timeout = 0.5
+        with pytest.raises(ClusterServerError, match='timed out'):
+            c.run_inline(nap, [10])
+        assert c.run_inline(divide, [4, 2]) == 2
+    finally:
+        pool.shutdown()
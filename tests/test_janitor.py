@@ -0,0 +1,74 @@
+import tempfile
+import time
+import os
+
+from carcosa.cluster.janitor import Janitor, RetentionPolicy
+from carcosa.qsystems.local import LocalClient
+
+
+def inc(x):
+    return x + 1
+
+
+def test_janitor():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        jobs = c.map(inc, range(3), jobname='arr')
+        single = c.new_job(inc, jobname='single')
+        single.launch(args=[1])
+        pending = c.new_job(inc, jobname='pending')
+        pending.launch(args=[2])
+
+        for j in jobs[:2] + [single]:
+            j.status = 'completed'
+        jobs[2].status = 'running'
+        pending.status = 'pending'
+
+        janitor = Janitor(c)
+        # Shared array and session files are kept while a job is running.
+        assert janitor.run() == 1
+        assert not os.path.exists(single.script.local.filepath('sbatch'))
+        assert os.path.exists(jobs[0].script.local.filepath('sbatch'))
+        assert os.path.exists(c.pack(single.script).filepath('pack'))
+        assert single.retval == 2
+
+        # Inputs of failed jobs are kept by default
+        jobs[2].status = 'failed'
+        pending.status = 'completed'
+        assert janitor.run() == 1
+        assert os.path.exists(jobs[0].script.local.filepath('sbatch'))
+        assert os.path.exists(c.pack(single.script).filepath('pack'))
+
+        # Results are kept for a while
+        janitor.policy = RetentionPolicy(inputs=0, failed_inputs=0,
+                                         results=3600)
+        assert janitor.run() == 3
+        assert not os.path.exists(c.pack(single.script).filepath('pack'))
+        assert jobs[0].retval == 1
+
+        c.jobs.updated[single._row] -= 7200
+        assert janitor.run() == 2
+        assert not os.path.exists(single.script.local.filepath('out'))
+        assert os.path.exists(jobs[0].script.local.filepath('out'))
+
+        # Relaunched jobs are not finished, and use a new pack
+        single.launch(args=[5], force=True)
+        assert janitor.run() == 0
+        single.status = 'completed'
+        assert single.retval == 6
+
+
+def test_janitor_thread():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        j = c.new_job('true', jobname='cmd')
+        j.launch()
+        j.status = 'completed'
+        janitor = Janitor(c)
+        janitor.start(interval=0.01)
+        for _ in range(100):
+            if not os.path.exists(j.script.local.filepath('sbatch')):
+                break
+            time.sleep(0.01)
+        janitor.stop()
+        assert not os.path.exists(j.script.local.filepath('sbatch'))
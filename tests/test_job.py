@@ -35,12 +35,13 @@ class FakeClient(ClusterClient):
     def server(self):
         return self
 
-    def queue_parser(self, job_id: Optional[str] = None) -> Tuple[str, str]:
-        r = (self.ret_queue_id, self.ret_queue_status)
-        print('>>>>>>>>>>>>>>>>', r)
-        return r
+    def queue_parser(self,
+                     job_id: Optional[str] = None) -> List[Tuple[str, str]]:
+        return [(self.ret_queue_id, self.ret_queue_status)]
 
-    def submit(self, script: scripts.Script) -> str:
+    def submit(self,
+               script: scripts.Script,
+               args: Optional[List[str]] = None) -> str:
         self.submit_check = True
         return TEST_JOB_ID
 
@@ -50,7 +51,8 @@ class FakeClient(ClusterClient):
                     function: Optional[Callable[..., Any]] = None,
                     args: Optional[Tuple] = None,
                     kwargs: Optional[Dict] = None,
-                    cmd: Optional[str] = None) -> bool:
+                    cmd: Optional[str] = None,
+                    profile: bool = False) -> bool:
         self.scripts_check = True
         return True
 
@@ -187,7 +189,7 @@ def test_stderr():
 def test_retvar():
     j = get_job()
     ret_val = 'retval'
-    with open(j.script.out_file, 'wb+') as f:
+    with open(j.script.local.filepath('out'), 'wb+') as f:
         marshal.dump(ret_val, f)
 
     # Job have not finished
@@ -204,6 +206,79 @@ def test_retvar():
     # with pytest.raises(ConnectionError):
     #     j.retval
 
-    os.remove(j.script.out_file)
+    os.remove(j.script.local.filepath('out'))
     with pytest.raises(FileNotFoundError):
         j.retval
+
+
+def test_profile():
+    from carcosa.qsystems.local import LocalClient
+
+    def work(n):
+        return sum([i * i for i in range(n)])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        j = c.new_job(work, jobname=TEST_JOBNAME)
+        assert j.profile is None
+
+        j.launch(args=[1000], profile=True)
+        j.status = 'completed'
+
+        assert j.retval == work(1000)
+        stats, allocs = j.profile
+        assert any(fn[2] == 'work' for fn in stats.stats)
+        assert all(len(a) == 4 for a in allocs)
+
+
+def test_timings():
+    with tempfile.TemporaryDirectory() as tmp:
+        from carcosa.qsystems.local import LocalClient
+
+        c = LocalClient(local_path=tmp)
+        j = c.new_job(lambda x: x, jobname=TEST_JOBNAME)
+        assert j.timings is None
+        j.launch(args=[1])
+        j.status = 'completed'
+
+        t = j.timings
+        assert list(t['phases']) == [
+            'script_start', 'runner_start', 'payload_loaded',
+            'function_done', 'result_written', 'exit'
+            ]
+        d = t['durations']
+        assert all(v >= 0 for v in d.values())
+        assert d['overhead'] == d['total'] - d['run']
+
+        j = c.new_job('true', jobname='cmd')
+        j.launch()
+        j.status = 'completed'
+        assert list(j.timings['durations']) == ['total', 'overhead']
+
+
+def test_tail():
+    with tempfile.NamedTemporaryFile(mode='wb+') as f:
+        j = get_job()
+        j.outfile = f.name
+        assert j.tail() == ('', 0)
+
+        j.launched = True
+        f.write('line 1\nlínea 2\n'.encode('utf-8'))
+        f.flush()
+        data, offset = j.tail()
+        assert data == 'line 1\nlínea 2\n'
+
+        # Incomplete UTF-8 characters are left for the next read
+        f.write('ñ'.encode('utf-8')[:1])
+        f.flush()
+        assert j.tail(offset) == ('', offset)
+        f.write('ñ'.encode('utf-8')[1:] + b'end\n')
+        f.flush()
+        data, offset = j.tail(offset, max_bytes=3)
+        assert data == 'ñe'
+        assert j.tail(offset) == ('nd\n', offset + 3)
+
+        j.status = 'completed'
+        assert ''.join(j.follow()) == 'line 1\nlínea 2\nñend\n'
+        assert j.search('^l') == [(0, 'line 1'), (7, 'línea 2')]
+        assert j.search('nothing') == []
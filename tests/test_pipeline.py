@@ -0,0 +1,46 @@
+import tempfile
+import pytest
+
+from carcosa.cluster import Pipeline
+from carcosa.qsystems.local import LocalClient
+
+
+def square(x):
+    return x * x
+
+
+def add(a, b=0):
+    return a + b
+
+
+def test_pipeline():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        p = Pipeline(c)
+        a = p.add(square, args=[3], jobname='a')
+        b = p.add(square, args=[4], jobname='b')
+        s = p.add(add, args=[a], kwargs={'b': b}, jobname='s')
+        p.add('true', after=[s], jobname='d')
+
+        jobs = p.submit()
+        assert [j.launched for j in jobs] == [True] * 4
+        assert 'dependency' not in a.options
+        assert s.options['dependency'] == 'afterok:{}:{}'.format(a.id, b.id)
+        assert jobs[-1].options['dependency'] == 'afterok:{}'.format(s.id)
+
+        with open(s.script.local.filepath('sbatch')) as f:
+            assert '#SBATCH --dependency=afterok:' in f.read()
+
+        s.status = 'completed'
+        assert s.retval == 25
+
+
+def test_pipeline_foreign_job():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        other = c.new_job(square)
+        p = Pipeline(c)
+        with pytest.raises(ValueError):
+            p.add(square, args=[other])
+        with pytest.raises(TypeError):
+            p.add('echo', args=[p.add(square, args=[2])])
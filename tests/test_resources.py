@@ -0,0 +1,107 @@
+import tempfile
+
+from carcosa.cluster.resources import ResourceHistory, family, parse_memory, \
+    parse_usage
+from carcosa.qsystems.local import LocalClient
+from carcosa.qsystems.slurm import SlurmClient
+
+
+def square(x):
+    return x * x
+
+
+def row(job_id, cpus='', rss='', elapsed=''):
+    fields = [''] * 14
+    fields[0], fields[2], fields[8], fields[13] = job_id, cpus, rss, elapsed
+    return tuple(fields)
+
+
+def test_parse_usage():
+    assert parse_memory('') == 0
+    assert parse_memory('2048') == 2048
+    assert parse_memory('2K') == 2048
+    assert parse_memory('1.5G') == 3 << 29
+
+    assert family(square, 'x') == '{}.square'.format(__name__)
+    assert family('./sim', 'sim_12') == 'sim'
+    assert family('./sim', 'sim') == 'sim'
+
+    usage = parse_usage([
+        row('10_0', '4', '', '00:10:00'),
+        row('10_0.batch', '4', '300M', '00:10:00'),
+        row('10_0.extern', '4', '1M', '00:10:00'),
+        row('11', '1', '', '1-00:00:00'),
+        ('',)
+        ])
+    assert usage == {
+        '10_0': (600, 300 << 20, 4),
+        '11': (86400, 0, 1)
+        }
+
+
+def test_suggest():
+    with tempfile.TemporaryDirectory() as tmp:
+        h = ResourceHistory(path=tmp, quantile=100, headroom=1.5,
+                            min_samples=2, max_samples=3)
+        h.record({'a': [(100, 100 << 20, 2)]})
+        assert h.suggest('a') == {}
+
+        h.record({'a': [(590, 200 << 20, 2), (10, 1, 2), (20, 1, 2)]})
+        assert len(h.samples('a')) == 3
+        assert h.suggest('a') == {
+            'time': '0-00:15:00', 'memory': '300M', 'cpus_per_task': 2
+            }
+        assert h.suggest('b') == {}
+
+        # Cached until the history is modified, by this or another client
+        h.samples = None
+        assert h.suggest('a')['time'] == '0-00:15:00'
+        del h.samples
+        other = ResourceHistory(path=tmp, min_samples=1)
+        other.record({'a': [(1000, 1, 2)] * 3})
+        assert h.suggest('a')['time'] == '0-00:25:00'
+
+
+def test_right_sizing():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        c.enable_right_sizing(auto=True, quantile=100, headroom=1,
+                              min_samples=2, path=tmp)
+        jobs = c.map(square, range(3), jobname='arr')
+        for j, status in zip(jobs, ['completed', 'completed', 'failed']):
+            j.status = status
+
+        array_id = jobs[0].id.split('_')[0]
+        queried = []
+
+        def metrics(job_id=None):
+            queried.append(job_id)
+            return iter([
+                row(jobs[0].id, '1', '', '00:02:00'),
+                row(jobs[0].id + '.batch', '1', '100M', '00:02:00'),
+                row(jobs[1].id, '1', '', '00:04:00'),
+                row(jobs[1].id + '.batch', '1', '50M', '00:04:00')
+                ])
+
+        c.metrics = metrics
+        assert c.record_usage() == 2
+        assert queried == [array_id]
+        assert jobs[0].metrics == {
+            'elapsed': 120, 'max_rss': 100 << 20, 'alloc_cpus': 1
+            }
+        # Recorded jobs are not recorded again
+        assert c.record_usage() == 0
+
+        job = c.new_job(square, options={'time': '1:00:00'})
+        assert job.options['time'] == '1:00:00'
+        assert job.options['memory'] == '100M'
+        assert job.options['cpus_per_task'] == 1
+
+        c.auto_size = False
+        assert 'memory' not in c.new_job(square).options
+        assert c.suggest_options(square)['time'] == '0-00:04:00'
+
+
+def test_memory_option():
+    c = SlurmClient()
+    assert '#SBATCH --mem=4G' in c.parse_options(memory='4G').split('\n')
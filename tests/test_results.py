@@ -0,0 +1,88 @@
+import marshal
+import tempfile
+import os
+
+from carcosa import scripts
+from carcosa.cluster import Pipeline
+from carcosa.cluster.results import ResultsLog, frame
+from carcosa.qsystems.local import LocalClient
+
+
+def double(x):
+    return 2 * x
+
+
+def add(a, b):
+    return a + b
+
+
+def test_shards():
+    with tempfile.TemporaryDirectory() as tmp:
+        log = ResultsLog('s', tmp, tmp)
+        with open(log.prefix() + '.node1', 'wb') as f:
+            f.write(frame('a', marshal.dumps(1)))
+            bad = bytearray(frame('b', marshal.dumps(2)))
+            bad[-1] ^= 0xff
+            f.write(bad)
+            f.write(frame('c', marshal.dumps(3)))
+        with open(log.prefix() + '.node2', 'wb') as f:
+            f.write(frame('d', marshal.dumps(4)))
+            # A frame that is still being written
+            f.write(frame('e', marshal.dumps(5))[:-2])
+
+        assert len(log) == 3
+        assert marshal.loads(log.get('c')) == 3
+        assert log.get('b') is None
+        assert 'e' not in log
+
+        with open(log.prefix() + '.node2', 'ab') as f:
+            f.write(frame('e', marshal.dumps(5))[-2:])
+        assert marshal.loads(log.get('e')) == 5
+
+        # The last record of a key wins, e.g. of a resubmitted job
+        with open(log.prefix() + '.node1', 'ab') as f:
+            f.write(frame('c', marshal.dumps(6)))
+        assert marshal.loads(log.get('c')) == 6
+        assert dict(log.items({'a', 'e'})) == {
+            'a': marshal.dumps(1), 'e': marshal.dumps(5)
+            }
+
+
+def test_results_log():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        c.enable_results_log()
+
+        jobs = c.map(double, range(5), jobname='arr')
+        p = Pipeline(c)
+        a = p.add(double, args=[10], jobname='a')
+        s = p.add(add, args=[a, jobs[0]], jobname='s')
+        p.submit()
+        for j in c.jobs:
+            j.status = 'completed'
+
+        assert not [f for f in os.listdir(tmp) if f.endswith('.marshal.out')]
+        assert c.collect(jobs) == [0, 2, 4, 6, 8]
+        assert s.retval == 20
+        assert c.collect([a, s]) == [20, 20]
+
+
+def test_results_index(monkeypatch):
+    runner = {}
+    exec(scripts.RUNNER_HEADER.format(), runner)
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        log = c.enable_results_log()
+        jobs = c.map(double, range(3), jobname='arr')
+        assert len(log.index_files()) >= 1
+
+        key = os.path.basename(jobs[2].script.remote.filepath('out'))
+        payload = runner['read_indexed'](log.prefix(remote=True), key.encode())
+        assert marshal.loads(payload) == 4
+
+        # Without the index the shards are scanned
+        for f in log.index_files():
+            os.remove(f)
+        assert runner['read_indexed'](log.prefix(), key.encode()) is None
+        monkeypatch.setenv('CARCOSA_RESULTS', log.prefix())
+        assert marshal.loads(runner['read_results_log'](key)) == 4
@@ -0,0 +1,109 @@
+import tempfile
+import pytest
+
+from carcosa.cluster import Retrier, RetryPolicy
+from carcosa.cluster.errors import ClusterClientError, SubmitLimitError
+from carcosa.cluster.retry import parse_walltime, format_walltime
+from carcosa.qsystems.local import LocalClient
+
+
+def square(x):
+    return x * x
+
+
+def test_walltime():
+    assert parse_walltime('30') == 30 * 60
+    assert parse_walltime('30:15') == 30 * 60 + 15
+    assert parse_walltime('2:00:00') == 7200
+    assert parse_walltime('1-2') == 26 * 3600
+    assert parse_walltime('1-02:30:05') == 26 * 3600 + 30 * 60 + 5
+    assert format_walltime(26 * 3600 + 5) == '1-02:00:05'
+
+    p = RetryPolicy(max_time='03:00:00')
+    assert p.extend('01:00:00') == '0-02:00:00'
+    assert p.extend('02:00:00') == '0-03:00:00'
+    assert p.extend('03:00:00') is None
+    assert p.delay(0) == 60 and p.delay(2) == 240
+    with pytest.raises(ValueError):
+        RetryPolicy(actions={'failed': 'maybe'})
+
+
+def test_retrier():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        jobs = c.map(square, range(4), options={'time': '10'}, jobname='arr')
+        pack_size = len(c.pack(jobs[0].script))
+
+        retrier = Retrier(c, RetryPolicy(max_retries=1, backoff=0))
+        for j, status in zip(jobs, ['node_fail', 'timeout', 'failed',
+                                    'completed']):
+            j.status = status
+        assert retrier.check() == 2
+
+        # Only the failed tasks were resubmitted, with the same payload
+        assert len(c.pack(jobs[0].script)) == pack_size
+        assert [j.status for j in jobs[:2]] == [jobs[0].INIT_STATUS] * 2
+        assert jobs[2].status == 'failed'
+        assert jobs[1].options['time'] == '0-00:20:00'
+        assert jobs[0].options['time'] == '10'
+
+        for j in jobs[:2]:
+            j.status = 'completed'
+            assert j.retval == j._row ** 2
+
+        # No more retries left
+        jobs[0].status = 'node_fail'
+        assert retrier.check() == 0
+
+
+def test_backoff():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        j = c.new_job('true', jobname='cmd')
+        j.launch()
+        j.status = 'preempted'
+        retrier = Retrier(c, RetryPolicy(backoff=3600))
+        assert retrier.check() == 0
+        assert retrier.check() == 0
+        j._extra()['retry_at'] = 0
+        assert retrier.check() == 1
+        assert j.id == '0'
+
+
+def test_failed_resubmit():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        j = c.new_job('true', jobname='cmd', options={'time': '10'})
+        j.launch()
+        j.status = 'timeout'
+        retrier = Retrier(c, RetryPolicy(backoff=0))
+
+        # The job and its retry are left as they were
+        submit = c._server.submit
+        c._server.submit = lambda *args: None
+        with pytest.raises(ClusterClientError):
+            retrier.check()
+        assert j.status == 'timeout' and j.id == '0'
+        assert j.options['time'] == '10'
+        assert j._extra()['attempts'] == 0
+
+        def limited(*args):
+            raise SubmitLimitError('QOSMaxSubmitJobPerUserLimit')
+        c._server.submit = limited
+        with pytest.raises(SubmitLimitError):
+            retrier.check()
+        assert j.status == 'timeout' and j._extra()['attempts'] == 0
+
+        # Held by the throttle until there are tokens
+        c._server.submit = submit
+        throttle = c.enable_throttle(rate=0.001, burst=1)
+        throttle._tokens = 0
+        assert retrier.check() == 1
+        assert j.backlogged and j.status == 'timeout'
+        assert retrier.check() == 0
+        assert j._extra()['attempts'] == 1
+
+        throttle._tokens = 1
+        assert throttle.pump() == 1
+        assert not j.backlogged and j.id == '0'
+        assert j.options['time'] == '0-00:20:00'
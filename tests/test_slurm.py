@@ -0,0 +1,340 @@
+import subprocess
+import tempfile
+import time as slurm_time
+import pytest
+import Pyro4
+
+from carcosa.cluster import errors
+from carcosa.cluster.events import EventLog
+from carcosa.qsystems import slurm
+from carcosa.qsystems.slurm import SlurmServer, SlurmClient
+
+SQUEUE_OUT = """\
+100|PENDING|sweep42_a
+101|PENDING|sweep42_b
+102|RUNNING|sweep42_c
+103|PENDING|other
+"""
+
+
+class FakeSlurmServer(SlurmServer):
+    def __init__(self, outputs=None, codes=None, errors=None):
+        super().__init__()
+        self.calls = []
+        self.outputs = outputs or {}
+        self.codes = codes or {}
+        self.errors = errors or {}
+
+    def _cmd(self, args):
+        self.calls.append(list(args))
+        return subprocess.CompletedProcess(
+            args,
+            self.codes.get(args[0], 0),
+            stdout=self.outputs.get(args[0], ''),
+            stderr=self.errors.get(args[0], '')
+            )
+
+
+def test_kill():
+    s = FakeSlurmServer()
+    ids = [1, '2']
+    assert s.kill(ids)
+    assert ids == [1, '2']
+    assert s.calls == [[slurm.SCANCEL, '1', '2']]
+
+
+def test_cancel_filter():
+    s = FakeSlurmServer(outputs={slurm.SQUEUE: SQUEUE_OUT})
+    res = s.cancel({'name': 'sweep42', 'states': ['pending']})
+    assert res == {'matched': 2, 'cancelled': 2, 'failed': 0}
+    assert s.calls[-1] == [slurm.SCANCEL, '100', '101']
+
+    res = s.cancel({'ids': [103, 102]})
+    assert res['matched'] == 2
+    assert s.calls[-1] == [slurm.SCANCEL, '102', '103']
+    assert s.stats()['rpc']['cancel']['count'] == 2
+
+
+def test_cancel_chunks(monkeypatch):
+    monkeypatch.setattr(slurm, 'CANCEL_CHUNK', 3)
+    out = '\n'.join('{}|PENDING|j'.format(i) for i in range(7))
+    s = FakeSlurmServer(
+        outputs={slurm.SQUEUE: out},
+        codes={slurm.SCANCEL: 1}
+        )
+    res = s.cancel({})
+    assert res == {'matched': 7, 'cancelled': 0, 'failed': 7}
+    assert [len(c) - 1 for c in s.calls[1:]] == [3, 3, 1]
+
+
+def test_submit_limit():
+    s = FakeSlurmServer(
+        outputs={slurm.SQUEUE: '100\n101_1\n101_2\n'},
+        codes={slurm.SBATCH: 1},
+        errors={slurm.SBATCH: (
+            'sbatch: error: QOSMaxSubmitJobPerUserLimit\n'
+            'sbatch: error: Batch job submission failed: Job violates '
+            'accounting/QOS policy (job submit limit, user\'s size and/or '
+            'time limits)\n'
+            )}
+        )
+    with pytest.raises(errors.SubmitLimitError):
+        s.submit('job.sbatch')
+    assert s.queue_count() == 3
+
+    s.errors = {slurm.SBATCH: 'sbatch: error: invalid partition'}
+    assert s.submit('job.sbatch') is None
+
+
+class FakeProcess:
+    def __init__(self, code=None):
+        self.code = code
+
+    def poll(self):
+        return self.code
+
+    def terminate(self):
+        self.code = -15
+
+
+class StepServer(FakeSlurmServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.spawned = []
+
+    def _spawn(self, args):
+        self.spawned.append(list(args))
+        return FakeProcess(1 if 'bad' in args[-1] else None)
+
+
+def test_steps():
+    sacct = (
+        '200|carcosa-allocation|RUNNING\n'
+        '200.batch|batch|RUNNING\n'
+        '200.0|a|COMPLETED\n'
+        '200.1|b|RUNNING\n'
+        )
+    s = StepServer(outputs={slurm.SBATCH: '200\n', slurm.SACCT: sacct})
+    assert s.allocate(['--nodes=2']) == '200'
+    assert s.calls[-1][-2:] == ['--nodes=2', '--wrap=sleep infinity']
+
+    for name in ('a', 'b', 'c', 'd'):
+        s.run_step('200', name + '.sbatch', name)
+    s.run_step('200', 'bad.sbatch', 'e')
+    assert s.spawned[0] == [
+        slurm.SRUN, '--jobid=200', '--exact', '--nodes=1', '--ntasks=1',
+        '--job-name=a', 'bash', 'a.sbatch'
+        ]
+    with pytest.raises(errors.ClusterServerError):
+        s.run_step('200', 'a.sbatch', 'a')
+    with pytest.raises(errors.ClusterServerError):
+        s.run_step('201', 'a.sbatch', 'x')
+
+    assert sorted(s.steps('200')) == [
+        ('a', '200.0', 'completed'),
+        ('b', '200.1', 'running'),
+        ('c', '', 'pending'),
+        ('d', '', 'pending'),
+        ('e', '', 'failed')
+        ]
+
+    assert s.release('200')
+    assert s.calls[-1] == [slurm.SCANCEL, '200']
+    assert s._steps == {}
+
+
+def test_client_steps():
+    sacct = '300.0|step|COMPLETED\n'
+    server = StepServer(outputs={slurm.SBATCH: '300\n', slurm.SACCT: sacct})
+    with tempfile.TemporaryDirectory() as tmp:
+        c = SlurmClient(local_path=tmp)
+        c._server = server
+
+        allocation = c.allocate({'time': '1:00:00', 'nodes': 2})
+        assert allocation == '300'
+        assert '--time=1:00:00' in server.calls[-1]
+        assert '--nodes=2' in server.calls[-1]
+
+        job = c.new_job('echo hi', options={'cpus_per_task': 4,
+                                            'queue': 'debug'},
+                        jobname='step')
+        other = c.new_job('echo bye', jobname='other')
+        job.launch(allocation=allocation)
+        other.launch(allocation=allocation)
+        args = server.spawned[0]
+        assert '--cpus-per-task=4' in args
+        assert '--output={}/step.out'.format(tmp) in args
+        assert not [a for a in args if a.startswith('--qos')]
+        assert job.launched and job.status == 'pending'
+
+        c.update_steps(allocation)
+        assert job.status == 'completed'
+        assert job._extra()['step'] == '300.0'
+        assert other.status == 'pending'
+
+
+def test_fork_server_allocation():
+    server = StepServer(outputs={slurm.SBATCH: '400\n'})
+    with tempfile.TemporaryDirectory() as tmp:
+        c = SlurmClient(local_path=tmp)
+        c._server = server
+
+        allocation = c.allocate({'nodes': 2}, preload=['numpy', 'pandas'])
+        wrap = server.calls[-1][-1]
+        assert wrap.startswith('--wrap=srun --overlap --ntasks-per-node=1 ')
+        assert wrap.endswith(
+            '/tmp/carcosa-fork-$SLURM_JOB_ID.sock numpy pandas'
+            )
+
+        job = c.new_job('true')
+        job.launch(allocation=allocation)
+        export = server.spawned[-1][-3]
+        assert export.startswith(
+            '--export=ALL,CARCOSA_FORK_SERVER=/tmp/carcosa-fork-400.sock,'
+            'CARCOSA_FORK_CLIENT={}/carcosa-forkclient-'.format(tmp)
+            )
+
+
+def test_changes_since():
+    sacct = '99|COMPLETED|old\n100|PENDING|sweep42_a\n104.0|RUNNING|step\n'
+    s = FakeSlurmServer(outputs={slurm.SQUEUE: SQUEUE_OUT,
+                                 slurm.SACCT: sacct})
+    s.events_refresh = 0
+    feed = s.changes_since()
+    assert not feed['reset']
+    # The orphan step is collapsed into its job
+    assert [c[1:] for c in feed['changes']] == [
+        ('99', 'completed'), ('100', 'pending'), ('104', 'running'),
+        ('101', 'pending'), ('102', 'running'), ('103', 'pending')
+        ]
+
+    s.outputs[slurm.SQUEUE] = '101|RUNNING|sweep42_b\n'
+    s.outputs[slurm.SACCT] = sacct + '100|CANCELLED by 1000|sweep42_a\n'
+    changes = s.changes_since(feed['seq'])['changes']
+    assert [c[1:] for c in changes] == [
+        ('100', 'cancelled'), ('101', 'running')
+        ]
+    changes = s.changes_since(0, {'states': ['running']})['changes']
+    assert [c[1] for c in changes] == ['104', '102', '101']
+
+    # A cursor older than the kept events gets the current states
+    s.events._events.clear()
+    feed = s.changes_since(1, {'name': 'sweep42'})
+    assert feed['reset']
+    assert sorted(c[1:] for c in feed['changes']) == [
+        ('100', 'cancelled'), ('101', 'running'), ('102', 'running')
+        ]
+
+    # A cursor ahead of the log is from before a restart of the server
+    feed = s.changes_since(feed['seq'] + 100, {'ids': ['101']})
+    assert feed['reset']
+    assert feed['changes'] == [(feed['seq'], '101', 'running')]
+
+
+def test_event_log_prune():
+    log = EventLog(max_events=2)
+    log.observe({'1': ('COMPLETED', 'a'), '2': ('RUNNING', 'b')})
+    # Finished jobs are kept while they are listed or their events are kept
+    log.observe({'1': ('COMPLETED', 'a'), '3': ('PENDING', 'c')})
+    assert sorted(log._states) == ['1', '2', '3']
+    log.observe({'2': ('FAILED', 'b'), '3': ('PENDING', 'c')})
+    assert sorted(log._states) == ['2', '3']
+    log.observe({})
+    assert sorted(log._states) == ['2', '3']
+
+
+def test_poll_changes():
+    s = FakeSlurmServer(outputs={slurm.SQUEUE: SQUEUE_OUT})
+    s.events_refresh = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        c = SlurmClient(local_path=tmp)
+        c._server = s
+        jobs = [c.new_job('echo {}'.format(i)) for i in range(3)]
+        for job, jid in zip(jobs, ('101', '102', '200')):
+            job.id = jid
+            job.status = 'submitted'
+        assert c.poll_changes() == 2
+        assert [j.status for j in jobs] == ['pending', 'running', 'submitted']
+
+        s.outputs[slurm.SQUEUE] = '102|COMPLETED|sweep42_c\n'
+        assert c.poll_changes() == 1
+        assert jobs[1].status == 'completed'
+        assert c.poll_changes() == 0
+
+
+def test_state_cache(monkeypatch):
+    s = FakeSlurmServer(outputs={slurm.SQUEUE: '101|PENDING|a\n'})
+    s.events_refresh = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        c = SlurmClient(local_path=tmp)
+        c._server = s
+        jobs = [c.new_job('echo {}'.format(i)) for i in range(2)]
+        for job, jid in zip(jobs, ('101', '102')):
+            job.id = jid
+            job.launched = True
+            job.status = 'submitted'
+
+        # Disabled by default
+        assert jobs[0].status == 'submitted'
+        assert not s.calls
+
+        c.enable_state_cache(60)
+        now = [jobs[0].checked + 61]
+        monkeypatch.setattr(slurm_time, 'time', lambda: now[0])
+        assert jobs[0].status == 'pending'
+        # Both jobs were refreshed with a single query
+        assert len([a for a in s.calls if a[0] == slurm.SQUEUE]) == 1
+        assert jobs[1].status == 'submitted'
+        assert not jobs[1].finished
+        assert len([a for a in s.calls if a[0] == slurm.SQUEUE]) == 1
+
+        s.outputs[slurm.SQUEUE] = '102|COMPLETED|b\n'
+        jobs[1].max_staleness = 10
+        now[0] += 11
+        assert jobs[1].finished
+        assert jobs[0].status == 'pending'
+        assert len([a for a in s.calls if a[0] == slurm.SQUEUE]) == 2
+
+
+def test_queue_parser():
+    sacct = 'JobID|State|JobName\n105|RUNNING|a\n105.batch|RUNNING|batch\n'
+    s = FakeSlurmServer(outputs={slurm.SQUEUE: '105|COMPLETING|a\n',
+                                 slurm.SACCT: sacct})
+    assert s.queue_parser(job_id='105') == [('105', 'completing')]
+    assert all('--jobs=105' in args for args in s.calls)
+
+    s.outputs[slurm.SQUEUE] = ''
+    s.codes[slurm.SQUEUE] = 1
+    assert s.queue_parser(job_id='105') == [('105', 'running')]
+
+    # The snapshot is not a method of the daemon
+    exposed = Pyro4.util.get_exposed_members(SlurmServer)['methods']
+    assert 'queue_parser' in exposed and '_snapshot' not in exposed
+
+
+def test_metrics_summary():
+    sacct = '100|a|normal|COMPLETED|4|1||{0}|{0}|00:01:00\n'.format(
+        '2020-05-01T10:00:00'
+        )
+    s = FakeSlurmServer(outputs={slurm.SACCT: sacct})
+    rows = s.metrics_summary(['partition'],
+                             aggregates=['count', 'sum:elapsed'],
+                             since='now-7days')
+    assert rows == [{'partition': 'normal', 'count': 1, 'sum:elapsed': 60}]
+    assert '--starttime=now-7days' in s.calls[-1]
+
+    s.codes[slurm.SACCT] = 1
+    with pytest.raises(errors.ClusterServerError):
+        s.metrics_summary()
+
+
+def test_metrics():
+    s = FakeSlurmServer(outputs={slurm.SACCT: '1|normal\n1.batch|\n'})
+    assert s.metrics(job_id=1) == [('1', 'normal'), ('1.batch', '')]
+    assert s.calls[-1][-1] == '--jobs=1'
+
+    s.codes[slurm.SACCT] = 1
+    with pytest.raises(errors.ClusterServerError):
+        s.metrics()
+    rpc = s.stats()['rpc']['metrics']
+    assert rpc['count'] == 2 and rpc['errors'] == 1
@@ -0,0 +1,62 @@
+import pytest
+
+from carcosa.cluster.snapshot import QueueSnapshot, parent_id
+
+SACCT_OUT = """\
+JobID|State|JobName
+100|COMPLETED|sweep_a
+100.batch|COMPLETED|batch
+100.extern|COMPLETED|extern
+101|RUNNING|sweep_b
+101.0|RUNNING|step
+102.0|FAILED|orphan
+103|CANCELLED by 1000|other
+"""
+
+SQUEUE_OUT = """\
+101|COMPLETING|sweep_b
+104_[1-3]|PENDING|array
+104_4|RUNNING|array
+"""
+
+
+def test_parent_id():
+    assert parent_id('123') == '123'
+    assert parent_id('123.batch') == '123'
+    assert parent_id('123_4.0') == '123_4'
+
+
+def test_merge():
+    s = QueueSnapshot().merge(SACCT_OUT).merge(SQUEUE_OUT)
+    assert s.jobs == {
+        '100': ('completed', 'sweep_a'),
+        '101': ('completing', 'sweep_b'),
+        '102': ('failed', 'orphan'),
+        '103': ('cancelled', 'other'),
+        '104_4': ('running', 'array'),
+        }
+    assert s.state('101') == 'completing'
+    assert s.state('999') is None
+    assert '104_4' in s and '104_[1-3]' not in s
+    assert s.with_state('COMPLETED') == {'100'}
+    assert s.with_state('running') == {'104_4'}
+    assert s.with_name('sweep_b') == {'101'}
+
+    # Steps don't replace their job
+    s.add('100.0', 'FAILED', 'step')
+    assert s.state('100') == 'completed'
+    # And jobs replace the steps
+    s.add('102', 'COMPLETED', 'orphan')
+    assert s.with_state('failed') == set()
+
+
+def test_select():
+    s = QueueSnapshot().merge(SACCT_OUT).merge(SQUEUE_OUT, array_parents=True)
+    assert s.select() == ['100', '101', '102', '103', '104_[1-3]', '104_4']
+    assert s.select({'states': ['pending', 'completed']}) == [
+        '100', '104_[1-3]'
+        ]
+    assert s.select({'ids': [101, '999'], 'name': 'sweep'}) == ['101']
+    assert s.select({'name': 'sweep', 'states': ['running']}) == []
+    with pytest.raises(ValueError):
+        s.select({'user': 'x'})
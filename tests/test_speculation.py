@@ -0,0 +1,56 @@
+import tempfile
+import json
+import os
+
+from carcosa.cluster import Speculator
+from carcosa.qsystems.local import LocalClient
+
+
+def square(x):
+    return x * x
+
+
+def test_speculator():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        jobs = c.map(square, range(4), jobname='arr')
+        for j in jobs[:3]:
+            j.status = 'completed'
+
+        # Task 3 started an hour ago and is still running
+        straggler = jobs[3]
+        straggler.status = 'running'
+        os.remove(straggler.script.local.filepath('out'))
+        timings_file = straggler.script.local.filepath('timings')
+        with open(timings_file) as f:
+            lines = [json.loads(line) for line in f]
+        with open(timings_file, 'w') as f:
+            for p in lines:
+                if p['task'] == 3:
+                    if p['phase'] != 'script_start':
+                        continue
+                    p['realtime'] -= 3600 * 10 ** 9
+                f.write(json.dumps(p) + '\n')
+
+        # No room in the throttle for the copy
+        throttle = c.enable_throttle(rate=0.001, burst=1)
+        throttle._tokens = 0
+        s = Speculator(c, jobs)
+        assert s.check() == 0
+        throttle._tokens = 1
+        assert s.check() == 1
+        assert s.duplicates == {straggler._row: ['0_3']}
+        # The copy finished, the original is cancelled
+        assert s.check() == 0
+        assert straggler.finished
+        assert straggler.retval == 9
+        # The cancellation of the original is not applied
+        c.changes_since = lambda seq: {
+            'seq': 1, 'reset': False,
+            'changes': [(1, straggler.id, 'cancelled')]
+            }
+        assert c.poll_changes() == 0
+        assert straggler.status == 'completed'
+
+        # Not enough tasks done to speculate
+        assert Speculator(c, jobs, min_done=1.1).check() == 0
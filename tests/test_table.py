@@ -0,0 +1,77 @@
+from carcosa.cluster import ClusterClient
+from carcosa.cluster.table import parse_job_id, format_job_id
+
+LOCAL_PATH = '/tmp'
+
+
+def get_client(n=0):
+    c = ClusterClient(local_path=LOCAL_PATH)
+    for i in range(n):
+        c.new_job('echo {}'.format(i), jobname='job{}'.format(i))
+    return c
+
+
+def test_job_ids():
+    assert parse_job_id('123') == (123, -1)
+    assert parse_job_id('123_4') == (123, 4)
+    assert format_job_id(123, -1) == '123'
+    assert format_job_id(123, 4) == '123_4'
+    assert format_job_id(-1, -1) is None
+
+
+def test_views():
+    c = get_client(3)
+    assert len(c.jobs) == 3
+    j = c.jobs[1]
+    assert j == c.jobs[1]
+    assert j != c.jobs[0]
+    assert j in c.jobs
+    assert j not in get_client(3).jobs
+    assert [x.script.name for x in c.jobs] == ['job0', 'job1', 'job2']
+    assert [x.script.name for x in c.jobs[-2:]] == ['job1', 'job2']
+
+    # All the views of a job share its state
+    j.id = '42_1'
+    j.status = 'RUNNING'
+    j.launched = True
+    k = c.jobs[1]
+    assert k.id == '42_1'
+    assert k.status == 'running'
+    assert k.running and k.launched and not k.finished
+    assert not c.jobs[0].launched
+
+    # Options are not shared between jobs
+    assert c.jobs[0].options is not k.options
+
+
+def test_states():
+    c = get_client(6)
+    for j, st in zip(c.jobs, ['pending', 'running', 'completed',
+                              'CANCELLED by 1000', 'failed', 'weird']):
+        j.status = st
+
+    assert c.jobs[3].status == 'cancelled'
+    assert c.jobs[5].status == 'unknown'
+    assert c.jobs.count('running') == 1
+    assert c.jobs.counts() == {
+        'pending': 1, 'running': 1, 'completed': 1, 'cancelled': 1,
+        'failed': 1, 'unknown': 1
+        }
+    assert [j.script.name for j in c.jobs.unfinished()] == \
+        ['job0', 'job1', 'job5']
+    assert [j.script.name for j in c.jobs.select(['failed', 'pending'])] == \
+        ['job0', 'job4']
+
+
+def test_find():
+    c = get_client(3)
+    c.jobs[0].id = '42_1'
+    c.jobs[1].id = '43'
+    assert c.jobs.find('42_1') == 0
+    assert c.jobs.find('43') == 1
+    assert c.jobs.find('42') is None
+    assert c.jobs.find('not-an-id') is None
+
+    c.jobs[1].id = '44'
+    assert c.jobs.find('43') is None
+    assert c.jobs.find('44') == 1
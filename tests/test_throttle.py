@@ -0,0 +1,92 @@
+import tempfile
+import time
+
+from carcosa.cluster import Pipeline
+from carcosa.cluster.errors import SubmitLimitError
+from carcosa.qsystems.local import LocalClient, LocalServer
+
+
+def ident(x):
+    return x
+
+
+class LimitedServer(LocalServer):
+    """
+    Queue that refuses submissions over a limit, jobs never finish.
+    """
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.queued = 0
+        self.submitted = 0
+
+    def submit(self, script_path):
+        tasks = self._array_tasks(script_path)
+        n = len(tasks) if tasks else 1
+        if self.queued + n > self.limit:
+            raise SubmitLimitError('QOSMaxSubmitJobPerUserLimit')
+        self.queued += n
+        self.submitted += 1
+        return str(self.submitted)
+
+    def queue_count(self):
+        return self.queued
+
+
+def test_throttle_limit():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        server = c._server = LimitedServer(limit=3)
+        throttle = c.enable_throttle(rate=1000, burst=100, refresh=0)
+
+        jobs = [c.new_job('true', jobname='j{}'.format(i)) for i in range(5)]
+        for j in jobs:
+            j.launch()
+        assert [j.launched for j in jobs] == [True] * 3 + [False] * 2
+        assert [j.backlogged for j in jobs] == [False] * 3 + [True] * 2
+        assert throttle.max_queued == 3
+        assert jobs[3].id is None
+
+        # Launching a held job again doesn't submit it twice
+        jobs[3].launch()
+        assert len(throttle.backlog) == 2
+
+        server.queued = 1
+        assert throttle.pump() == 2
+        assert [j.id for j in jobs] == ['1', '2', '3', '4', '5']
+        assert not throttle.backlog
+
+        # Arrays take a slot per task
+        server.queued = 0
+        tasks = c.map(ident, range(4), jobname='arr')
+        assert all(t.backlogged for t in tasks)
+        server.limit = throttle.max_queued = 10
+        throttle.pump()
+        assert [t.id for t in tasks] == ['6_0', '6_1', '6_2', '6_3']
+
+
+def test_throttle_rate():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = LocalClient(local_path=tmp)
+        c._server = LimitedServer(limit=100)
+        throttle = c.enable_throttle(rate=0.001, burst=1)
+
+        p = Pipeline(c)
+        a = p.add('true', jobname='a')
+        b = p.add('true', jobname='b')
+        d = p.add('true', after=[b], jobname='d')
+        e = p.add('true', jobname='e')
+        p.submit()
+        assert a.launched
+        assert b.backlogged
+        # Stages after a held dependency are not launched
+        assert not d.launched and not d.backlogged
+        assert not e.launched and not e.backlogged
+
+        throttle.rate = 1000
+        throttle.burst = 10
+        time.sleep(0.02)
+        throttle.pump()
+        p.submit()
+        assert d.options['dependency'] == 'afterok:{}'.format(b.id)
+        assert d.launched and e.launched